@@ -91,6 +91,46 @@ CACHES = {
     }
 }
 
+# Use the PostGIS geography column (see gis_store.0013) for spatial filters
+# when the database has it. Turn off to always use the in-memory store index.
+SPATIAL_POSTGIS = os.getenv('SPATIAL_POSTGIS', 'true').lower() in ('1', 'true', 'yes', 'on')
+
+# Shared on-disk cache for /tools/tiles/<z>/<x>/<y>.pbf store tiles.
+SPATIAL_TILE_CACHE_DIR = Path(os.getenv('SPATIAL_TILE_CACHE_DIR', BASE_DIR / 'cache' / 'tiles'))
+
+# District boundary polygons (GeoJSON FeatureCollection) for point-in-district
+# lookups. When the file is missing, district filters match quan_huyen text.
+SPATIAL_DISTRICTS_GEOJSON = Path(os.getenv('SPATIAL_DISTRICTS_GEOJSON', BASE_DIR / 'data' / 'hcm_districts.geojson'))
+
+# Optional HCM street/ward gazetteer (CSV: name,lat,lon[,ward,district]) for
+# the local geocoder, which also indexes store addresses.
+SPATIAL_GAZETTEER_PATH = Path(os.getenv('SPATIAL_GAZETTEER_PATH', BASE_DIR / 'data' / 'hcm_gazetteer.csv'))
+
+# Outbound provider rate limits (services/rate_limit.py) are shared through
+# Redis when a URL is given, otherwise through a SQLite file on this host.
+SPATIAL_RATE_LIMIT_REDIS_URL = os.getenv('SPATIAL_RATE_LIMIT_REDIS_URL', '')
+SPATIAL_RATE_LIMIT_DB = Path(os.getenv('SPATIAL_RATE_LIMIT_DB', BASE_DIR / 'cache' / 'ratelimit.sqlite3'))
+
+# Pooled keep-alive sessions for outbound provider calls (services/http_pool.py).
+SPATIAL_HTTP_POOL_SIZE = int(os.getenv('SPATIAL_HTTP_POOL_SIZE', '10'))
+SPATIAL_HTTP_RETRIES = int(os.getenv('SPATIAL_HTTP_RETRIES', '2'))
+SPATIAL_HTTP_BACKOFF = float(os.getenv('SPATIAL_HTTP_BACKOFF', '0.3'))
+SPATIAL_HTTP_DEADLINE = float(os.getenv('SPATIAL_HTTP_DEADLINE', '15'))
+
+# /tools/reverse-geo/ reuses an earlier answer for a point this close (km).
+SPATIAL_REVERSE_NEAR_KM = float(os.getenv('SPATIAL_REVERSE_NEAR_KM', '0.05'))
+
+# Rows kept in the persistent store-route cache before the least recently
+# used ones are evicted (services/route_store.py).
+SPATIAL_ROUTE_CACHE_MAX_ROWS = int(os.getenv('SPATIAL_ROUTE_CACHE_MAX_ROWS', '50000'))
+
+# Offline router (services/routing_service.py): OSM road ways as GeoJSON with
+# their tags as properties. SPATIAL_ROUTING_ENGINE is "osrm" (public server
+# only), "local" (offline router first) or "fallback" (offline router when
+# OSRM fails).
+SPATIAL_ROAD_GRAPH_PATH = Path(os.getenv('SPATIAL_ROAD_GRAPH_PATH', BASE_DIR / 'data' / 'hcm_roads.geojson'))
+SPATIAL_ROUTING_ENGINE = os.getenv('SPATIAL_ROUTING_ENGINE', 'fallback')
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -3,3 +3,10 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 application = get_wsgi_application()
+
+# Build the offline road graphs in the background so no request waits for them.
+from django.conf import settings  # noqa: E402
+from modules.spatial.services.routing_service import local_router  # noqa: E402
+
+if settings.SPATIAL_ROUTING_ENGINE != 'osrm':
+    local_router.warm()
@@ -1,3 +1,5 @@
+-- Migration gis_store.0013 adds the CuaHang.geog geography column and its
+-- GiST index only when this extension is installed at migrate time.
 CREATE EXTENSION IF NOT EXISTS postgis;
 SELECT PostGIS_Version();
 select * from auth_user
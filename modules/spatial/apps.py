@@ -4,3 +4,6 @@
 class SpatialConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'modules.spatial'
+
+    def ready(self):
+        from . import signals  # noqa: F401
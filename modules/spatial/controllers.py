@@ -1,19 +1,45 @@
-﻿import math
+﻿import base64
+import math
 import re
 import time
 import json
 import unicodedata
 import hashlib
-import requests
-from functools import wraps
-
-from django.http import JsonResponse
-from django.db.models import Q
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import NamedTuple
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import F, Q
 from django.core.cache import cache
+from django.db import connections
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 
+import numpy as np
+
 from modules.store.models import CuaHang
+from modules.spatial.services import (
+    circuit, geocode_store, postgis, rate_limit, route_store, singleflight, tile_cache, visit_planner,
+)
+from modules.spatial.services.geocoding_service import fan_out, local_geocoder, request_nominatim, request_photon
+from modules.spatial.services.reverse_index import reverse_index
+from modules.spatial.services.routing_service import local_router, request_osrm
+from modules.spatial.services.district_index import district_index
+from modules.spatial.services.store_index import store_generation, store_index
+from modules.spatial.utils import geohash, polyline
+from modules.spatial.utils.geo import bbox_deltas, haversine_km, haversine_km_many, tile_bounds
+from modules.spatial.utils.mvt import EXTENT as MVT_EXTENT, encode_point_layer
+from modules.spatial.utils.text import (
+    norm_text as _norm_text,
+    score_geocode_candidate as _score_geocode_candidate,
+)
+
+logger = logging.getLogger(__name__)
 
 
 # =========================
@@ -29,15 +55,42 @@ VN_COUNTRY_CODE = "vn"
 
 CACHE_TTL = 60 * 60 * 6
 CACHE_TTL_SHORT = 60 * 10
+CACHE_STALE_MAX_SEC = 60 * 60  # longest an expired entry is served while it is refreshed
 
 CONTACT_EMAIL = "student@example.com"
 NOMINATIM_TIMEOUT = 12
 OSRM_TIMEOUT = 12
+ROUTING_ENGINE = "fallback"  # settings.SPATIAL_ROUTING_ENGINE: "osrm", "local" or "fallback"
+ROUTE_MODES = ("full", "summary", "polyline", "simplified")
+ROUTE_SIMPLIFY_PX = 1.0  # simplified geometry may deviate this many pixels at the requested zoom
+ROUTE_DEFAULT_ZOOM = 15
+ROUTE_ORIGIN_GEOHASH_PRECISION = 7  # store routes start from the centre of this ~150 m origin cell
+
+PROVIDER_QUEUE_DEADLINE_SEC = 3  # longest wait for a provider's rate limit (see services.rate_limit)
 
-_LAST_NOMINATIM_TS_KEY = "nominatim:last_ts"
-_NOMINATIM_MIN_INTERVAL_SEC = 0.35
+GEOCODE_MIN_SCORE = 0.18  # a candidate at or above this is accepted
+GEOCODE_MAX_VARIANTS = 5  # query variants sent to each provider
 
 MAX_STORES_RETURN = 2000
+RADIUS_BUCKET_KM = 0.1  # radius cache entries are shared by radii rounded up to this
+REVERSE_GEOHASH_PRECISION = 8  # ~38 x 19 m cells for reverse-geocode cache keys
+REVERSE_NEAR_KM = 0.05  # reuse a resolved point this close (settings.SPATIAL_REVERSE_NEAR_KM)
+REVERSE_FALLBACK_STORE_KM = 2.0  # nearest store used to describe a point when Nominatim is down
+NEAREST_MAX_K = 50
+NEAREST_BATCH_MAX_POINTS = 10000
+NEAREST_BATCH_MAX_ADDRESSES = 200  # addresses go through the rate-limited geocoders
+NEAREST_BATCH_CHUNK = 500
+NEAREST_BATCH_STREAM_OVER = 500  # larger batches are streamed as NDJSON
+ROAD_MATRIX_MAX_STORES = 50  # destinations per OSRM table request
+ROAD_MATRIX_GEOHASH_PRECISION = 8  # origins in one ~38 x 19 m cell share cached store pairs
+ROAD_MATRIX_TTL = 60 * 60 * 6
+OPTIMIZE_VISITS_MAX_STORES = 50  # stops per plan; one table request covers the whole matrix
+OPTIMIZE_VISITS_BUDGET_MS = 300  # default time budget of the order search
+OPTIMIZE_VISITS_MAX_BUDGET_MS = 2000
+CLUSTER_UNTIL_ZOOM = 15  # stores_in_bounds returns clusters below this zoom
+
+TILE_BUFFER_PX = 64
+TILE_HTTP_MAX_AGE = 60 * 5
 
 
 # =========================
@@ -110,6 +163,32 @@ def _cache_key(prefix: str, obj: dict):
     return f"{prefix}:{h}"
 
 
+def _encode_cursor(obj: dict) -> str:
+    raw = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(raw: str):
+    """Opaque keyset cursor -> dict; ``{}`` when absent, ``None`` when malformed."""
+    raw = (raw or "").strip()
+    if not raw:
+        return {}
+    try:
+        obj = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _id_page(qs, cursor, limit):
+    """Keyset page over ``id`` ordering: ``(rows, next_cursor)``."""
+    if cursor.get("id") is not None:
+        qs = qs.filter(id__gt=_safe_int(cursor["id"]))
+    rows = list(qs.order_by("id")[:limit + 1])
+    next_cursor = _encode_cursor({"id": rows[limit - 1].id}) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
 # =========================
 # HELPERS
 # =========================
@@ -169,24 +248,77 @@ def _parse_latlon(text: str):
     return None
 
 
-def _haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = (math.sin(dphi / 2) ** 2) + math.cos(phi1) * math.cos(phi2) * (math.sin(dlambda / 2) ** 2)
-    return 2 * R * math.asin(math.sqrt(a))
+def _brand_names(brand_key: str):
+    """Upper-cased chain names accepted for a brand key, as matched by the store index."""
+    if not brand_key:
+        return None
+    return {b.upper() for b in ALIASES.get(brand_key, [])}
 
 
 def _bbox_filter(qs, lat, lon, radius_km):
-    dlat = radius_km / 111.0
-    dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 1e-6))
+    if postgis.postgis_enabled():
+        return postgis.filter_dwithin(qs, lat, lon, radius_km)
+    dlat, dlon = bbox_deltas(lat, radius_km)
     return qs.filter(
         vi_do__gte=lat - dlat, vi_do__lte=lat + dlat,
         kinh_do__gte=lon - dlon, kinh_do__lte=lon + dlon
     )
 
 
+def _bounds_filter(qs, south, west, north, east):
+    if postgis.postgis_enabled():
+        # && selects through the GiST index; the float predicates below keep
+        # the result exact since geography boxes are not lat/lon rectangles.
+        qs = postgis.filter_envelope(qs, south, west, north, east)
+    return qs.filter(
+        vi_do__gte=min(south, north),
+        vi_do__lte=max(south, north),
+        kinh_do__gte=min(west, east),
+        kinh_do__lte=max(west, east),
+    )
+
+
+def _district_filter(qs, district):
+    """
+    Stores inside the district's boundary polygon when one is loaded,
+    otherwise the legacy case-insensitive ``quan_huyen`` match.
+    """
+    bounds = district_index.bounds(district)
+    if bounds is None:
+        return qs.filter(quan_huyen__iexact=district)
+    if postgis.postgis_enabled():
+        return postgis.filter_intersects(qs, district_index.wkt(district))
+    rows = list(_bounds_filter(qs, *bounds).values_list("id", "vi_do", "kinh_do"))
+    if not rows:
+        return qs.none()
+    ids, lats, lons = zip(*rows)
+    mask = district_index.contains_mask(district, lats, lons)
+    return qs.filter(id__in=[sid for sid, inside in zip(ids, mask.tolist()) if inside])
+
+
+def _radius_hits(lat, lon, radius_km, brand="", district="", limit=None):
+    """
+    ``[(distance_km, store_id), ...]`` within the radius, nearest first.
+    PostGIS does the filtering and KNN ordering when the geography column
+    exists; otherwise the in-memory store index answers.
+    """
+    if not postgis.postgis_enabled():
+        return store_index.radius(
+            lat, lon, radius_km,
+            brands=_brand_names(brand), district=district, limit=limit,
+        )
+    qs = CuaHang.objects.all()
+    if brand:
+        qs = qs.filter(_brand_q(brand))
+    if district:
+        qs = _district_filter(qs, district)
+    qs = postgis.annotate_distance(_bbox_filter(qs, lat, lon, radius_km), lat, lon)
+    qs = postgis.order_by_knn(qs, lat, lon).values_list("distance_m", "id")
+    if limit is not None:
+        qs = qs[:limit]
+    return [(m / 1000.0, sid) for m, sid in qs]
+
+
 def _store_dict(s: CuaHang, extra=None):
     def _is_open_now(store: CuaHang, now_t=None):
         if getattr(store, "hoat_dong_24h", False):
@@ -234,6 +366,96 @@ def _store_dict(s: CuaHang, extra=None):
     return d
 
 
+def _radius_points(lat, lon, radius_km, brand="", district=""):
+    """``[(store_id, lat, lon), ...]`` within the radius, in no particular order."""
+    if not postgis.postgis_enabled():
+        hits = store_index.radius(
+            lat, lon, radius_km,
+            brands=_brand_names(brand), district=district, with_coords=True,
+        )
+        return [(sid, s_lat, s_lon) for _, sid, s_lat, s_lon in hits]
+    qs = CuaHang.objects.all()
+    if brand:
+        qs = qs.filter(_brand_q(brand))
+    if district:
+        qs = _district_filter(qs, district)
+    return list(_bbox_filter(qs, lat, lon, radius_km).values_list("id", "vi_do", "kinh_do"))
+
+
+def _cell_candidates(lat, lon, radius_km, brand="", district=""):
+    """
+    Candidate stores shared by every center in the geohash cell around (lat, lon).
+
+    The cell is sized for the (bucketed) radius and its cache entry holds all
+    stores within radius + half the cell diagonal of the cell center, a
+    superset for any center inside the cell; callers apply exact distances.
+    Returns ``(candidates, from_cache)``.
+    """
+    bucket = round(math.ceil(radius_km / RADIUS_BUCKET_KM - 1e-9) * RADIUS_BUCKET_KM, 3)
+    cell = geohash.encode(lat, lon, geohash.precision_for_km(bucket))
+    key = _cache_key("radius_cell", {
+        "cell": cell,
+        "radius_km": bucket,
+        "brand": brand or "ALL",
+        "district": district.lower(),
+        "gen": store_generation(),
+    })
+    cached = _cache_get(key)
+    if isinstance(cached, dict):
+        return cached, True
+
+    south, west, north, east = geohash.bounds(cell)
+    c_lat, c_lon = (south + north) / 2, (west + east) / 2
+    reach = bucket + haversine_km(c_lat, c_lon, north, east)
+    points = sorted(_radius_points(c_lat, c_lon, reach, brand=brand, district=district))
+    candidates = {
+        "ids": [p[0] for p in points],
+        "lat": [float(p[1]) for p in points],
+        "lon": [float(p[2]) for p in points],
+    }
+    _cache_set(key, candidates, seconds=CACHE_TTL_SHORT)
+    return candidates, False
+
+
+def _open_now_q(now_t):
+    """DB equivalent of the is_open_now rule in _store_dict (unknown hours = closed)."""
+    return (
+        Q(hoat_dong_24h=True)
+        | (Q(mo_cua__lte=F("dong_cua")) & Q(mo_cua__lte=now_t, dong_cua__gte=now_t))
+        | (Q(mo_cua__gt=F("dong_cua")) & (Q(mo_cua__lte=now_t) | Q(dong_cua__gte=now_t)))
+    )
+
+
+def _nearest_hits(lat, lon, k, brand="", district="", open_at=None, max_km=None):
+    """``[(distance_km, store_id), ...]`` for the k closest matching stores."""
+    if not postgis.postgis_enabled():
+        return store_index.nearest(
+            lat, lon, k,
+            brands=_brand_names(brand), district=district, open_at=open_at, max_km=max_km,
+        )
+    qs = CuaHang.objects.all()
+    if brand:
+        qs = qs.filter(_brand_q(brand))
+    if district:
+        qs = _district_filter(qs, district)
+    if open_at is not None:
+        qs = qs.filter(_open_now_q(open_at))
+    if max_km is not None:
+        qs = _bbox_filter(qs, lat, lon, max_km)
+    qs = postgis.order_by_knn(postgis.annotate_distance(qs, lat, lon), lat, lon)
+    return [(m / 1000.0, sid) for m, sid in qs.values_list("distance_m", "id")[:k]]
+
+
+def _stores_for_hits(hits):
+    """Serialize ``[(distance_km, store_id), ...]`` index hits, keeping their order."""
+    rows = CuaHang.objects.select_related("chuoi").in_bulk([sid for _, sid in hits])
+    return [
+        _store_dict(rows[sid], {"distance_km": round(d, 3)})
+        for d, sid in hits
+        if sid in rows
+    ]
+
+
 def _normalize_raw_query(raw: str) -> str:
     if not raw:
         return ""
@@ -317,73 +539,116 @@ def _make_geocode_fallback_queries(raw_q: str):
     return out
 
 
-def _norm_text(s: str) -> str:
-    s = _strip_accents((s or "").lower())
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+def _geocode_store_key(q: str) -> str:
+    """Key for the persistent geocode store: spelling, accents and punctuation folded."""
+    return _norm_text(_normalize_raw_query(q))
 
 
-def _tokens(s: str):
-    stop = {
-        "viet", "nam", "vietnam", "thanh", "pho", "tp", "ho", "chi", "minh",
-        "duong", "street", "road", "hem", "ngo", "so", "ap", "xa", "phuong",
-        "quan", "huyen", "city", "ward", "district",
-    }
-    t = []
-    for w in _norm_text(s).split():
-        if len(w) <= 1:
-            continue
-        if w in stop:
-            continue
-        t.append(w)
-    return t
+class _CacheEntry(NamedTuple):
+    value: object
+    fresh_until: float
 
 
-def _score_geocode_candidate(query: str, display: str):
-    q_tokens = set(_tokens(query))
-    d_tokens = set(_tokens(display))
-    if not q_tokens or not d_tokens:
-        return 0.0
-    inter = len(q_tokens & d_tokens)
-    score = inter / max(len(q_tokens), 1)
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
-    q_nums = set(re.findall(r"\d+", query or ""))
-    d_nums = set(re.findall(r"\d+", display or ""))
-    if q_nums and d_nums:
-        score += 0.15 * (len(q_nums & d_nums) / len(q_nums))
-    return score
 
+def _schedule_refresh(key, refresh):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
 
-def _cache_get(key):
-    return cache.get(key)
+    def _run():
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Background refresh of %s failed", key)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+            connections.close_all()
 
+    _refresh_pool.submit(_run)
 
-def _cache_set(key, value, seconds=CACHE_TTL):
-    cache.set(key, value, seconds)
 
+def _cache_get(key, refresh=None):
+    """
+    Cached value, or None once its TTL has passed. When ``refresh`` is
+    given, an expired entry stored with ``stale_ok`` and still within
+    CACHE_STALE_MAX_SEC is returned as-is and ``refresh()`` runs on a
+    background worker to replace it (stale-while-revalidate); ``refresh``
+    is expected to call _cache_set.
+    """
+    entry = cache.get(key)
+    if not isinstance(entry, _CacheEntry):
+        return entry
+    if time.time() < entry.fresh_until:
+        return entry.value
+    if refresh is None:
+        return None
+    _schedule_refresh(key, refresh)
+    return entry.value
+
+
+def _cache_set(key, value, seconds=CACHE_TTL, stale_ok=False):
+    if not stale_ok:
+        cache.set(key, value, seconds)
+        return
+    # Kept CACHE_STALE_MAX_SEC past its TTL so _cache_get can serve it stale.
+    cache.set(key, _CacheEntry(value, time.time() + seconds), seconds + CACHE_STALE_MAX_SEC)
+
+
+def _rate_limited(provider, stop=None):
+    """Wait for ``provider``'s shared rate limit; False if the queue deadline passes first."""
+    return rate_limit.acquire(provider, timeout=PROVIDER_QUEUE_DEADLINE_SEC, stop=stop)
+
+
+def _circuit_open(provider):
+    return circuit.breaker(provider).state == circuit.OPEN
+
+
+_PROVIDER_CLIENTS = {
+    "nominatim": request_nominatim,
+    "photon": request_photon,
+    "osrm": request_osrm,
+}
 
-def _nominatim_throttle():
-    last = _cache_get(_LAST_NOMINATIM_TS_KEY)
-    now = time.time()
-    if last:
-        try:
-            last = float(last)
-            if (now - last) < _NOMINATIM_MIN_INTERVAL_SEC:
-                time.sleep(_NOMINATIM_MIN_INTERVAL_SEC - (now - last))
-        except Exception:
-            pass
-    _cache_set(_LAST_NOMINATIM_TS_KEY, str(time.time()), seconds=60)
+
+def _upstream_get(provider, url, params, timeout):
+    """
+    GET through the provider's pooled client in services, guarded by its
+    circuit breaker, which records the outcome and latency. Retries take
+    their own token from the provider's rate limit. Returns None when the
+    breaker refuses the call (open, or a half-open probe already in flight).
+    """
+    breaker = circuit.breaker(provider)
+    if not breaker.allow():
+        return None
+    started = time.monotonic()
+    try:
+        r = _PROVIDER_CLIENTS[provider](url, params, _headers(), timeout, acquire=partial(_rate_limited, provider))
+    except Exception:
+        breaker.record(False, time.monotonic() - started)
+        raise
+    breaker.record(r.status_code != 429 and r.status_code < 500, time.monotonic() - started)
+    return r
 
 
-def _call_nominatim_search_safe(query: str, use_countrycodes=True):
-    _nominatim_throttle()
+def _call_nominatim_search_safe(query: str, use_countrycodes=True, throttle=True):
+    if _circuit_open("nominatim"):
+        return None, {"error": "CIRCUIT_OPEN", "query": query}
+    if throttle and not _rate_limited("nominatim"):
+        return None, {"error": "RATE_LIMITED", "query": query}
     url = "https://nominatim.openstreetmap.org/search"
     params = {"q": query, "format": "jsonv2", "limit": 8, "addressdetails": 1}
     if use_countrycodes:
         params["countrycodes"] = VN_COUNTRY_CODE
     try:
-        r = requests.get(url, params=params, headers=_headers(), timeout=NOMINATIM_TIMEOUT)
+        r = _upstream_get("nominatim", url, params, NOMINATIM_TIMEOUT)
+        if r is None:
+            return None, {"error": "CIRCUIT_OPEN", "query": query}
         if r.status_code != 200:
             return None, {"status": r.status_code, "body": r.text[:200], "query": query}
         return (r.json() or []), None
@@ -391,12 +656,17 @@ def _call_nominatim_search_safe(query: str, use_countrycodes=True):
         return None, {"exception": str(e), "query": query}
 
 
-def _call_photon_search_safe(query: str):
-    _nominatim_throttle()
+def _call_photon_search_safe(query: str, throttle=True):
+    if _circuit_open("photon"):
+        return None, {"error": "CIRCUIT_OPEN", "query": query, "provider": "photon"}
+    if throttle and not _rate_limited("photon"):
+        return None, {"error": "RATE_LIMITED", "query": query, "provider": "photon"}
     url = "https://photon.komoot.io/api/"
     params = {"q": query, "limit": 8, "lang": "en"}
     try:
-        r = requests.get(url, params=params, headers=_headers(), timeout=NOMINATIM_TIMEOUT)
+        r = _upstream_get("photon", url, params, NOMINATIM_TIMEOUT)
+        if r is None:
+            return None, {"error": "CIRCUIT_OPEN", "query": query, "provider": "photon"}
         if r.status_code != 200:
             return None, {"status": r.status_code, "body": r.text[:200], "query": query, "provider": "photon"}
 
@@ -431,11 +701,16 @@ def _call_photon_search_safe(query: str):
 
 
 def _call_nominatim_reverse_safe(lat: float, lon: float):
-    _nominatim_throttle()
+    if _circuit_open("nominatim"):
+        return None, {"error": "CIRCUIT_OPEN"}
+    if not _rate_limited("nominatim"):
+        return None, {"error": "RATE_LIMITED"}
     url = "https://nominatim.openstreetmap.org/reverse"
     params = {"format": "jsonv2", "lat": lat, "lon": lon, "zoom": 18, "addressdetails": 1}
     try:
-        r = requests.get(url, params=params, headers=_headers(), timeout=NOMINATIM_TIMEOUT)
+        r = _upstream_get("nominatim", url, params, NOMINATIM_TIMEOUT)
+        if r is None:
+            return None, {"error": "CIRCUIT_OPEN"}
         if r.status_code != 200:
             return None, {"status": r.status_code, "body": r.text[:200]}
         return r.json(), None
@@ -444,68 +719,138 @@ def _call_nominatim_reverse_safe(lat: float, lon: float):
 
 
 def _reverse_geocode(lat: float, lon: float):
-    key = _cache_key("geo_rev", {"lat": round(lat, 6), "lon": round(lon, 6)})
+    cell = geohash.encode(lat, lon, REVERSE_GEOHASH_PRECISION)
+    key = _cache_key("geo_rev", {"cell": cell})
     cached = _cache_get(key)
     if isinstance(cached, dict):
         return cached, None
+    stored = geocode_store.get("reverse", cell)
+    if isinstance(stored, dict):
+        _cache_set(key, stored, seconds=60 * 60)
+        return stored, None
+    near_km = getattr(settings, "SPATIAL_REVERSE_NEAR_KM", REVERSE_NEAR_KM)
+    near = reverse_index.nearest(lat, lon, near_km) if near_km > 0 else None
+    if near:
+        _cache_set(key, near[0], seconds=60 * 60)
+        return near[0], None
     res, err = _call_nominatim_reverse_safe(lat, lon)
     if res:
         _cache_set(key, res, seconds=60 * 60)
+        geocode_store.put("reverse", cell, res, provider="nominatim")
+        reverse_index.add(cell, res)
         return res, None
+    fallback = _reverse_fallback(lat, lon)
+    if fallback:
+        _cache_set(key, fallback, seconds=60)
+        return fallback, None
     return None, err
 
 
+def _reverse_fallback(lat: float, lon: float):
+    """
+    Approximate description of a point from our own data (nearest store,
+    district polygon) for when Nominatim cannot answer. Marked ``approximate``.
+    """
+    district = district_index.locate(lat, lon) if district_index.available() else None
+    hits = store_index.nearest(lat, lon, k=1, max_km=REVERSE_FALLBACK_STORE_KM)
+    store = CuaHang.objects.filter(id=hits[0][1]).first() if hits else None
+    if not store and not district:
+        return None
+    parts = []
+    if store:
+        parts.append(f"Gan {store.ten} ({store.dia_chi})")
+    parts += [district or (store.quan_huyen if store else ""), "Thanh pho Ho Chi Minh", "Viet Nam"]
+    return {
+        "display_name": ", ".join(p for p in parts if p),
+        "approximate": True,
+        "source": "nearest_store" if store else "district",
+        "store_id": store.id if store else None,
+        "distance_km": round(hits[0][0], 3) if store else None,
+        "district": district or (store.quan_huyen if store else ""),
+    }
+
+
+def _geocode_search_task(provider, query, stop):
+    """One provider/variant search for fan_out; skipped if stopped before its rate-limit slot."""
+    if _circuit_open(provider) or not _rate_limited(provider, stop):
+        return None
+    if provider == "nominatim":
+        arr, err = _call_nominatim_search_safe(query, use_countrycodes=True, throttle=False)
+    else:
+        arr, err = _call_photon_search_safe(query, throttle=False)
+    return provider, arr, err
+
+
 def _resolve_geocode_payload(q: str):
     variants = _make_geocode_fallback_queries(q)
     if not variants:
         return {"q": q, "location": None, "provider": None, "error": "NO_VARIANTS"}
 
-    last_err = None
-    candidates = []
-
-    for v in variants[:5]:
-        arr, err = _call_nominatim_search_safe(v, use_countrycodes=True)
-        if arr:
-            for it in arr[:8]:
-                candidates.append({
-                    "provider": "nominatim",
-                    "lat": _safe_float(it.get("lat")),
-                    "lon": _safe_float(it.get("lon")),
-                    "display": it.get("display_name", ""),
-                })
-        else:
-            last_err = err
+    local = local_geocoder.geocode(q)
+    if local:
+        return {
+            "q": q,
+            "provider": "local",
+            "location": {"lat": local["lat"], "lon": local["lon"], "display": local["display"]},
+            "score": round(local["score"], 4),
+            "source": local["source"],
+            "precision": local["precision"],
+            "variants": variants[:6],
+            "candidates_count": 1,
+        }
 
-    for v in variants[:5]:
-        arr, err = _call_photon_search_safe(v)
-        if arr:
-            for it in arr[:8]:
-                candidates.append({
-                    "provider": "photon",
-                    "lat": _safe_float(it.get("lat")),
-                    "lon": _safe_float(it.get("lon")),
-                    "display": it.get("display_name", ""),
-                })
-        else:
-            last_err = err
+    store_key = _geocode_store_key(q)
+    stored = geocode_store.get("geocode", store_key)
+    if isinstance(stored, dict):
+        return {**stored, "q": q}
 
+    last_err = None
     uniq = []
     seen = set()
-    for c in candidates:
-        if c["lat"] is None or c["lon"] is None:
-            continue
-        k = (round(float(c["lat"]), 6), round(float(c["lon"]), 6), (c["display"] or "").strip().lower())
-        if k in seen:
-            continue
-        seen.add(k)
-        c["score"] = _score_geocode_candidate(q, c.get("display", ""))
-        uniq.append(c)
+
+    def _collect(result):
+        # Score candidates as each response arrives; True stops the fan-out.
+        nonlocal last_err
+        provider, arr, err = result
+        if not arr:
+            last_err = err
+            return False
+        for it in arr[:8]:
+            c = {
+                "provider": provider,
+                "lat": _safe_float(it.get("lat")),
+                "lon": _safe_float(it.get("lon")),
+                "display": it.get("display_name", ""),
+            }
+            if c["lat"] is None or c["lon"] is None:
+                continue
+            k = (round(float(c["lat"]), 6), round(float(c["lon"]), 6), (c["display"] or "").strip().lower())
+            if k in seen:
+                continue
+            seen.add(k)
+            c["score"] = _score_geocode_candidate(q, c.get("display", ""))
+            uniq.append(c)
+        return any(c["score"] >= GEOCODE_MIN_SCORE for c in uniq)
+
+    # Providers with a closed circuit are interleaved healthiest first, so
+    # both work in parallel, each paced by its own rate limit.
+    providers = circuit.ordered(("nominatim", "photon"))
+    if not providers:
+        last_err = {"error": "CIRCUIT_OPEN"}
+    fan_out(
+        [
+            partial(_geocode_search_task, provider, v)
+            for v in variants[:GEOCODE_MAX_VARIANTS]
+            for provider in providers
+        ],
+        _collect,
+    )
 
     uniq.sort(key=lambda x: x.get("score", 0.0), reverse=True)
     best = uniq[0] if uniq else None
 
-    if best and best.get("score", 0.0) >= 0.18:
-        return {
+    if best and best.get("score", 0.0) >= GEOCODE_MIN_SCORE:
+        payload = {
             "q": q,
             "provider": best.get("provider"),
             "location": {
@@ -517,6 +862,8 @@ def _resolve_geocode_payload(q: str):
             "variants": variants[:6],
             "candidates_count": len(uniq),
         }
+        geocode_store.put("geocode", store_key, payload, provider=payload["provider"], score=payload["score"])
+        return payload
 
     return {
         "q": q,
@@ -529,30 +876,55 @@ def _resolve_geocode_payload(q: str):
     }
 
 
-# =========================
-# ENDPOINTS
-# =========================
-@cors_view
-def ping(request):
-    return ok({"pong": True}, message="pong")
+def _cached_dict(key, refresh=None):
+    cached = _cache_get(key, refresh=refresh)
+    return cached if isinstance(cached, dict) else None
 
 
-@cors_view
-def suggest(request):
-    q = (request.GET.get("q") or "").strip()
-    if len(q) < 3:
-        return ok({"q": q, "items": [], "variants": []}, message="Type more")
+def _geocode_and_cache(q: str, key, refreshing=False):
+    payload = _resolve_geocode_payload(q)
+    # A background refresh that fails keeps serving the stale entry.
+    if not refreshing or payload.get("location"):
+        _cache_set(key, payload, seconds=60 * 30, stale_ok=True)
+    return payload
+
+
+def _geocode_cached(q: str):
+    """
+    _resolve_geocode_payload behind the geocode endpoint's cache entry;
+    concurrent misses for the same query share one upstream resolution,
+    and an expired entry is served while it is refreshed.
+    """
+    key = _cache_key("geocode", {"q": q.lower()})
+    cached = _cached_dict(key, refresh=partial(_geocode_and_cache, q, key, refreshing=True))
+    if cached is not None:
+        return cached
+    return singleflight.do(key, partial(_geocode_and_cache, q, key), lookup=partial(_cached_dict, key))
 
-    key = _cache_key("suggest", {"q": q.lower()})
-    cached = _cache_get(key)
-    if isinstance(cached, dict):
-        return ok(cached, message="OK (cache)")
 
+def _suggest_and_cache(q: str, key, store_key, refreshing=False):
     variants = _make_geocode_variants(q)
     items = []
     last_err = None
+    # Photon stands in while Nominatim's circuit is open.
+    use_photon = _circuit_open("nominatim")
+    provider = "photon" if use_photon else "nominatim"
 
     for v in variants[:4]:
+        if use_photon:
+            arr, err = _call_photon_search_safe(v)
+            if arr:
+                for x in arr[:8]:
+                    items.append({
+                        "display": x.get("display_name", ""),
+                        "lat": x.get("lat"),
+                        "lon": x.get("lon"),
+                        "place_id": x.get("place_id"),
+                    })
+                break
+            last_err = err
+            continue
+
         arr, err = _call_nominatim_search_safe(v, use_countrycodes=True)
         if arr:
             for x in arr[:8]:
@@ -585,7 +957,328 @@ def suggest(request):
             uniq.append(it)
 
     payload = {"q": q, "items": uniq, "variants": variants[:6], "error": last_err}
-    _cache_set(key, payload, seconds=60 * 30)
+    if not refreshing or uniq:
+        _cache_set(key, payload, seconds=60 * 30, stale_ok=True)
+    if uniq:
+        geocode_store.put("suggest", store_key, payload, provider=provider)
+    return payload
+
+
+def _osrm_route_params(mode, alternatives, fields):
+    params = {"alternatives": "true" if alternatives else "false"}
+    if mode == "summary":
+        params["overview"] = "false"
+    else:
+        params["overview"] = "full"
+        params["geometries"] = "polyline" if mode == "polyline" else "geojson"
+    params["steps"] = "true" if mode == "full" or fields else "false"
+    return params
+
+
+def _shape_route(route, mode, zoom, fields):
+    """
+    ``route`` cut down to what ``mode`` renders: the full OSRM route, or
+    distance/duration plus the geometry (if any) and the requested step
+    ``fields``.
+    """
+    if mode == "full":
+        if not fields:
+            return route
+        shaped = dict(route)
+    else:
+        shaped = {k: route[k] for k in ("distance", "duration") if k in route}
+        geometry = route.get("geometry")
+        if mode == "simplified" and isinstance(geometry, dict):
+            coords = polyline.simplify(
+                geometry.get("coordinates") or [], polyline.tolerance_for_zoom(zoom, ROUTE_SIMPLIFY_PX),
+            )
+            shaped["geometry"] = {"type": "LineString", "coordinates": coords}
+        elif mode == "polyline" and geometry:
+            shaped["geometry"] = geometry
+    if fields:
+        shaped["legs"] = [
+            {
+                "distance": leg.get("distance"),
+                "duration": leg.get("duration"),
+                "summary": leg.get("summary", ""),
+                "steps": [{k: st[k] for k in fields if k in st} for st in leg.get("steps") or []],
+            }
+            for leg in route.get("legs") or []
+        ]
+    return shaped
+
+
+def _osrm_route_data(profile, frm, to, params):
+    """``(osrm_json, None)`` from the OSRM server, or ``(None, error_kwargs)`` for bad()."""
+    flt, fln = frm
+    tlt, tln = to
+    url = f"https://router.project-osrm.org/route/v1/{profile}/{fln},{flt};{tln},{tlt}"
+    if not _rate_limited("osrm"):
+        return None, {"message": "OSRM rate limited", "status": 429}
+    try:
+        r = _upstream_get("osrm", url, params, OSRM_TIMEOUT)
+        if r is None:
+            return None, {"message": "OSRM unavailable (circuit open)", "status": 503}
+        if r.status_code != 200:
+            return None, {"message": "OSRM error", "status_code": r.status_code, "body": r.text[:250]}
+
+        data = r.json()
+        if data.get("code") != "Ok":
+            return None, {"message": "OSRM not OK", "raw": data}
+        return data, None
+    except Exception as e:
+        return None, {"message": "OSRM exception", "exception": str(e)}
+
+
+def _local_route_data(profile, frm, to, params):
+    """OSRM-style json from the offline router, or None if it cannot answer."""
+    try:
+        data = local_router.route(
+            profile, frm, to,
+            overview=params.get("overview") != "false",
+            geometries=params.get("geometries", "geojson"),
+            steps=params.get("steps") == "true",
+        )
+    except Exception:
+        logger.exception("Local routing failed")
+        return None
+    return data if data and data.get("code") == "Ok" else None
+
+
+def _route_data(profile, frm, to, params):
+    """
+    ``(route_json, engine, error_kwargs)``. settings.SPATIAL_ROUTING_ENGINE
+    picks the router: ``osrm`` only, ``local`` first with OSRM behind it, or
+    ``fallback`` (the default) to OSRM first and the local router when OSRM
+    fails. Without a road network file the local router never answers.
+    """
+    engine = getattr(settings, "SPATIAL_ROUTING_ENGINE", ROUTING_ENGINE)
+    if engine == "local":
+        data = _local_route_data(profile, frm, to, params)
+        if data is not None:
+            return data, "local", None
+    data, err = _osrm_route_data(profile, frm, to, params)
+    if err and engine == "fallback":
+        local = _local_route_data(profile, frm, to, params)
+        if local is not None:
+            return local, "local", None
+    return data, "osrm", err
+
+
+def _osrm_route_and_cache(key, profile, frm, to, alternatives, mode="full", zoom=ROUTE_DEFAULT_ZOOM, fields=()):
+    """``(route_payload, None)``, or ``(None, error_kwargs)`` for bad()."""
+    flt, fln = frm
+    tlt, tln = to
+    params = _osrm_route_params(mode, alternatives, fields)
+    data, engine, err = _route_data(profile, frm, to, params)
+    if err:
+        return None, err
+
+    routes = [_shape_route(rt, mode, zoom, fields) for rt in data.get("routes") or []]
+    out = {
+        "profile": profile, "engine": engine,
+        "from": {"lat": flt, "lon": fln}, "to": {"lat": tlt, "lon": tln}, "routes": routes,
+    }
+    if mode != "full":
+        out["mode"] = mode
+    _cache_set(key, out, seconds=60 * 30, stale_ok=True)
+    return out, None
+
+
+def _snap_origin(lat, lon, precision=ROUTE_ORIGIN_GEOHASH_PRECISION):
+    """``(geohash_cell, (lat, lon))`` of the road-scale cell containing the point and its centre."""
+    cell = geohash.encode(lat, lon, precision)
+    south, west, north, east = geohash.bounds(cell)
+    return cell, ((south + north) / 2, (west + east) / 2)
+
+
+def _store_route_variant(alternatives, mode, zoom, fields):
+    return route_store.variant_key(
+        alternatives=alternatives, mode=mode, zoom=zoom if mode == "simplified" else None, fields=list(fields),
+    )
+
+
+def _store_route_and_cache(key, profile, cell, store_id, frm, to, alternatives, mode, zoom, fields):
+    """Like _osrm_route_and_cache, but read from and written to the persistent route store."""
+    variant = _store_route_variant(alternatives, mode, zoom, fields)
+    stored = route_store.get(profile, cell, store_id, variant)
+    if stored is not None:
+        _cache_set(key, stored, seconds=60 * 30, stale_ok=True)
+        return stored, None
+    out, err = _osrm_route_and_cache(key, profile, frm, to, alternatives, mode, zoom, fields)
+    if out is not None:
+        route_store.put(profile, cell, store_id, variant, out)
+    return out, err
+
+
+def _store_route_request(profile, origin, store, alternatives, mode, zoom, fields):
+    """
+    ``(cache_key, fetch)`` for the route from ``origin``'s cell to ``store``
+    (``(id, lat, lon)``). ``fetch()`` returns ``(payload, None)`` or
+    ``(None, error_kwargs)``.
+    """
+    store_id, s_lat, s_lon = store
+    cell, frm = _snap_origin(*origin)
+    key = _cache_key("osrm_store_route", {
+        "profile": profile,
+        "cell": cell,
+        "store": [store_id, round(s_lat, 6), round(s_lon, 6)],
+        "alternatives": alternatives,
+        "mode": mode,
+        "zoom": zoom if mode == "simplified" else None,
+        "fields": fields,
+    })
+    fetch = partial(
+        _store_route_and_cache, key, profile, cell, store_id, frm, (s_lat, s_lon), alternatives, mode, zoom, fields,
+    )
+    return key, fetch
+
+
+def _cached_route(key):
+    cached = _cached_dict(key)
+    return (cached, None) if cached is not None else None
+
+
+def _road_pair_key(profile, cell, store_id):
+    return _cache_key("road_pair", {"profile": profile, "cell": cell, "id": store_id})
+
+
+def _osrm_table_data(profile, points, params):
+    """``(osrm_table_json, None)`` for ``points`` (``(lat, lon)``), or ``(None, error_kwargs)``."""
+    coords = ";".join(f"{lon},{lat}" for lat, lon in points)
+    url = f"https://router.project-osrm.org/table/v1/{profile}/{coords}"
+    if not _rate_limited("osrm"):
+        return None, {"message": "OSRM rate limited", "status": 429}
+    try:
+        r = _upstream_get("osrm", url, params, OSRM_TIMEOUT)
+        if r is None:
+            return None, {"message": "OSRM unavailable (circuit open)", "status": 503}
+        if r.status_code != 200:
+            return None, {"message": "OSRM error", "status_code": r.status_code, "body": r.text[:250]}
+
+        data = r.json()
+        if data.get("code") != "Ok":
+            return None, {"message": "OSRM not OK", "raw": data}
+        return data, None
+    except Exception as e:
+        return None, {"message": "OSRM exception", "exception": str(e)}
+
+
+def _local_table_data(profile, points, sources=None, destinations=None):
+    """OSRM-style table json from the offline router, or None if it cannot answer."""
+    try:
+        data = local_router.table(profile, points, sources=sources, destinations=destinations)
+    except Exception:
+        logger.exception("Local routing table failed")
+        return None
+    return data if data and data.get("code") == "Ok" else None
+
+
+def _table_data(profile, points, sources=None, destinations=None):
+    """
+    ``(table_json, error_kwargs)`` from the ``sources`` to the
+    ``destinations`` indices of ``points`` (all of them by default), from
+    the engine _route_data would use.
+    """
+    engine = getattr(settings, "SPATIAL_ROUTING_ENGINE", ROUTING_ENGINE)
+    local = partial(_local_table_data, profile, points, sources=sources, destinations=destinations)
+    if engine == "local":
+        data = local()
+        if data is not None:
+            return data, None
+    params = {"annotations": "duration,distance"}
+    if sources is not None:
+        params["sources"] = ";".join(str(i) for i in sources)
+    if destinations is not None:
+        params["destinations"] = ";".join(str(i) for i in destinations)
+    data, err = _osrm_table_data(profile, points, params)
+    if err and engine == "fallback":
+        fallback = local()
+        if fallback is not None:
+            return fallback, None
+    return data, err
+
+
+def _one_to_many_table(profile, origin, dests):
+    """
+    ``([(distance_m, duration_s), ...], None)`` from ``origin`` to each of
+    ``dests`` in one table request (None values where unreachable), or
+    ``(None, error_kwargs)`` for bad().
+    """
+    data, err = _table_data(profile, [origin, *dests], sources=[0], destinations=list(range(1, len(dests) + 1)))
+    if err:
+        return None, err
+    durations = (data.get("durations") or [[]])[0]
+    distances = (data.get("distances") or [[]])[0]
+    if len(durations) != len(dests) or len(distances) != len(dests):
+        return None, {"message": "Routing table size mismatch"}
+    return list(zip(distances, durations)), None
+
+
+def _travel_matrix(profile, cell, ids, points):
+    """
+    ``(durations, distances, None)`` between ``points`` (the start, then the
+    stores ``ids``; None where unreachable), or ``(None, None, error_kwargs)``.
+    The whole matrix is one cache entry keyed by the start ``cell`` and the
+    sorted ids, so a repeated plan costs one cache read whatever its order.
+    """
+    n = len(points)
+    canon = [0] + [1 + i for i in sorted(range(len(ids)), key=ids.__getitem__)]
+    key = _cache_key("travel_matrix", {"profile": profile, "cell": cell, "ids": sorted(ids)})
+    cached = _cache_get(key)
+    if not isinstance(cached, dict):
+        data, err = _table_data(profile, [points[i] for i in canon])
+        if err:
+            return None, None, err
+        durations, distances = data.get("durations") or [], data.get("distances") or []
+        if len(durations) != n or len(distances) != n or any(len(r) != n for r in durations + distances):
+            return None, None, {"message": "Routing table size mismatch"}
+        cached = {"durations": durations, "distances": distances}
+        _cache_set(key, cached, seconds=ROAD_MATRIX_TTL)
+
+    pos = [0] * n
+    for k, i in enumerate(canon):
+        pos[i] = k
+    durations = [[cached["durations"][pos[i]][pos[j]] for j in range(n)] for i in range(n)]
+    distances = [[cached["distances"][pos[i]][pos[j]] for j in range(n)] for i in range(n)]
+    return durations, distances, None
+
+
+# =========================
+# ENDPOINTS
+# =========================
+@cors_view
+def ping(request):
+    return ok({"pong": True}, message="pong")
+
+
+@cors_view
+def providers(request):
+    """Circuit state and rolling latency/error stats of the upstream providers."""
+    return ok({"providers": circuit.snapshot()}, message="OK")
+
+
+@cors_view
+def suggest(request):
+    q = (request.GET.get("q") or "").strip()
+    if len(q) < 3:
+        return ok({"q": q, "items": [], "variants": []}, message="Type more")
+
+    key = _cache_key("suggest", {"q": q.lower()})
+    store_key = _geocode_store_key(q)
+    cached = _cache_get(key, refresh=partial(_suggest_and_cache, q, key, store_key, refreshing=True))
+    if isinstance(cached, dict):
+        return ok(cached, message="OK (cache)")
+
+    stored = geocode_store.get("suggest", store_key)
+    if isinstance(stored, dict):
+        stored = {**stored, "q": q}
+        _cache_set(key, stored, seconds=60 * 30, stale_ok=True)
+        return ok(stored, message="OK (cache)")
+
+    payload = singleflight.do(
+        key, partial(_suggest_and_cache, q, key, store_key), lookup=partial(_cached_dict, key),
+    )
     return ok(payload, message="OK")
 
 
@@ -600,7 +1293,10 @@ def reverse(request):
     if res:
         display = res.get("display_name", "")
         return ok(
-            {"lat": lat, "lon": lon, "display": display, "display_address": display, "raw": res},
+            {
+                "lat": lat, "lon": lon, "display": display, "display_address": display,
+                "approximate": bool(res.get("approximate")), "raw": res,
+            },
             message="OK",
         )
     return ok({"lat": lat, "lon": lon, "display": "", "display_address": "", "error": err}, message="NO_RESULT")
@@ -613,17 +1309,29 @@ def geocode(request):
         return bad("Required: q (at least 3 chars)", status=400)
 
     key = _cache_key("geocode", {"q": q.lower()})
-    cached = _cache_get(key)
+    cached = _cache_get(key, refresh=partial(_geocode_and_cache, q, key, refreshing=True))
     if isinstance(cached, dict):
         return ok(cached, message="OK (cache)")
 
-    payload = _resolve_geocode_payload(q)
-    _cache_set(key, payload, seconds=60 * 30)
+    payload = singleflight.do(key, partial(_geocode_and_cache, q, key), lookup=partial(_cached_dict, key))
     return ok(payload, message="OK" if payload.get("location") else "NO_RESULT")
 
 
 @cors_view
 def route_osrm(request):
+    """
+    OSRM route between two points.
+
+    ``mode``: ``full`` (default, the OSRM routes as returned), ``summary``
+    (distance and duration only), ``polyline`` (encoded full geometry) or
+    ``simplified`` (GeoJSON simplified for ``zoom``). ``fields`` lists the
+    step keys to keep (e.g. ``name,distance,maneuver``); outside ``full``
+    mode steps are only included when it is given.
+
+    With ``store=<id>`` instead of ``to``, the origin is snapped to a
+    road-scale cell and the route is kept in the persistent route store,
+    so nearby requests for the same store share it.
+    """
     profile = (request.GET.get("profile") or "driving").strip().lower()
     if profile not in ("driving", "walking", "cycling"):
         profile = "driving"
@@ -631,48 +1339,178 @@ def route_osrm(request):
     frm = (request.GET.get("from") or "").strip()
     to = (request.GET.get("to") or "").strip()
     alternatives = _safe_int(request.GET.get("alternatives", 1), default=1, min_v=0, max_v=3)
+    mode = (request.GET.get("mode") or "full").strip().lower()
+    if mode not in ROUTE_MODES:
+        mode = "full"
+    zoom = _safe_int(request.GET.get("zoom", ROUTE_DEFAULT_ZOOM), default=ROUTE_DEFAULT_ZOOM, min_v=0, max_v=22)
+    fields = tuple(sorted({x.strip() for x in (request.GET.get("fields") or "").split(",") if x.strip()}))
 
     f = _parse_latlon(frm.replace(",", " "))
-    t = _parse_latlon(to.replace(",", " "))
-    if not f or not t:
-        return bad("Required: from=lat,lon and to=lat,lon", status=400)
-
-    flt, fln = f
-    tlt, tln = t
-
-    key = _cache_key("osrm_route", {
-        "profile": profile,
-        "from": [round(flt, 6), round(fln, 6)],
-        "to": [round(tlt, 6), round(tln, 6)],
-        "alternatives": alternatives
-    })
-    cached = _cache_get(key)
+    store_id = _safe_int(request.GET.get("store"), default=None)
+    if f and store_id is not None:
+        store = CuaHang.objects.filter(pk=store_id).values_list("id", "vi_do", "kinh_do").first()
+        if store is None:
+            return bad("Store not found", status=404)
+        key, fetch = _store_route_request(profile, f, store, alternatives, mode, zoom, fields)
+    else:
+        t = _parse_latlon(to.replace(",", " "))
+        if not f or not t:
+            return bad("Required: from=lat,lon and to=lat,lon (or store=<id>)", status=400)
+
+        flt, fln = f
+        tlt, tln = t
+
+        key = _cache_key("osrm_route", {
+            "profile": profile,
+            "from": [round(flt, 6), round(fln, 6)],
+            "to": [round(tlt, 6), round(tln, 6)],
+            "alternatives": alternatives,
+            "mode": mode,
+            "zoom": zoom if mode == "simplified" else None,
+            "fields": fields,
+        })
+        fetch = partial(_osrm_route_and_cache, key, profile, f, t, alternatives, mode, zoom, fields)
+    cached = _cache_get(key, refresh=fetch)
     if isinstance(cached, dict):
         return ok(cached, message="OK (cache)")
 
-    url = f"https://router.project-osrm.org/route/v1/{profile}/{fln},{flt};{tln},{tlt}"
-    params = {
-        "overview": "full",
-        "geometries": "geojson",
-        "steps": "true",
-        "alternatives": "true" if alternatives else "false"
-    }
+    out, err = singleflight.do(key, fetch, lookup=partial(_cached_route, key))
+    if err:
+        # err is shared with coalesced callers, so do not mutate it.
+        extra = {k: v for k, v in err.items() if k not in ("message", "status")}
+        return bad(err["message"], status=err.get("status", 502), **extra)
+    return ok(out, message="OK")
 
-    try:
-        r = requests.get(url, params=params, headers=_headers(), timeout=OSRM_TIMEOUT)
-        if r.status_code != 200:
-            return bad("OSRM error", status=502, status_code=r.status_code, body=r.text[:250])
 
-        data = r.json()
-        if data.get("code") != "Ok":
-            return bad("OSRM not OK", status=502, raw=data)
+@cors_view
+def road_matrix(request):
+    """
+    Road distance and duration from one origin to many stores.
 
-        routes = data.get("routes") or []
-        out = {"profile": profile, "from": {"lat": flt, "lon": fln}, "to": {"lat": tlt, "lon": tln}, "routes": routes}
-        _cache_set(key, out, seconds=60 * 30)
-        return ok(out, message="OK")
-    except Exception as e:
-        return bad("OSRM exception", status=502, exception=str(e))
+    Distances are measured from the centre of the origin's geohash cell and
+    cached per cell and store id, so only the stores missing from the cache
+    go to the router, all in a single table request.
+    """
+    profile = (request.GET.get("profile") or "driving").strip().lower()
+    if profile not in ("driving", "walking", "cycling"):
+        profile = "driving"
+
+    f = _parse_latlon((request.GET.get("from") or "").replace(",", " "))
+    ids = list(dict.fromkeys(
+        int(x) for x in (request.GET.get("ids") or "").split(",") if x.strip().isdigit()
+    ))
+    if not f or not ids:
+        return bad("Required: from=lat,lon and ids=1,2,...", status=400)
+    if len(ids) > ROAD_MATRIX_MAX_STORES:
+        return bad(f"At most {ROAD_MATRIX_MAX_STORES} ids per request", status=400)
+
+    cell, origin = _snap_origin(f[0], f[1], ROAD_MATRIX_GEOHASH_PRECISION)
+    pairs = {}
+    for sid in ids:
+        cached = _cache_get(_road_pair_key(profile, cell, sid))
+        if isinstance(cached, dict):
+            pairs[sid] = cached
+
+    err = None
+    missing = []
+    todo = [sid for sid in ids if sid not in pairs]
+    if todo:
+        coords = {
+            sid: (lat, lon)
+            for sid, lat, lon in CuaHang.objects.filter(id__in=todo).values_list("id", "vi_do", "kinh_do")
+        }
+        missing = [sid for sid in todo if sid not in coords]
+        found = [sid for sid in todo if sid in coords]
+        if found:
+            rows, err = _one_to_many_table(profile, origin, [coords[sid] for sid in found])
+            for sid, (distance_m, duration_s) in zip(found, rows or []):
+                pairs[sid] = {"distance_m": distance_m, "duration_s": duration_s}
+                _cache_set(_road_pair_key(profile, cell, sid), pairs[sid], seconds=ROAD_MATRIX_TTL)
+
+    if err and not pairs:
+        extra = {k: v for k, v in err.items() if k not in ("message", "status")}
+        return bad(err["message"], status=err.get("status", 502), **extra)
+
+    items = [{"id": sid, **pairs[sid]} for sid in ids if sid in pairs]
+    out = {"profile": profile, "from": {"lat": f[0], "lon": f[1]}, "items": items, "missing": missing}
+    if err:
+        out["error"] = err
+    return ok(out, message="OK" if not err else "PARTIAL")
+
+
+@cors_view
+def optimize_visits(request):
+    """
+    Visiting order for a round of store visits.
+
+    ``start=lat,lon`` and ``ids=1,2,...``; ``return=1`` to come back to the
+    start, ``budget_ms`` for the order search. The travel-time matrix comes
+    from one cached table request, and visit_planner orders the stops.
+    """
+    profile = (request.GET.get("profile") or "driving").strip().lower()
+    if profile not in ("driving", "walking", "cycling"):
+        profile = "driving"
+
+    start = _parse_latlon((request.GET.get("start") or "").replace(",", " "))
+    ids = list(dict.fromkeys(
+        int(x) for x in (request.GET.get("ids") or "").split(",") if x.strip().isdigit()
+    ))
+    if not start or not ids:
+        return bad("Required: start=lat,lon and ids=1,2,...", status=400)
+    if len(ids) > OPTIMIZE_VISITS_MAX_STORES:
+        return bad(f"At most {OPTIMIZE_VISITS_MAX_STORES} ids per request", status=400)
+    closed = (request.GET.get("return") or "").strip().lower() in ("1", "true", "yes")
+    budget_ms = _safe_int(
+        request.GET.get("budget_ms", OPTIMIZE_VISITS_BUDGET_MS),
+        default=OPTIMIZE_VISITS_BUDGET_MS, min_v=10, max_v=OPTIMIZE_VISITS_MAX_BUDGET_MS,
+    )
+
+    rows = CuaHang.objects.select_related("chuoi").in_bulk(ids)
+    found = [sid for sid in ids if sid in rows]
+    missing = [sid for sid in ids if sid not in rows]
+    if not found:
+        return bad("No matching stores", status=404, missing=missing)
+
+    cell = geohash.encode(start[0], start[1], ROAD_MATRIX_GEOHASH_PRECISION)
+    points = [start] + [(rows[sid].vi_do, rows[sid].kinh_do) for sid in found]
+    durations, distances, err = _travel_matrix(profile, cell, found, points)
+    if err:
+        extra = {k: v for k, v in err.items() if k not in ("message", "status")}
+        return bad(err["message"], status=err.get("status", 502), **extra)
+
+    order = visit_planner.plan(durations, closed=closed, budget_sec=budget_ms / 1000.0)
+    path = [0, *order, *([0] if closed else [])]
+    legs = []
+    elapsed = 0.0
+    total_m = 0.0
+    unreachable = 0
+    for a, b in zip(path, path[1:]):
+        duration_s, distance_m = durations[a][b], distances[a][b]
+        if duration_s is None:
+            unreachable += 1
+        else:
+            elapsed += duration_s
+            total_m += distance_m or 0.0
+        legs.append({
+            "from_id": found[a - 1] if a else None,
+            "to_id": found[b - 1] if b else None,
+            "duration_s": duration_s,
+            "distance_m": distance_m,
+            "arrival_s": round(elapsed, 1),
+        })
+
+    stops = [_store_dict(rows[found[i - 1]], {"order": n}) for n, i in enumerate(order, start=1)]
+    return ok({
+        "profile": profile,
+        "start": {"lat": start[0], "lon": start[1]},
+        "return_to_start": closed,
+        "stops": stops,
+        "legs": legs,
+        "total_duration_s": round(elapsed, 1),
+        "total_distance_m": round(total_m, 1),
+        "unreachable_legs": unreachable,
+        "missing": missing,
+    }, message="OK")
 
 
 @cors_view
@@ -687,15 +1525,33 @@ def districts(request):
     if brand:
         qs = qs.filter(_brand_q(brand))
 
-    items = sorted({
-        (getattr(s, "quan_huyen", "") or "").strip()
-        for s in qs
-        if (getattr(s, "quan_huyen", "") or "").strip()
-    })
+    if district_index.available():
+        # Only districts with a boundary filter geometrically, so list those.
+        rows = list(qs.values_list("vi_do", "kinh_do"))
+        items = sorted({
+            name for name in district_index.locate_many([r[0] for r in rows], [r[1] for r in rows]) if name
+        })
+    else:
+        items = sorted({
+            (getattr(s, "quan_huyen", "") or "").strip()
+            for s in qs
+            if (getattr(s, "quan_huyen", "") or "").strip()
+        })
     _cache_set(key, items, seconds=CACHE_TTL)
     return ok({"brand": brand or "ALL", "districts": items}, message="OK")
 
 
+@cors_view
+def district_at(request):
+    lat = _safe_float(request.GET.get("lat"))
+    lon = _safe_float(request.GET.get("lon"))
+    if lat is None or lon is None:
+        return bad("Required: lat, lon", status=400)
+    if not district_index.available():
+        return bad("District boundaries are not loaded", status=503)
+    return ok({"lat": lat, "lon": lon, "district": district_index.locate(lat, lon)}, message="OK")
+
+
 @cors_view
 def stores_in_radius(request):
     lat = _safe_float(request.GET.get("lat"))
@@ -710,59 +1566,180 @@ def stores_in_radius(request):
     district = (request.GET.get("district") or "").strip()
 
     limit = _safe_int(request.GET.get("limit", 300), default=300, min_v=1, max_v=1000)
-    offset = _safe_int(request.GET.get("offset", 0), default=0, min_v=0, max_v=100000)
-
-    key = _cache_key("stores_in_radius", {
-        "lat": round(lat, 6), "lon": round(lon, 6),
-        "radius_km": round(radius_km, 3),
-        "brand": brand or "ALL",
-        "district": district.lower(),
-    })
-    cached = _cache_get(key)
-    if isinstance(cached, list):
-        sliced = cached[offset: offset + limit]
-        return ok({
-            "brand": brand or "ALL",
-            "center": {"lat": lat, "lon": lon},
-            "radius_km": radius_km,
-            "total": len(cached),
-            "count": len(sliced),
-            "offset": offset,
-            "limit": limit,
-            "stores": sliced,
-        }, message="OK (cache)")
-
-    qs = CuaHang.objects.select_related("chuoi").all()
-    if brand:
-        qs = qs.filter(_brand_q(brand))
-    if district:
-        qs = qs.filter(quan_huyen__iexact=district)
-
-    qs = _bbox_filter(qs, lat, lon, radius_km)
-
-    result = []
-    for s in qs:
-        d = _haversine_km(lat, lon, float(s.vi_do), float(s.kinh_do))
-        if d <= radius_km:
-            result.append(_store_dict(s, {"distance_km": round(d, 3)}))
-
-    result.sort(key=lambda x: x.get("distance_km", 1e9))
-    if len(result) > MAX_STORES_RETURN:
-        result = result[:MAX_STORES_RETURN]
-
-    _cache_set(key, result, seconds=CACHE_TTL_SHORT)
-
-    sliced = result[offset: offset + limit]
+    offset = _safe_int(request.GET.get("offset", 0), default=0, min_v=0, max_v=MAX_STORES_RETURN)
+    cursor = _decode_cursor(request.GET.get("cursor"))
+    if cursor is None:
+        return bad("Invalid cursor", status=400)
+    if cursor:
+        offset = 0
+
+    candidates, from_cache = _cell_candidates(lat, lon, radius_km, brand=brand, district=district)
+    ids = np.asarray(candidates["ids"], dtype=np.int64)
+    dist = haversine_km_many(lat, lon, candidates["lat"], candidates["lon"])
+    inside = dist <= radius_km
+    total = int(inside.sum())
+
+    # Keyset on (distance, id): only rows after the cursor are ranked and
+    # only the requested page is loaded and serialized.
+    mask = inside
+    if cursor:
+        c_dist = _safe_float(cursor.get("d"), 0.0)
+        c_id = _safe_int(cursor.get("id"))
+        mask = inside & ((dist > c_dist) | ((dist == c_dist) & (ids > c_id)))
+    idx = np.flatnonzero(mask)
+    idx = idx[np.lexsort((ids[idx], dist[idx]))][: offset + limit + 1]
+    hits = [(float(dist[i]), int(ids[i])) for i in idx.tolist()]
+    page = hits[offset: offset + limit]
+    next_cursor = None
+    if len(hits) > offset + limit:
+        next_cursor = _encode_cursor({"d": page[-1][0], "id": page[-1][1]})
+
+    sliced = _stores_for_hits(page)
     return ok({
         "brand": brand or "ALL",
         "center": {"lat": lat, "lon": lon},
         "radius_km": radius_km,
-        "total": len(result),
+        "total": total,
         "count": len(sliced),
         "offset": offset,
         "limit": limit,
+        "next_cursor": next_cursor,
         "stores": sliced,
-    }, message="OK")
+    }, message="OK (cache)" if from_cache else "OK")
+
+
+@cors_view
+def nearest(request):
+    lat = _safe_float(request.GET.get("lat"))
+    lon = _safe_float(request.GET.get("lon"))
+    if lat is None or lon is None:
+        return bad("Required: lat, lon", status=400)
+
+    k = _safe_int(request.GET.get("k", 5), default=5, min_v=1, max_v=NEAREST_MAX_K)
+    brand = _normalize_brand(request.GET.get("brand", ""))
+    district = (request.GET.get("district") or "").strip()
+    open_now = (request.GET.get("open_now") or "").strip().lower() in ("1", "true", "yes", "on")
+    max_km = _safe_float(request.GET.get("max_km"))
+    if max_km is not None and max_km <= 0:
+        return bad("max_km must be > 0", status=400)
+
+    open_at = timezone.localtime().time() if open_now else None
+    hits = _nearest_hits(lat, lon, k, brand=brand, district=district, open_at=open_at, max_km=max_km)
+    stores = _stores_for_hits(hits)
+    return ok({
+        "brand": brand or "ALL",
+        "center": {"lat": lat, "lon": lon},
+        "k": k,
+        "district": district,
+        "open_now": open_now,
+        "max_km": max_km,
+        "count": len(stores),
+        "stores": stores,
+    }, message="OK" if stores else "NO_RESULT")
+
+
+def _batch_origin(item, known=None):
+    """
+    Resolve one nearest-batch input to ``(lat, lon, geocode_info)``.
+    ``known`` maps geocode store keys to payloads prefetched for the chunk.
+    """
+    if not isinstance(item, dict):
+        return None, None, {"error": "INVALID_POINT"}
+    lat = _safe_float(item.get("lat"))
+    lon = _safe_float(item.get("lon", item.get("lng")))
+    if lat is not None and lon is not None:
+        return lat, lon, None
+    address = item.get("address")
+    if not isinstance(address, str) or len(address.strip()) < 3:
+        return None, None, {"error": "INVALID_POINT"}
+    address = address.strip()
+    latlon = _parse_latlon(address)
+    if latlon:
+        return latlon[0], latlon[1], None
+    geo = (known or {}).get(_geocode_store_key(address)) or _geocode_cached(address)
+    info = {"provider": geo.get("provider"), "score": geo.get("score")}
+    loc = geo.get("location")
+    if loc and loc.get("lat") is not None and loc.get("lon") is not None:
+        return float(loc["lat"]), float(loc["lon"]), info
+    info["error"] = "GEOCODE_FAILED"
+    return None, None, info
+
+
+def _iter_nearest_batch(points, brand, k, max_km):
+    """Yield one result per input point, in input order, a chunk at a time."""
+    brands = _brand_names(brand)
+    for start in range(0, len(points), NEAREST_BATCH_CHUNK):
+        chunk = points[start: start + NEAREST_BATCH_CHUNK]
+        known = geocode_store.prefetch("geocode", [
+            _geocode_store_key(p["address"])
+            for p in chunk
+            if isinstance(p, dict) and isinstance(p.get("address"), str) and p.get("lat") is None
+        ])
+        origins = [_batch_origin(p, known) for p in chunk]
+        valid = [i for i, o in enumerate(origins) if o[0] is not None]
+        joined = store_index.nearest_many(
+            [origins[i][0] for i in valid], [origins[i][1] for i in valid],
+            k=k, brands=brands, max_km=max_km,
+        )
+        hits_by_row = dict(zip(valid, joined))
+        rows = CuaHang.objects.select_related("chuoi").in_bulk(
+            {sid for hits in joined for _, sid in hits}
+        )
+        for i, (lat, lon, info) in enumerate(origins):
+            hits = hits_by_row.get(i, [])
+            yield {
+                "index": start + i,
+                "location": {"lat": lat, "lon": lon} if lat is not None else None,
+                "geocode": info,
+                "stores": [
+                    _store_dict(rows[sid], {"distance_km": round(d, 3)})
+                    for d, sid in hits
+                    if sid in rows
+                ],
+            }
+
+
+@csrf_exempt
+@cors_view
+def nearest_batch(request):
+    if request.method != "POST":
+        return bad("Method not allowed", status=405)
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+    except Exception:
+        return bad("Body must be JSON", status=400)
+    if not isinstance(data, dict):
+        return bad("Body must be a JSON object", status=400)
+
+    points = data.get("points")
+    if not isinstance(points, list) or not points:
+        return bad("Required: points (non-empty array of {lat, lon} or {address})", status=400)
+    if len(points) > NEAREST_BATCH_MAX_POINTS:
+        return bad(f"At most {NEAREST_BATCH_MAX_POINTS} points per batch", status=413)
+    addresses = sum(
+        1 for p in points if isinstance(p, dict) and isinstance(p.get("address"), str) and p.get("lat") is None
+    )
+    if addresses > NEAREST_BATCH_MAX_ADDRESSES:
+        return bad(f"At most {NEAREST_BATCH_MAX_ADDRESSES} addresses per batch", status=413)
+
+    brand = _normalize_brand(data.get("brand", ""))
+    k = _safe_int(data.get("k", 1), default=1, min_v=1, max_v=NEAREST_MAX_K)
+    max_km = _safe_float(data.get("max_km"))
+    if max_km is not None and max_km <= 0:
+        return bad("max_km must be > 0", status=400)
+    stream = bool(data.get("stream")) or len(points) > NEAREST_BATCH_STREAM_OVER
+
+    results = _iter_nearest_batch(points, brand, k, max_km)
+    header = {"ok": True, "tool": "nearest_batch", "brand": brand or "ALL", "k": k, "count": len(points)}
+    if stream:
+        lines = (
+            json.dumps(x, ensure_ascii=False) + "\n"
+            for x in itertools.chain([header], results)
+        )
+        return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+    header.pop("ok")
+    return ok({**header, "results": list(results)}, message="OK")
 
 
 @cors_view
@@ -778,47 +1755,102 @@ def stores_in_bounds(request):
     district = (request.GET.get("district") or "").strip()
     limit = _safe_int(request.GET.get("limit", 500), default=500, min_v=1, max_v=2000)
 
+    zoom = request.GET.get("zoom")
+    if zoom not in (None, ""):
+        zoom = _safe_int(zoom, default=CLUSTER_UNTIL_ZOOM, min_v=0, max_v=22)
+        if zoom < CLUSTER_UNTIL_ZOOM:
+            clusters = store_index.clusters(
+                zoom, south, west, north, east,
+                brands=_brand_names(brand), district=district,
+            )
+            return ok({
+                "brand": brand or "ALL",
+                "bounds": {"south": south, "west": west, "north": north, "east": east},
+                "mode": "clusters",
+                "zoom": zoom,
+                "cluster_until_zoom": CLUSTER_UNTIL_ZOOM,
+                "total": sum(c["count"] for c in clusters),
+                "count": len(clusters),
+                "clusters": clusters,
+                "stores": [],
+            }, message="OK")
+
     qs = CuaHang.objects.select_related("chuoi").all()
     if brand:
         qs = qs.filter(_brand_q(brand))
     if district:
-        qs = qs.filter(quan_huyen__iexact=district)
+        qs = _district_filter(qs, district)
 
-    qs = qs.filter(
-        vi_do__gte=min(south, north),
-        vi_do__lte=max(south, north),
-        kinh_do__gte=min(west, east),
-        kinh_do__lte=max(west, east),
-    )[:limit]
+    cursor = _decode_cursor(request.GET.get("cursor"))
+    if cursor is None:
+        return bad("Invalid cursor", status=400)
 
-    stores = [_store_dict(s) for s in qs]
+    rows, next_cursor = _id_page(_bounds_filter(qs, south, west, north, east), cursor, limit)
+    stores = [_store_dict(s) for s in rows]
     return ok({
         "brand": brand or "ALL",
         "bounds": {"south": south, "west": west, "north": north, "east": east},
+        "mode": "stores",
         "count": len(stores),
+        "next_cursor": next_cursor,
         "stores": stores,
     }, message="OK")
 
 
+@cors_view
+def store_tile(request, z, x, y):
+    n = 2 ** z if 0 <= z <= tile_cache.TILE_MAX_ZOOM else 0
+    if z < tile_cache.TILE_MIN_ZOOM or not (0 <= x < n and 0 <= y < n):
+        return bad("Tile out of range", status=404)
+
+    data = tile_cache.read(z, x, y)
+    if data is None:
+        south, west, north, east = tile_bounds(z, x, y, buffer=TILE_BUFFER_PX / MVT_EXTENT)
+        rows = _bounds_filter(CuaHang.objects.all(), south, west, north, east).values_list(
+            "id", "vi_do", "kinh_do", "chuoi__ten", "quan_huyen", "hoat_dong_24h",
+        )
+        features = [
+            (sid, lat, lon, {"brand": brand or "", "is_24h": bool(is_24h), "district": district or ""})
+            for sid, lat, lon, brand, district, is_24h in rows
+        ]
+        data = encode_point_layer("stores", features, z, x, y, buffer=TILE_BUFFER_PX)
+        tile_cache.write(z, x, y, data)
+
+    etag = '"%s"' % hashlib.md5(data).hexdigest()
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        resp = HttpResponse(status=304)
+    else:
+        resp = HttpResponse(data, content_type="application/vnd.mapbox-vector-tile")
+    resp["ETag"] = etag
+    resp["Cache-Control"] = f"public, max-age={TILE_HTTP_MAX_AGE}"
+    return resp
+
+
 @cors_view
 def search_stores(request):
     q = (request.GET.get("q") or "").strip()
     brand = _normalize_brand(request.GET.get("brand", ""))
     district = (request.GET.get("district") or "").strip()
     limit = _safe_int(request.GET.get("limit", 200), default=200, min_v=1, max_v=1000)
+    cursor = _decode_cursor(request.GET.get("cursor"))
+    if cursor is None:
+        return bad("Invalid cursor", status=400)
 
     qs = CuaHang.objects.select_related("chuoi").all()
     if brand:
         qs = qs.filter(_brand_q(brand))
     if district:
-        qs = qs.filter(quan_huyen__iexact=district)
+        qs = _district_filter(qs, district)
 
     if q:
         qs = qs.filter(Q(ten__icontains=q) | Q(dia_chi__icontains=q))
 
-    qs = qs[:limit]
-    stores = [_store_dict(s) for s in qs]
-    return ok({"q": q, "brand": brand or "ALL", "district": district, "count": len(stores), "stores": stores}, message="OK")
+    rows, next_cursor = _id_page(qs, cursor, limit)
+    stores = [_store_dict(s) for s in rows]
+    return ok({
+        "q": q, "brand": brand or "ALL", "district": district,
+        "count": len(stores), "next_cursor": next_cursor, "stores": stores,
+    }, message="OK")
 
 
 @csrf_exempt
@@ -867,7 +1899,7 @@ def smart_search(request):
             lat, lng = latlon
             mode = "latlon_from_text"
         else:
-            geo = _resolve_geocode_payload(dia_chi)
+            geo = _geocode_cached(dia_chi)
             geocode_info = {
                 "provider": geo.get("provider"),
                 "score": geo.get("score"),
@@ -892,18 +1924,8 @@ def smart_search(request):
             lat, lng = DEFAULT_CENTER
             mode = "default"
 
-    candidates = _bbox_filter(
-        CuaHang.objects.select_related("chuoi").filter(_brand_q(brand)),
-        lat, lng, max_km
-    )
-
-    stores_list = []
-    for s in candidates:
-        d = _haversine_km(lat, lng, float(s.vi_do), float(s.kinh_do))
-        if d <= max_km:
-            stores_list.append(_store_dict(s, {"distance_km": round(d, 3)}))
-
-    stores_list.sort(key=lambda x: x.get("distance_km", 1e9))
+    hits = _radius_hits(lat, lng, max_km, brand=brand)
+    stores_list = _stores_for_hits(hits[:300])
     store_data = stores_list[0] if stores_list else None
 
     return JsonResponse({
@@ -914,8 +1936,8 @@ def smart_search(request):
         "input": {"ten": ten, "dia_chi": dia_chi, "lat": lat, "lng": lng, "brand": brand, "max_km": max_km},
         "location": {"lat": lat, "lon": lng, "display_address": dia_chi or "TP.HCM"},
         "store": store_data,
-        "count": len(stores_list),
-        "stores": stores_list[:300],
-        "message": f"Tim thay {len(stores_list)} cua hang trong {max_km} km.",
+        "count": len(hits),
+        "stores": stores_list,
+        "message": f"Tim thay {len(hits)} cua hang trong {max_km} km.",
     })
 
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from modules.spatial.services import tile_cache
+from modules.spatial.services.district_index import district_index, district_key
+from modules.spatial.services.store_index import bump_store_generation, store_index
+from modules.store.models import CuaHang
+
+
+class Command(BaseCommand):
+    help = "Check CuaHang.quan_huyen against the district boundary polygons, and optionally fix it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Write the polygon district into quan_huyen.")
+        parser.add_argument("--only-empty", action="store_true", help="Only fill stores with a blank quan_huyen.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not district_index.available():
+            raise CommandError("District boundaries are not loaded (check SPATIAL_DISTRICTS_GEOJSON and shapely).")
+
+        rows = list(CuaHang.objects.values_list("id", "ten", "quan_huyen", "vi_do", "kinh_do").order_by("id"))
+        located = district_index.locate_many([r[3] for r in rows], [r[4] for r in rows])
+
+        changes, outside = [], 0
+        for (sid, ten, current, _, _), name in zip(rows, located):
+            if name is None:
+                outside += 1
+                continue
+            current = (current or "").strip()
+            if options["only_empty"] and current:
+                continue
+            if district_key(current) != district_key(name):
+                changes.append((sid, ten, current, name))
+
+        for sid, ten, current, name in changes:
+            self.stdout.write(f"#{sid} {ten}: {current or '(empty)'} -> {name}")
+        self.stdout.write(
+            f"{len(rows)} stores, {len(changes)} mismatched, {outside} outside every boundary."
+        )
+        if not options["fix"] or not changes:
+            return
+
+        stores = [CuaHang(id=sid, quan_huyen=name[:50]) for sid, _, _, name in changes]
+        with transaction.atomic():
+            CuaHang.objects.bulk_update(stores, ["quan_huyen"], batch_size=options["batch_size"])
+        # bulk_update skips the model signals, so refresh the spatial caches here.
+        store_index.invalidate()
+        bump_store_generation()
+        tile_cache.clear()
+        self.stdout.write(self.style.SUCCESS(f"Updated quan_huyen on {len(stores)} stores."))
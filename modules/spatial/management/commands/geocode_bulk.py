@@ -0,0 +1,130 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from modules.spatial import controllers
+
+RESULT_FIELDS = ["lat", "lon", "display", "provider", "score", "confidence", "error"]
+HIGH_CONFIDENCE_SCORE = 0.6
+
+
+def _confidence(payload):
+    score = payload.get("score") or 0.0
+    if not payload.get("location"):
+        return "none"
+    if score >= HIGH_CONFIDENCE_SCORE:
+        return "high"
+    return "medium" if score >= controllers.GEOCODE_MIN_SCORE else "low"
+
+
+def _read_rows(path, column):
+    """Input rows as dicts; the address is under ``column`` (or ``dia_chi``)."""
+    if path.suffix.lower() == ".json":
+        with open(path, encoding="utf-8-sig") as fh:
+            data = json.load(fh)
+        if not isinstance(data, list):
+            raise CommandError("JSON input must be an array of addresses or objects")
+        return [row if isinstance(row, dict) else {column: row} for row in data]
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def _address(row, column):
+    return str(row.get(column) or row.get("dia_chi") or "").strip()
+
+
+def _geocode(address):
+    try:
+        if len(address) < 3:
+            return {"location": None, "error": "EMPTY_ADDRESS"}
+        return controllers._geocode_cached(address)
+    finally:
+        # Worker threads open their own connections (geocode store, local index).
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Geocode a CSV or JSON file of addresses with the geocode pipeline "
+        "(local index, stored results, rate-limited providers), resumably."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="CSV with a header row, or a JSON array of strings/objects.")
+        parser.add_argument("--output", help="Result file (.csv or .jsonl). Default: <input>.geocoded.csv")
+        parser.add_argument("--column", default="address", help="Address column/key (default: address, then dia_chi).")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent geocodes (providers stay rate limited).")
+        parser.add_argument("--batch-size", type=int, default=100, help="Rows per write and checkpoint.")
+        parser.add_argument("--limit", type=int, help="Stop after this many rows in this run.")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over.")
+
+    def handle(self, *args, **options):
+        src = Path(options["input"])
+        if not src.exists():
+            raise CommandError(f"Input not found: {src}")
+        out = Path(options["output"] or src.with_suffix(".geocoded.csv"))
+        checkpoint = out.with_name(out.name + ".checkpoint")
+        column = options["column"]
+        batch_size = max(1, options["batch_size"])
+
+        rows = _read_rows(src, column)
+        start = 0
+        if checkpoint.exists() and not options["restart"]:
+            start = json.loads(checkpoint.read_text(encoding="utf-8")).get("next_index", 0)
+            self.stdout.write(f"Resuming at row {start} of {len(rows)}.")
+        elif out.exists():
+            out.unlink()
+        stop = len(rows) if options["limit"] is None else min(len(rows), start + options["limit"])
+
+        fields = list(dict.fromkeys(["index", *(k for row in rows for k in row), *RESULT_FIELDS]))
+        found = 0
+        with ThreadPoolExecutor(max_workers=max(1, options["workers"])) as pool:
+            for a in range(start, stop, batch_size):
+                batch = rows[a: min(a + batch_size, stop)]
+                payloads = list(pool.map(_geocode, [_address(r, column) for r in batch]))
+                results = []
+                for i, (row, payload) in enumerate(zip(batch, payloads), start=a):
+                    loc = payload.get("location") or {}
+                    found += bool(loc)
+                    results.append({
+                        **row,
+                        "index": i,
+                        "lat": loc.get("lat"),
+                        "lon": loc.get("lon"),
+                        "display": loc.get("display", ""),
+                        "provider": payload.get("provider") or "",
+                        "score": payload.get("score"),
+                        "confidence": _confidence(payload),
+                        "error": "" if loc else json.dumps(payload.get("error"), ensure_ascii=False),
+                    })
+                self._append(out, fields, results)
+                self._save_checkpoint(checkpoint, a + len(batch))
+                self.stdout.write(f"{a + len(batch)}/{len(rows)} rows")
+
+        if stop >= len(rows) and checkpoint.exists():
+            checkpoint.unlink()
+        self.stdout.write(self.style.SUCCESS(
+            f"Geocoded {found} of {stop - start} rows this run; results in {out}."
+        ))
+
+    def _append(self, out, fields, results):
+        new_file = not out.exists()
+        with open(out, "a", encoding="utf-8", newline="") as fh:
+            if out.suffix.lower() == ".jsonl":
+                for r in results:
+                    fh.write(json.dumps(r, ensure_ascii=False) + "\n")
+                return
+            writer = csv.DictWriter(fh, fieldnames=fields, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows(results)
+
+    def _save_checkpoint(self, path, next_index):
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps({"next_index": next_index}), encoding="utf-8")
+        os.replace(tmp, path)
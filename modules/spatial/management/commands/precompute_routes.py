@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from modules.spatial import controllers
+from modules.spatial.services import route_store
+from modules.spatial.services.store_index import store_index
+from modules.spatial.utils import geohash
+from modules.spatial.utils.geo import parse_latlon
+from modules.store.models import CuaHang
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the persistent route cache with routes from the most requested "
+        "origin cells (and any --from points) to their nearest stores."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", default="driving", choices=["driving", "walking", "cycling"])
+        parser.add_argument("--cells", type=int, default=50, help="Most requested origin cells to use.")
+        parser.add_argument("--from", dest="origins", action="append", default=[], help="Extra origin lat,lon (repeatable).")
+        parser.add_argument("--stores", type=int, default=5, help="Nearest stores per origin cell.")
+        parser.add_argument("--mode", default="full", choices=list(controllers.ROUTE_MODES))
+        parser.add_argument("--zoom", type=int, default=controllers.ROUTE_DEFAULT_ZOOM)
+        parser.add_argument("--alternatives", type=int, default=1, help="Same meaning as in /tools/route-osrm/.")
+
+    def handle(self, *args, **options):
+        profile, mode, zoom, alternatives = options["profile"], options["mode"], options["zoom"], options["alternatives"]
+        cells = [cell for cell, _ in route_store.popular_cells(profile, max(0, options["cells"]))]
+        for raw in options["origins"]:
+            point = parse_latlon(raw)
+            if point is None:
+                raise CommandError(f"Invalid --from point: {raw}")
+            cells.append(controllers._snap_origin(*point)[0])
+        cells = list(dict.fromkeys(cells))
+
+        variant = controllers._store_route_variant(alternatives, mode, zoom, ())
+        fetched = skipped = failed = 0
+        for cell in cells:
+            south, west, north, east = geohash.bounds(cell)
+            origin = ((south + north) / 2, (west + east) / 2)
+            hits = store_index.nearest(origin[0], origin[1], k=max(1, options["stores"]))
+            stores = CuaHang.objects.in_bulk([sid for _, sid in hits])
+            for _, sid in hits:
+                if sid not in stores:
+                    continue
+                if route_store.exists(profile, cell, sid, variant):
+                    skipped += 1
+                    continue
+                store = (sid, stores[sid].vi_do, stores[sid].kinh_do)
+                _, fetch = controllers._store_route_request(profile, origin, store, alternatives, mode, zoom, ())
+                _, err = fetch()
+                if err:
+                    failed += 1
+                    self.stderr.write(f"{cell} -> {sid}: {err['message']}")
+                else:
+                    fetched += 1
+
+        evicted = route_store.evict()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(cells)} origin cells: {fetched} routes fetched, {skipped} already cached, "
+            f"{failed} failed, {evicted} evicted."
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from modules.spatial.services import geocode_store
+
+
+class Command(BaseCommand):
+    help = "Delete expired rows from the persistent geocode cache."
+
+    def handle(self, *args, **options):
+        deleted = geocode_store.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired geocode cache rows."))
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('geocode', 'Geocode'), ('suggest', 'Suggest'), ('reverse', 'Reverse')], max_length=16, verbose_name='Loại')),
+                ('key', models.CharField(help_text='md5 của truy vấn đã chuẩn hóa', max_length=32, verbose_name='Khóa')),
+                ('query', models.TextField(verbose_name='Truy vấn chuẩn hóa')),
+                ('provider', models.CharField(blank=True, max_length=32, verbose_name='Nguồn')),
+                ('score', models.FloatField(blank=True, null=True, verbose_name='Điểm')),
+                ('payload', models.JSONField(verbose_name='Kết quả')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Lượt dùng')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Tạo lúc')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Cập nhật lúc')),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True, verbose_name='Dùng lần cuối')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Hết hạn')),
+            ],
+            options={
+                'verbose_name': 'Bộ đệm geocode',
+                'verbose_name_plural': 'Bộ đệm geocode',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'key'), name='spatial_geocodecache_kind_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gis_store', '0013_cuahang_geog_postgis'),
+        ('spatial', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile', models.CharField(max_length=16, verbose_name='Phương tiện')),
+                ('origin_cell', models.CharField(help_text='geohash của điểm xuất phát đã làm tròn', max_length=12, verbose_name='Ô xuất phát')),
+                ('variant', models.CharField(help_text='md5 của mode/zoom/fields/alternatives', max_length=32, verbose_name='Biến thể')),
+                ('distance_m', models.FloatField(blank=True, null=True, verbose_name='Quãng đường (m)')),
+                ('duration_s', models.FloatField(blank=True, null=True, verbose_name='Thời gian (s)')),
+                ('payload', models.JSONField(verbose_name='Kết quả')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Lượt dùng')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Tạo lúc')),
+                ('last_hit_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Dùng lần cuối')),
+                ('cua_hang', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gis_store.cuahang', verbose_name='Cửa hàng')),
+            ],
+            options={
+                'verbose_name': 'Bộ đệm tuyến đường',
+                'verbose_name_plural': 'Bộ đệm tuyến đường',
+                'constraints': [models.UniqueConstraint(fields=('profile', 'origin_cell', 'cua_hang', 'variant'), name='spatial_routecache_origin_store_variant')],
+            },
+        ),
+    ]
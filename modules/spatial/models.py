@@ -0,0 +1,70 @@
+from django.db import models
+from django.utils import timezone
+
+
+class GeocodeCache(models.Model):
+    """Persistent geocode / suggest / reverse-geocode results shared by all workers."""
+
+    KIND_GEOCODE = "geocode"
+    KIND_SUGGEST = "suggest"
+    KIND_REVERSE = "reverse"
+    KIND_CHOICES = [
+        (KIND_GEOCODE, "Geocode"),
+        (KIND_SUGGEST, "Suggest"),
+        (KIND_REVERSE, "Reverse"),
+    ]
+
+    kind = models.CharField("Loại", max_length=16, choices=KIND_CHOICES)
+    key = models.CharField("Khóa", max_length=32, help_text="md5 của truy vấn đã chuẩn hóa")
+    query = models.TextField("Truy vấn chuẩn hóa")
+    provider = models.CharField("Nguồn", max_length=32, blank=True)
+    score = models.FloatField("Điểm", null=True, blank=True)
+    payload = models.JSONField("Kết quả")
+    hits = models.PositiveIntegerField("Lượt dùng", default=0)
+    created_at = models.DateTimeField("Tạo lúc", auto_now_add=True)
+    updated_at = models.DateTimeField("Cập nhật lúc", auto_now=True)
+    last_hit_at = models.DateTimeField("Dùng lần cuối", null=True, blank=True)
+    expires_at = models.DateTimeField("Hết hạn", db_index=True)
+
+    class Meta:
+        verbose_name = "Bộ đệm geocode"
+        verbose_name_plural = "Bộ đệm geocode"
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "key"], name="spatial_geocodecache_kind_key"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind}: {self.query[:60]}"
+
+
+class RouteCache(models.Model):
+    """Routes from a snapped origin cell to a store, evicted least recently used first."""
+
+    profile = models.CharField("Phương tiện", max_length=16)
+    origin_cell = models.CharField("Ô xuất phát", max_length=12, help_text="geohash của điểm xuất phát đã làm tròn")
+    cua_hang = models.ForeignKey(
+        "gis_store.CuaHang",
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Cửa hàng",
+    )
+    variant = models.CharField("Biến thể", max_length=32, help_text="md5 của mode/zoom/fields/alternatives")
+    distance_m = models.FloatField("Quãng đường (m)", null=True, blank=True)
+    duration_s = models.FloatField("Thời gian (s)", null=True, blank=True)
+    payload = models.JSONField("Kết quả")
+    hits = models.PositiveIntegerField("Lượt dùng", default=0)
+    created_at = models.DateTimeField("Tạo lúc", auto_now_add=True)
+    last_hit_at = models.DateTimeField("Dùng lần cuối", default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Bộ đệm tuyến đường"
+        verbose_name_plural = "Bộ đệm tuyến đường"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["profile", "origin_cell", "cua_hang", "variant"],
+                name="spatial_routecache_origin_store_variant",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.profile}: {self.origin_cell} -> {self.cua_hang_id}"
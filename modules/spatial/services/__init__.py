@@ -1,4 +1,5 @@
-﻿from .geocoding_service import request_nominatim
+﻿from .geocoding_service import request_nominatim, request_photon
 from .routing_service import request_osrm
+from .store_index import store_index
 
-__all__ = ['request_nominatim', 'request_osrm']
+__all__ = ['request_nominatim', 'request_osrm', 'request_photon', 'store_index']
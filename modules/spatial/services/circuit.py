@@ -0,0 +1,151 @@
+"""
+Per-provider circuit breakers with rolling latency and error statistics.
+
+Each upstream (``"nominatim"``, ``"photon"``, ``"osrm"``) has a breaker that
+keeps the outcomes of its recent calls. It opens when enough recent calls
+failed, so callers skip the provider at once instead of waiting out
+timeouts. After a cooldown it half-opens and lets a single probe through;
+the probe's outcome closes it again or restarts a longer cooldown. State is
+per process: each worker learns about a degraded upstream on its own, which
+takes only ``MIN_CALLS`` failures.
+"""
+
+import threading
+import time
+from collections import deque
+
+WINDOW_SEC = 60
+WINDOW_MAX_CALLS = 50
+MIN_CALLS = 4  # calls in the window before the error rate can open the circuit
+ERROR_RATE_OPEN = 0.5
+CONSECUTIVE_FAILURES_OPEN = 3
+COOLDOWN_SEC = 15
+COOLDOWN_MAX_SEC = 300
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=WINDOW_MAX_CALLS)  # (monotonic ts, ok, latency_s)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._cooldown = COOLDOWN_SEC
+        self._consecutive_failures = 0
+        self._probing = False
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > WINDOW_SEC:
+            self._calls.popleft()
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """True if a call may go out now; in half-open state only one probe at a time."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self._cooldown:
+                    return False
+                self._state = HALF_OPEN
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok, latency):
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, bool(ok), latency))
+            self._trim(now)
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self._state = CLOSED
+                    self._cooldown = COOLDOWN_SEC
+                    self._consecutive_failures = 0
+                    self._calls.clear()
+                else:
+                    self._cooldown = min(self._cooldown * 2, COOLDOWN_MAX_SEC)
+                    self._open(now)
+                return
+
+            self._consecutive_failures = 0 if ok else self._consecutive_failures + 1
+            if self._state == CLOSED and (
+                self._consecutive_failures >= CONSECUTIVE_FAILURES_OPEN
+                or (len(self._calls) >= MIN_CALLS and self._error_rate() >= ERROR_RATE_OPEN)
+            ):
+                self._open(now)
+
+    def _error_rate(self):
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, ok, _ in self._calls if not ok) / len(self._calls)
+
+    def _latency(self, q):
+        values = sorted(latency for _, _, latency in self._calls)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def health(self):
+        """Lower is healthier: error rate first, then median latency."""
+        with self._lock:
+            self._trim(time.monotonic())
+            return self._error_rate(), self._latency(0.5)
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "state": state,
+                "calls": len(self._calls),
+                "error_rate": round(self._error_rate(), 3),
+                "p50_ms": round(self._latency(0.5) * 1000),
+                "p95_ms": round(self._latency(0.95) * 1000),
+            }
+
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def breaker(name):
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def ordered(names):
+    """``names`` healthiest first, leaving out providers whose circuit is open."""
+    live = [n for n in names if breaker(n).state != OPEN]
+    return sorted(live, key=lambda n: breaker(n).health())
+
+
+def snapshot():
+    with _registry_lock:
+        names = sorted(_breakers)
+    return {n: breaker(n).stats() for n in names}
+
+
+def reset():
+    with _registry_lock:
+        _breakers.clear()
@@ -0,0 +1,165 @@
+"""
+Administrative district polygons for point-in-district lookups.
+
+Boundaries are read from the GeoJSON FeatureCollection at
+``settings.SPATIAL_DISTRICTS_GEOJSON`` (one Polygon or MultiPolygon feature
+per district, named by one of ``NAME_PROPERTIES``) and kept in a Shapely
+STR-tree. The file is reloaded when its mtime changes. Without the file or
+without Shapely the index is empty, ``available()`` is False, and callers
+keep the ``quan_huyen`` text match.
+"""
+
+import json
+import logging
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from modules.spatial.utils.text import strip_accents
+
+try:
+    import shapely
+    from shapely.geometry import shape
+    from shapely.strtree import STRtree
+except ImportError:  # pragma: no cover - optional dependency
+    shapely = None
+
+logger = logging.getLogger(__name__)
+
+NAME_PROPERTIES = ("quan_huyen", "name", "ten", "district", "NAME_2")
+
+_PREFIX_RE = re.compile(r"^(quan|huyen|thanh pho|tp|thi xa|district|q)(?:\b\.?\s*|(?=\d))")
+
+
+def district_key(name: str) -> str:
+    """Comparable form of a district name: "Quận 1", "Q.01" and "quan 1" all give "1"."""
+    s = strip_accents(name or "").replace("đ", "d").replace("Đ", "D").lower()
+    s = re.sub(r"\s+", " ", s).strip()
+    s = _PREFIX_RE.sub("", s).strip()
+    return str(int(s)) if s.isdigit() else s
+
+
+def _feature_name(props):
+    for key in NAME_PROPERTIES:
+        value = (props or {}).get(key)
+        if value:
+            return str(value).strip()
+    return ""
+
+
+class DistrictIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None  # (path, mtime) of the loaded file
+        self._names = []
+        self._geoms = []
+        self._by_key = {}
+        self._tree = None
+
+    def _path(self):
+        path = getattr(settings, "SPATIAL_DISTRICTS_GEOJSON", None)
+        return Path(path) if path else None
+
+    def _ensure(self):
+        path = self._path()
+        try:
+            source = (str(path), path.stat().st_mtime) if path and shapely is not None else None
+        except OSError:
+            source = None
+        if source == self._source:
+            return
+        with self._lock:
+            if source != self._source:
+                self._load(path if source else None)
+                self._source = source
+
+    def _load(self, path):
+        names, geoms = [], []
+        if path is not None:
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    features = json.load(fh).get("features") or []
+            except (OSError, ValueError, AttributeError):
+                logger.exception("Could not read district boundaries from %s", path)
+                features = []
+            for feature in features:
+                name = _feature_name(feature.get("properties"))
+                geometry = feature.get("geometry") or {}
+                if not name or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+                    continue
+                geom = shape(geometry)
+                shapely.prepare(geom)
+                names.append(name)
+                geoms.append(geom)
+        self._names = names
+        self._geoms = geoms
+        self._by_key = {district_key(n): i for i, n in enumerate(names)}
+        self._tree = STRtree(geoms) if geoms else None
+
+    def invalidate(self):
+        with self._lock:
+            self._source = None
+
+    def available(self):
+        self._ensure()
+        return self._tree is not None
+
+    def names(self):
+        self._ensure()
+        return sorted(self._names)
+
+    def _index_of(self, name):
+        self._ensure()
+        return self._by_key.get(district_key(name))
+
+    def canonical(self, name):
+        """Boundary name matching a free-text district, or None if it has no polygon."""
+        i = self._index_of(name)
+        return None if i is None else self._names[i]
+
+    def bounds(self, name):
+        """``(south, west, north, east)`` of the district polygon, or None."""
+        i = self._index_of(name)
+        if i is None:
+            return None
+        west, south, east, north = self._geoms[i].bounds
+        return south, west, north, east
+
+    def wkt(self, name):
+        i = self._index_of(name)
+        return None if i is None else self._geoms[i].wkt
+
+    def locate_many(self, lats, lons):
+        """District name (or None) for each point; boundary points count as inside."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        out = [None] * len(lats)
+        self._ensure()
+        tree, names = self._tree, self._names
+        if tree is None or not len(lats):
+            return out
+        point_idx, geom_idx = tree.query(shapely.points(lons, lats), predicate="intersects")
+        # Several hits only happen on shared borders; keep the first polygon.
+        for p, g in sorted(zip(point_idx.tolist(), geom_idx.tolist()), reverse=True):
+            out[p] = names[g]
+        return out
+
+    def locate(self, lat, lon):
+        return self.locate_many([lat], [lon])[0]
+
+    def contains_mask(self, name, lats, lons):
+        """Boolean mask of points inside the district, or None if it has no polygon."""
+        i = self._index_of(name)
+        if i is None:
+            return None
+        return shapely.intersects_xy(
+            self._geoms[i],
+            np.asarray(lons, dtype=np.float64),
+            np.asarray(lats, dtype=np.float64),
+        )
+
+
+district_index = DistrictIndex()
@@ -0,0 +1,107 @@
+"""
+Database-backed store for geocode, suggest and reverse-geocode results.
+
+Rows are keyed by ``(kind, md5(query))`` where ``query`` is already
+normalized by the caller, so every worker and every restart shares the same
+warm results. Reads skip expired rows and bump the hit counter; the
+per-process cache in front of this store keeps the hot path off the
+database.
+"""
+
+import hashlib
+from datetime import timedelta
+
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+
+from modules.spatial.models import GeocodeCache
+
+TTL_SEC = {
+    GeocodeCache.KIND_GEOCODE: 60 * 60 * 24 * 30,
+    GeocodeCache.KIND_SUGGEST: 60 * 60 * 24 * 7,
+    GeocodeCache.KIND_REVERSE: 60 * 60 * 24 * 30,
+}
+
+
+def _key(query: str) -> str:
+    return hashlib.md5(query.encode("utf-8")).hexdigest()
+
+
+def _touch(pks):
+    GeocodeCache.objects.filter(pk__in=pks).update(hits=F("hits") + 1, last_hit_at=timezone.now())
+
+
+def get(kind, query):
+    """Stored payload for the normalized ``query``, or None if missing or expired."""
+    if not query:
+        return None
+    try:
+        row = (
+            GeocodeCache.objects.filter(kind=kind, key=_key(query), expires_at__gt=timezone.now())
+            .values_list("pk", "payload")
+            .first()
+        )
+        if row is None:
+            return None
+        _touch([row[0]])
+    except DatabaseError:
+        return None
+    return row[1]
+
+
+def prefetch(kind, queries):
+    """``{query: payload}`` for every stored, unexpired query, in one SELECT."""
+    by_key = {_key(q): q for q in queries if q}
+    if not by_key:
+        return {}
+    try:
+        rows = list(
+            GeocodeCache.objects.filter(kind=kind, key__in=list(by_key), expires_at__gt=timezone.now())
+            .values_list("pk", "key", "payload")
+        )
+        if rows:
+            _touch([pk for pk, _, _ in rows])
+    except DatabaseError:
+        return {}
+    return {by_key[key]: payload for _, key, payload in rows}
+
+
+def entries(kind, since=None):
+    """
+    ``[(query, payload, expires_at), ...]`` for every unexpired row of
+    ``kind``, or only those written after ``since``.
+    """
+    rows = GeocodeCache.objects.filter(kind=kind, expires_at__gt=timezone.now())
+    if since is not None:
+        rows = rows.filter(updated_at__gt=since)
+    try:
+        return list(rows.order_by("updated_at").values_list("query", "payload", "expires_at"))
+    except DatabaseError:
+        return []
+
+
+def put(kind, query, payload, provider="", score=None, ttl=None):
+    if not query:
+        return
+    ttl = TTL_SEC.get(kind, 60 * 60 * 24) if ttl is None else ttl
+    try:
+        GeocodeCache.objects.update_or_create(
+            kind=kind,
+            key=_key(query),
+            defaults={
+                "query": query,
+                "provider": provider or "",
+                "score": score,
+                "payload": payload,
+                "expires_at": timezone.now() + timedelta(seconds=ttl),
+            },
+        )
+    except DatabaseError:
+        pass
+
+
+def purge_expired():
+    """Delete expired rows; returns how many were removed."""
+    deleted, _ = GeocodeCache.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -1,7 +1,258 @@
 ﻿"""Geocoding helpers reused by spatial controllers."""
 
-import requests
+import csv
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
 
+from django.conf import settings
 
-def request_nominatim(url, params, headers, timeout):
-    return requests.get(url, params=params, headers=headers, timeout=timeout)
+from modules.spatial.services import http_pool
+from modules.spatial.services.district_index import district_key
+from modules.spatial.services.store_index import SNAPSHOT_MAX_AGE_SEC, store_generation
+from modules.spatial.utils.text import address_tokens, score_geocode_candidate, strip_accents
+from modules.store.models import CuaHang
+
+logger = logging.getLogger(__name__)
+
+FANOUT_MAX_WORKERS = 6
+FANOUT_TIMEOUT_SEC = 15
+
+LOCAL_MIN_SCORE = 0.8  # below this the external providers are asked
+LOCAL_MAX_CANDIDATES = 50  # entries scored per query, by token overlap
+
+_NUMBER = r"(\d+[a-z]?(?:/\d+[a-z]?)*)"
+_HOUSE_NUMBER_RE = re.compile(rf"(?:^\s*|\b(?:hem|so|ngo|kiet)\s+){_NUMBER}\b")
+_DISTRICT_NUMBER_RE = re.compile(r"\b(?:quan|q|district)\s*(\d{1,2})\b")
+_WARD_RE = re.compile(r"\b(?:phuong|p|ward)\s*(\d{1,2})\b|\bphuong\s+([a-z][a-z ]*?)\s*(?:,|$)")
+_WARD_PREFIX_RE = re.compile(r"^(?:phuong|xa|thi tran|p)\b\.?\s*")
+
+# Named (non-numbered) HCM districts, recognized in queries without a "quan" prefix.
+HCM_NAMED_DISTRICTS = (
+    "binh chanh", "binh tan", "binh thanh", "can gio", "cu chi", "go vap", "hoc mon",
+    "nha be", "phu nhuan", "tan binh", "tan phu", "thu duc",
+)
+
+_pool = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="geocode")
+
+
+def request_nominatim(url, params, headers, timeout, acquire=None):
+    return http_pool.get(url, params=params, headers=headers, timeout=timeout, acquire=acquire)
+
+
+def request_photon(url, params, headers, timeout, acquire=None):
+    return http_pool.get(url, params=params, headers=headers, timeout=timeout, acquire=acquire)
+
+
+def fan_out(tasks, on_result, timeout=FANOUT_TIMEOUT_SEC):
+    """
+    Run ``tasks`` (callables taking a stop ``threading.Event``) concurrently on the shared
+    geocoding pool, passing each result to ``on_result`` as it arrives.
+
+    As soon as ``on_result`` returns True the remaining work is abandoned:
+    queued tasks are cancelled and the stop event is set, so tasks still
+    waiting on a provider rate limit can skip their request. Results arriving after ``timeout`` seconds
+    are dropped as well. Returns True when stopped early by ``on_result``.
+    """
+    stop = threading.Event()
+
+    def _run(task):
+        if stop.is_set():
+            return None
+        return task(stop)
+
+    pending = {_pool.submit(_run, task) for task in tasks}
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception:
+                    continue
+                if result is not None and on_result(result):
+                    return True
+        return False
+    finally:
+        stop.set()
+        for future in pending:
+            future.cancel()
+
+
+def _fold(text):
+    """Lower-case, accent-free text keeping only letters, digits, ``/`` and commas."""
+    s = strip_accents((text or "").lower()).replace("đ", "d")
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9/, ]", " ", s)).strip()
+
+
+def _house_number(text):
+    """House number at the start of the address or after hem/so/ngo/kiet, else ""."""
+    m = _HOUSE_NUMBER_RE.search(_fold(text))
+    return m.group(1) if m else ""
+
+
+def _ward_key(name):
+    """Comparable ward name: "Phường 03" -> "3", "P. Bến Nghé" -> "ben nghe"."""
+    s = _WARD_PREFIX_RE.sub("", re.sub(r"[,/]", " ", _fold(name)).strip()).strip()
+    return str(int(s)) if s.isdigit() else s
+
+
+def _district_of(folded, named):
+    m = _DISTRICT_NUMBER_RE.search(folded)
+    if m:
+        return str(int(m.group(1)))
+    for name in named:
+        if re.search(rf"\b{name}\b", folded):
+            return name
+    return ""
+
+
+def _ward_of(folded):
+    m = _WARD_RE.search(folded)
+    if not m:
+        return ""
+    return str(int(m.group(1))) if m.group(1) else m.group(2)
+
+
+class LocalGeocoder:
+    """
+    In-process geocoder over our own store addresses and an optional
+    street/ward gazetteer.
+
+    Entries are ``(display, lat, lon, source, district, ward)``; ``source``
+    is ``"store"`` for ``CuaHang`` rows and ``"gazetteer"`` for rows of the
+    CSV file at ``settings.SPATIAL_GAZETTEER_PATH`` (columns ``name,lat,lon``
+    and optionally ``ward,district``). An inverted index over accent-folded
+    address tokens picks the candidates, which are ranked with the same
+    ``score_geocode_candidate`` used for Nominatim and Photon results. A
+    candidate in another district or ward than the query names is dropped,
+    and a store only answers a query with its exact house number. The index
+    is rebuilt when the store generation or the gazetteer file changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._built_at = 0.0
+        self._entries = []
+        self._postings = {}
+        self._districts = HCM_NAMED_DISTRICTS
+
+    def _gazetteer_path(self):
+        path = getattr(settings, "SPATIAL_GAZETTEER_PATH", None)
+        return Path(path) if path else None
+
+    def _current_signature(self):
+        path = self._gazetteer_path()
+        try:
+            mtime = path.stat().st_mtime if path else None
+        except OSError:
+            mtime = None
+        return store_generation(), mtime
+
+    def _load_gazetteer(self, path):
+        entries = []
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as fh:
+                for row in csv.DictReader(fh):
+                    try:
+                        lat, lon = float(row["lat"]), float(row["lon"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    parts = [row.get("name"), row.get("ward"), row.get("district")]
+                    display = ", ".join(p.strip() for p in parts if p and p.strip())
+                    if display:
+                        district = district_key(row.get("district") or "")
+                        ward = _ward_key(row.get("ward") or "")
+                        entries.append((display, lat, lon, "gazetteer", district, ward))
+        except OSError:
+            logger.exception("Could not read gazetteer %s", path)
+        return entries
+
+    def rebuild(self, signature=None):
+        signature = signature or self._current_signature()
+        entries = []
+        for dia_chi, quan_huyen, lat, lon in CuaHang.objects.values_list(
+            "dia_chi", "quan_huyen", "vi_do", "kinh_do",
+        ):
+            if lat is None or lon is None or not dia_chi:
+                continue
+            display = dia_chi if not quan_huyen or quan_huyen.lower() in dia_chi.lower() else f"{dia_chi}, {quan_huyen}"
+            district = district_key(quan_huyen) or _district_of(_fold(dia_chi), HCM_NAMED_DISTRICTS)
+            entries.append((display, float(lat), float(lon), "store", district, _ward_of(_fold(dia_chi))))
+        if signature[1] is not None:
+            entries += self._load_gazetteer(self._gazetteer_path())
+        named = {e[4] for e in entries if e[4] and not e[4].isdigit()} | set(HCM_NAMED_DISTRICTS)
+        districts = tuple(sorted(named, key=len, reverse=True))
+
+        postings = {}
+        for i, entry in enumerate(entries):
+            for token in set(address_tokens(entry[0])):
+                postings.setdefault(token, []).append(i)
+        with self._lock:
+            self._entries = entries
+            self._postings = postings
+            self._districts = districts
+            self._signature = signature
+            self._built_at = time.monotonic()
+
+    def _ensure(self):
+        signature = self._current_signature()
+        if signature != self._signature or time.monotonic() - self._built_at > SNAPSHOT_MAX_AGE_SEC:
+            self.rebuild(signature)
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def search(self, query, limit=5):
+        """Best-scoring entries for ``query`` as candidate dicts, best first."""
+        self._ensure()
+        with self._lock:
+            entries, postings, districts = self._entries, self._postings, self._districts
+        overlap = Counter()
+        for token in set(address_tokens(query)):
+            overlap.update(postings.get(token, ()))
+        folded = _fold(query)
+        number = _house_number(query)
+        q_district = _district_of(folded, districts)
+        q_ward = _ward_of(folded)
+        out = []
+        for i, _ in overlap.most_common(LOCAL_MAX_CANDIDATES):
+            display, lat, lon, source, district, ward = entries[i]
+            if q_district and district and q_district != district:
+                continue
+            if q_ward and ward and q_ward != ward:
+                continue
+            if source == "store" and (not number or _house_number(display) != number):
+                # Without the same house number a store is not this address.
+                continue
+            out.append({
+                "provider": "local",
+                "source": source,
+                "precision": "address" if source == "store" else "street",
+                "lat": lat,
+                "lon": lon,
+                "display": display,
+                "score": score_geocode_candidate(query, display),
+            })
+        out.sort(key=lambda c: (c["score"], c["precision"] == "address"), reverse=True)
+        return out[:limit]
+
+    def geocode(self, query):
+        """The best local candidate if it is confident enough, else None."""
+        best = self.search(query, limit=1)
+        if best and best[0]["score"] >= LOCAL_MIN_SCORE:
+            return best[0]
+        return None
+
+
+local_geocoder = LocalGeocoder()
@@ -0,0 +1,99 @@
+"""
+Keep-alive HTTP sessions for outbound provider calls, one per host.
+
+Each host gets a ``requests.Session`` whose adapter pools connections
+(``SPATIAL_HTTP_POOL_SIZE``). ``get`` retries connection failures and
+502/504 answers with exponential backoff (``SPATIAL_HTTP_RETRIES``,
+``SPATIAL_HTTP_BACKOFF``); every retry first takes a token through the
+caller's ``acquire`` so it counts against the provider's rate limit, and no
+attempt runs past ``SPATIAL_HTTP_DEADLINE`` seconds from the first. Read
+timeouts, 429s and 503s are not retried and Retry-After is not slept on:
+the caller's rate limiter and circuit breaker handle an overloaded
+provider. Sessions are shared by all threads of a worker.
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.3
+DEFAULT_DEADLINE = 15.0
+RETRY_STATUSES = (502, 504)
+
+_lock = threading.Lock()
+_sessions = {}
+
+
+def _build_session():
+    pool_size = getattr(settings, "SPATIAL_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def session_for(url):
+    host = urlsplit(url).netloc.lower()
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _sessions[host] = _build_session()
+    return session
+
+
+def get(url, params=None, headers=None, timeout=None, acquire=None):
+    """
+    GET through the host's pooled session. ``acquire()`` is called before
+    each retry and must return True for the retry to go out; the last
+    response (or connection error) is returned (or raised) otherwise.
+    """
+    retries = getattr(settings, "SPATIAL_HTTP_RETRIES", DEFAULT_RETRIES)
+    backoff = getattr(settings, "SPATIAL_HTTP_BACKOFF", DEFAULT_BACKOFF)
+    deadline = time.monotonic() + getattr(settings, "SPATIAL_HTTP_DEADLINE", DEFAULT_DEADLINE)
+    session = session_for(url)
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            r = session.get(
+                url, params=params, headers=headers,
+                timeout=remaining if timeout is None else min(timeout, remaining),
+            )
+        except requests.ConnectionError:
+            if not _retry(attempt, retries, backoff, deadline, acquire):
+                raise
+        else:
+            if r.status_code not in RETRY_STATUSES or not _retry(attempt, retries, backoff, deadline, acquire):
+                return r
+        attempt += 1
+
+
+def _retry(attempt, retries, backoff, deadline, acquire):
+    """Sleep for the backoff and take a token; False if the retry should not go out."""
+    if attempt >= retries:
+        return False
+    pause = backoff * (2 ** attempt)
+    if time.monotonic() + pause >= deadline:
+        return False
+    time.sleep(pause)
+    if acquire is not None and not acquire():
+        return False
+    return time.monotonic() < deadline
+
+
+def close_all():
+    """Close every pooled session (they are rebuilt on next use, e.g. after settings change)."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
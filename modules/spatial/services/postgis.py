@@ -0,0 +1,88 @@
+"""PostGIS query helpers for the ``CuaHang.geog`` geography column.
+
+``geog`` is a generated ``geography(Point, 4326)`` column with a GiST index,
+added by migration ``gis_store.0013`` only when the database has the PostGIS
+extension. It is not a model field, so the helpers below reach it through
+``RawSQL`` expressions. Callers check ``postgis_enabled()`` first and keep the
+plain ``vi_do``/``kinh_do`` float predicates as the fallback.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from modules.store.models import CuaHang
+
+GEOG_COLUMN = "geog"
+
+_POINT_SQL = "ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography"
+
+_enabled = {}
+
+
+def _geog():
+    return f'"{CuaHang._meta.db_table}"."{GEOG_COLUMN}"'
+
+
+def postgis_enabled(using="default"):
+    if not getattr(settings, "SPATIAL_POSTGIS", True):
+        return False
+    if using in _enabled:
+        return _enabled[using]
+    connection = connections[using]
+    found = False
+    if connection.vendor == "postgresql":
+        try:
+            with connection.cursor() as cur:
+                cur.execute(
+                    "SELECT 1 FROM information_schema.columns "
+                    "WHERE table_name = %s AND column_name = %s",
+                    [CuaHang._meta.db_table, GEOG_COLUMN],
+                )
+                found = cur.fetchone() is not None
+        except Exception:
+            found = False
+    _enabled[using] = found
+    return found
+
+
+def filter_dwithin(qs, lat, lon, radius_km):
+    """Keep rows within ``radius_km`` of the point (index-assisted ``ST_DWithin``)."""
+    expr = RawSQL(
+        f"ST_DWithin({_geog()}, {_POINT_SQL}, %s)",
+        (lon, lat, radius_km * 1000.0),
+        output_field=BooleanField(),
+    )
+    return qs.filter(expr)
+
+
+def filter_envelope(qs, south, west, north, east):
+    """Keep rows whose point falls inside the box (index-assisted ``&&``)."""
+    expr = RawSQL(
+        f"{_geog()} && ST_MakeEnvelope(%s, %s, %s, %s, 4326)::geography",
+        (min(west, east), min(south, north), max(west, east), max(south, north)),
+        output_field=BooleanField(),
+    )
+    return qs.filter(expr)
+
+
+def filter_intersects(qs, wkt):
+    """Keep rows whose point lies in the WKT polygon (index-assisted ``ST_Intersects``)."""
+    expr = RawSQL(
+        f"ST_Intersects({_geog()}::geometry, ST_GeomFromText(%s, 4326))",
+        (wkt,),
+        output_field=BooleanField(),
+    )
+    return qs.filter(expr)
+
+
+def annotate_distance(qs, lat, lon, name="distance_m"):
+    expr = RawSQL(f"ST_Distance({_geog()}, {_POINT_SQL})", (lon, lat), output_field=FloatField())
+    return qs.annotate(**{name: expr})
+
+
+def order_by_knn(qs, lat, lon):
+    """Order by distance with the ``<->`` operator so the GiST index drives the scan."""
+    expr = RawSQL(f"{_geog()} <-> {_POINT_SQL}", (lon, lat), output_field=FloatField())
+    return qs.order_by(expr.asc(), "id")
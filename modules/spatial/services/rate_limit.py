@@ -0,0 +1,183 @@
+"""
+Per-provider token buckets shared by every worker process.
+
+Each provider gets ``rate`` tokens per second up to ``burst``; a call spends
+one token. Bucket state lives in Redis when ``settings.SPATIAL_RATE_LIMIT_REDIS_URL``
+is set (and redis-py is installed), otherwise in a small SQLite file at
+``settings.SPATIAL_RATE_LIMIT_DB`` whose write lock serializes processes on
+the same host. If the shared backend fails, an in-process bucket keeps the
+limit per worker.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# provider -> (tokens per second, burst)
+RATE_LIMITS = {
+    "nominatim": (1 / 0.35, 1),
+    "photon": (5.0, 1),
+    "osrm": (5.0, 2),
+}
+
+_REDIS_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or burst)
+local updated = tonumber(redis.call('HGET', KEYS[1], 'u') or now)
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+
+def _refill(tokens, updated, rate, burst, now):
+    """Spend one token if available: ``(tokens_left, wait_seconds)``."""
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def take(self, name, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._state.get(name, (burst, now))
+            tokens, wait_s = _refill(tokens, updated, rate, burst, now)
+            self._state[name] = (tokens, now)
+        return wait_s
+
+
+class SQLiteBuckets:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, name, rate, burst, now):
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the database write lock, so the read-modify-write
+        # below is atomic across processes.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, wait_s = _refill(tokens, updated, rate, burst, now)
+            conn.execute(
+                "INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait_s
+
+
+class RedisBuckets:
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+
+    def take(self, name, rate, burst, now):
+        return float(self._script(keys=[f"spatial:ratelimit:{name}"], args=[rate, burst, now]))
+
+
+_fallback = MemoryBuckets()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = getattr(settings, "SPATIAL_RATE_LIMIT_REDIS_URL", "")
+                if url and redis is not None:
+                    _backend = RedisBuckets(url)
+                else:
+                    _backend = SQLiteBuckets(settings.SPATIAL_RATE_LIMIT_DB)
+    return _backend
+
+
+def reset_backend():
+    """Forget the configured backend (after changing settings)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def _limits(provider):
+    limits = {**RATE_LIMITS, **getattr(settings, "SPATIAL_RATE_LIMITS", {})}
+    return limits.get(provider)
+
+
+def try_acquire(provider):
+    """
+    Take a token for ``provider`` without waiting. Returns 0.0 when a token
+    was taken, otherwise the seconds until one should be available.
+    """
+    limits = _limits(provider)
+    if limits is None:
+        return 0.0
+    rate, burst = limits
+    now = time.time()
+    try:
+        return _get_backend().take(provider, rate, burst, now)
+    except Exception:
+        logger.warning("Shared rate limiter unavailable, limiting %s per process", provider, exc_info=True)
+        return _fallback.take(provider, rate, burst, now)
+
+
+def acquire(provider, timeout=0.0, stop=None):
+    """
+    Take a token for ``provider``, waiting at most ``timeout`` seconds.
+
+    Gives up immediately (False) when the next token is due after the
+    deadline, instead of sleeping towards a call that cannot happen in
+    time, and when ``stop`` is set while waiting.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if stop is not None and stop.is_set():
+            return False
+        wait_s = try_acquire(provider)
+        if wait_s <= 0:
+            return True
+        if wait_s > deadline - time.monotonic():
+            return False
+        if stop is not None:
+            if stop.wait(wait_s):
+                return False
+        else:
+            time.sleep(wait_s)
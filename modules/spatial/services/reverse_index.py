@@ -0,0 +1,114 @@
+"""
+Nearest previously resolved reverse-geocode point.
+
+Every reverse result persisted in the geocode store is keyed by the geohash
+cell of the clicked point. This index decodes those cells back to points
+and buckets them in a lat/lon grid, so a new click can reuse the answer of
+a nearby earlier click instead of calling Nominatim. It loads the store
+once, then every ``SNAPSHOT_MAX_AGE_SEC`` reads only the rows written since
+(by other workers), and takes this worker's new results immediately. Past
+``MAX_POINTS`` the oldest points make room for new ones.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from modules.spatial.services import geocode_store
+from modules.spatial.services.store_index import SNAPSHOT_MAX_AGE_SEC
+from modules.spatial.utils import geohash
+from modules.spatial.utils.geo import bbox_deltas, haversine_km
+
+CELL_DEG = 0.001  # ~110 m
+MAX_POINTS = 200_000
+LOAD_OVERLAP_SEC = 60  # re-read rows this close to the last load, in case they committed late
+
+
+class ReverseIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._points = OrderedDict()  # geohash cell -> (lat, lon, payload, expires_at), oldest first
+        self._cells = {}  # grid cell -> {geohash cell, ...}
+        self._loaded_at = None
+        self._since = None
+
+    @staticmethod
+    def _cell(lat, lon):
+        return math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG)
+
+    def _add(self, key, payload, expires_at):
+        try:
+            south, west, north, east = geohash.bounds(key)
+        except ValueError:
+            return
+        lat, lon = (south + north) / 2, (west + east) / 2
+        if key not in self._points:
+            self._cells.setdefault(self._cell(lat, lon), set()).add(key)
+        self._points[key] = (lat, lon, payload, expires_at)
+        self._points.move_to_end(key)
+        while len(self._points) > MAX_POINTS:
+            old, (o_lat, o_lon, _, _) = self._points.popitem(last=False)
+            bucket = self._cells[self._cell(o_lat, o_lon)]
+            bucket.discard(old)
+            if not bucket:
+                del self._cells[self._cell(o_lat, o_lon)]
+
+    def rebuild(self):
+        """Drop everything and load the whole store again."""
+        with self._lock:
+            self._points, self._cells, self._since = OrderedDict(), {}, None
+        self._load()
+
+    def _load(self):
+        started = timezone.now()
+        with self._lock:
+            since = self._since
+        rows = geocode_store.entries("reverse", since=since)
+        with self._lock:
+            for key, payload, expires_at in rows:
+                self._add(key, payload, expires_at)
+            self._since = started - timedelta(seconds=LOAD_OVERLAP_SEC)
+            self._loaded_at = time.monotonic()
+
+    def _ensure(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > SNAPSHOT_MAX_AGE_SEC:
+            self._load()
+
+    def invalidate(self):
+        with self._lock:
+            self._points, self._cells = OrderedDict(), {}
+            self._loaded_at = self._since = None
+
+    def add(self, cell, payload):
+        """This worker's new result for the geohash ``cell``."""
+        self._ensure()
+        ttl = geocode_store.TTL_SEC["reverse"]
+        with self._lock:
+            self._add(cell, payload, timezone.now() + timedelta(seconds=ttl))
+
+    def nearest(self, lat, lon, max_km):
+        """``(payload, distance_km)`` of the closest resolved point within ``max_km``, or None."""
+        self._ensure()
+        now = timezone.now()
+        dlat, dlon = bbox_deltas(lat, max_km)
+        i0, j0 = self._cell(lat - dlat, lon - dlon)
+        i1, j1 = self._cell(lat + dlat, lon + dlon)
+        best = None
+        with self._lock:
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    for key in self._cells.get((i, j), ()):
+                        p_lat, p_lon, payload, expires_at = self._points[key]
+                        if expires_at <= now:
+                            continue
+                        d = haversine_km(lat, lon, p_lat, p_lon)
+                        if d <= max_km and (best is None or d < best[1]):
+                            best = (payload, d)
+        return best
+
+
+reverse_index = ReverseIndex()
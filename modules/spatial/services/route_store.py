@@ -0,0 +1,120 @@
+"""
+Database-backed route cache from snapped origin cells to stores.
+
+Rows are keyed by ``(profile, origin_cell, store, variant)``: the origin is a
+geohash cell (every point in it is routed from the cell centre), the
+destination is a ``CuaHang`` id and ``variant`` hashes the response shape
+(mode, zoom, step fields, alternatives). Reads bump ``last_hit_at``; once the
+table grows past ``max_rows()`` the least recently used rows are deleted.
+The hit counts also tell the precompute command which origin cells are
+popular.
+"""
+
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from modules.spatial.models import RouteCache
+
+MAX_ROWS = 50_000
+EVICT_EVERY = 100  # writes between eviction passes
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def max_rows():
+    return getattr(settings, "SPATIAL_ROUTE_CACHE_MAX_ROWS", MAX_ROWS)
+
+
+def variant_key(**shape) -> str:
+    return hashlib.md5(json.dumps(shape, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get(profile, cell, store_id, variant):
+    """Stored payload for the route, or None."""
+    try:
+        row = (
+            RouteCache.objects.filter(profile=profile, origin_cell=cell, cua_hang_id=store_id, variant=variant)
+            .values_list("pk", "payload")
+            .first()
+        )
+        if row is None:
+            return None
+        RouteCache.objects.filter(pk=row[0]).update(hits=F("hits") + 1, last_hit_at=timezone.now())
+    except DatabaseError:
+        return None
+    return row[1]
+
+
+def exists(profile, cell, store_id, variant):
+    try:
+        return RouteCache.objects.filter(
+            profile=profile, origin_cell=cell, cua_hang_id=store_id, variant=variant,
+        ).exists()
+    except DatabaseError:
+        return False
+
+
+def put(profile, cell, store_id, variant, payload):
+    routes = payload.get("routes") or [{}]
+    try:
+        RouteCache.objects.update_or_create(
+            profile=profile,
+            origin_cell=cell,
+            cua_hang_id=store_id,
+            variant=variant,
+            defaults={
+                "payload": payload,
+                "distance_m": routes[0].get("distance"),
+                "duration_s": routes[0].get("duration"),
+                "last_hit_at": timezone.now(),
+            },
+        )
+    except DatabaseError:
+        return
+
+    global _writes
+    with _writes_lock:
+        _writes += 1
+        due = _writes % EVICT_EVERY == 0
+    if due:
+        evict()
+
+
+def evict(limit=None):
+    """Delete the least recently used rows beyond ``limit``; returns how many were removed."""
+    limit = max_rows() if limit is None else limit
+    try:
+        extra = RouteCache.objects.count() - limit
+        if extra <= 0:
+            return 0
+        pks = list(RouteCache.objects.order_by("last_hit_at", "pk").values_list("pk", flat=True)[:extra])
+        deleted, _ = RouteCache.objects.filter(pk__in=pks).delete()
+    except DatabaseError:
+        return 0
+    return deleted
+
+
+def invalidate_store(store_id):
+    """Drop every cached route to a store, e.g. after it moved."""
+    try:
+        RouteCache.objects.filter(cua_hang_id=store_id).delete()
+    except DatabaseError:
+        pass
+
+
+def popular_cells(profile, limit):
+    """``[(origin_cell, requests), ...]`` for the most used origin cells (a row's first request created it)."""
+    return list(
+        RouteCache.objects.filter(profile=profile)
+        .values("origin_cell")
+        .annotate(total=Sum("hits") + Count("pk"))
+        .order_by("-total", "origin_cell")
+        .values_list("origin_cell", "total")[:limit]
+    )
@@ -1,7 +1,502 @@
-﻿"""Routing helpers reused by spatial controllers."""
+﻿"""
+Routing helpers reused by spatial controllers, and an offline road router.
 
-import requests
+``request_osrm`` calls the public OSRM server. ``local_router`` answers the
+same route queries in process from the road network file at
+``settings.SPATIAL_ROAD_GRAPH_PATH``: a GeoJSON FeatureCollection of
+LineString/MultiLineString ways with their OSM tags (``highway``,
+``oneway``, ``maxspeed``, ``name``) as properties, as written by
+``osmium export`` or osmtogeojson. Ways become a directed graph per profile
+weighted by travel time. For every graph a few far-apart landmarks and
+their shortest-path distances to and from every node are precomputed, so a
+query is an A* search with the ALT lower bounds and settles only a small
+part of the city. Graphs are built in a background thread; until a
+profile's graph is ready the local router does not answer. Answers have
+the shape of OSRM's route service.
+"""
 
+import heapq
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
 
-def request_osrm(url, params, headers, timeout):
-    return requests.get(url, params=params, headers=headers, timeout=timeout)
+import numpy as np
+from django.conf import settings
+
+from modules.spatial.services import http_pool
+from modules.spatial.utils import polyline
+from modules.spatial.utils.geo import EARTH_RADIUS_KM, haversine_km_many
+
+logger = logging.getLogger(__name__)
+
+LANDMARKS = 8
+SNAP_MAX_KM = 0.5  # farther than this from every road, a point is not routed locally
+COORD_PRECISION = 7  # decimals of the vertex coordinates that identify a graph node
+
+# Travel speed (km/h) by highway class; classes missing from a profile are not used by it.
+SPEEDS_KMH = {
+    "driving": {
+        "motorway": 80, "motorway_link": 40, "trunk": 60, "trunk_link": 35,
+        "primary": 40, "primary_link": 30, "secondary": 35, "secondary_link": 30,
+        "tertiary": 30, "tertiary_link": 25, "unclassified": 25, "residential": 20,
+        "living_street": 10, "service": 15, "road": 20,
+    },
+    "cycling": {
+        "primary": 15, "primary_link": 15, "secondary": 15, "secondary_link": 15,
+        "tertiary": 15, "tertiary_link": 15, "unclassified": 15, "residential": 15,
+        "living_street": 12, "service": 12, "road": 15, "cycleway": 16, "track": 10, "path": 10,
+    },
+    "walking": {
+        "primary": 5, "primary_link": 5, "secondary": 5, "secondary_link": 5,
+        "tertiary": 5, "tertiary_link": 5, "unclassified": 5, "residential": 5,
+        "living_street": 5, "service": 5, "road": 5, "pedestrian": 5, "footway": 5,
+        "path": 5, "track": 5, "cycleway": 5, "steps": 3,
+    },
+}
+
+_SPEED_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(mph)?", re.IGNORECASE)
+
+
+def request_osrm(url, params, headers, timeout, acquire=None):
+    return http_pool.get(url, params=params, headers=headers, timeout=timeout, acquire=acquire)
+
+
+def _tags(props):
+    tags = props.get("tags")
+    return tags if isinstance(tags, dict) else props
+
+
+def _speed_kmh(tags, profile):
+    default = SPEEDS_KMH[profile].get(tags.get("highway"))
+    if default is None or profile != "driving":
+        return default
+    m = _SPEED_RE.match(str(tags.get("maxspeed") or ""))
+    if not m:
+        return default
+    limit = float(m.group(1)) * (1.609 if m.group(2) else 1.0)
+    return max(5.0, 0.8 * limit)  # traffic keeps average speed below the limit
+
+
+def _direction(tags, profile):
+    """1 forward only, -1 backward only, 0 both ways."""
+    if profile == "walking":
+        return 0
+    if profile == "cycling" and str(tags.get("oneway:bicycle", "")).lower() == "no":
+        return 0
+    oneway = str(tags.get("oneway", "")).lower()
+    if oneway == "-1":
+        return -1
+    if oneway in ("yes", "true", "1") or tags.get("junction") == "roundabout" or tags.get("highway") == "motorway":
+        return 1
+    return 0
+
+
+def _dijkstra(adj, source):
+    dist = [math.inf] * len(adj)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, v = heapq.heappop(heap)
+        if d > dist[v]:
+            continue
+        for w, sec, _, _ in adj[v]:
+            nd = d + sec
+            if nd < dist[w]:
+                dist[w] = nd
+                heapq.heappush(heap, (nd, w))
+    return dist
+
+
+class RoadGraph:
+    """Directed road graph of one profile with ALT landmark distances."""
+
+    def __init__(self, lats, lons, names, edges, landmarks=LANDMARKS):
+        n = len(lats)
+        self.lats, self.lons, self.names = lats, lons, names
+        self.adj = [[] for _ in range(n)]
+        radj = [[] for _ in range(n)]
+        for u, v, sec, metres, name in edges:
+            self.adj[u].append((v, sec, metres, name))
+            radj[v].append((u, sec, metres, name))
+        self.usable = np.flatnonzero([bool(a or r) for a, r in zip(self.adj, radj)])
+
+        self.landmarks = []
+        froms, tos = [], []
+        if len(self.usable):
+            spread = np.asarray(_dijkstra(self.adj, int(self.usable[0])))
+            for _ in range(min(landmarks, len(self.usable))):
+                pick = np.where(np.isfinite(spread), spread, -1.0)
+                pick[self.landmarks] = -1.0
+                if pick.max() < 0:
+                    break
+                landmark = int(pick.argmax())
+                self.landmarks.append(landmark)
+                froms.append(np.asarray(_dijkstra(self.adj, landmark), dtype=np.float32))
+                tos.append(np.asarray(_dijkstra(radj, landmark), dtype=np.float32))
+                # Next landmark: the node farthest from all chosen ones.
+                spread = np.minimum(spread, froms[-1])
+
+        # Row v: travel times landmark -> v and v -> landmark, as float32.
+        self._from = np.stack(froms, axis=1) if froms else np.zeros((n, 0), dtype=np.float32)
+        self._to = np.stack(tos, axis=1) if tos else np.zeros((n, 0), dtype=np.float32)
+        # float32 rounding of two distances up to this size could overstate a bound.
+        finite = [a[np.isfinite(a)] for a in (self._from, self._to)]
+        largest = max((float(a.max()) for a in finite if a.size), default=0.0)
+        self._slack = 2 * float(np.finfo(np.float32).eps) * largest
+
+    def snap(self, lat, lon):
+        """``(node, distance_km)`` of the closest usable node, or ``(None, None)``."""
+        if not len(self.usable):
+            return None, None
+        dist = haversine_km_many(lat, lon, self.lats[self.usable], self.lons[self.usable])
+        i = int(dist.argmin())
+        if dist[i] > SNAP_MAX_KM:
+            return None, None
+        return int(self.usable[i]), float(dist[i])
+
+    def _bound(self, v, t_from, t_to):
+        """ALT lower bound on the travel time from ``v`` to the target."""
+        best = 0.0
+        for a, b in zip(t_from, self._from[v].tolist()):
+            if a != math.inf and b != math.inf and a - b > best:
+                best = a - b
+        for a, b in zip(self._to[v].tolist(), t_to):
+            if a != math.inf and b != math.inf and a - b > best:
+                best = a - b
+        return best - self._slack if best > self._slack else 0.0
+
+    def tree(self, s, targets):
+        """
+        ``{node: (seconds, metres)}`` of the fastest paths from ``s`` to the
+        reachable ``targets``; the search stops once all of them are settled.
+        """
+        dist = {s: 0.0}
+        length = {s: 0.0}
+        left = set(targets)
+        found = {}
+        heap = [(0.0, s)]
+        while heap and left:
+            d, v = heapq.heappop(heap)
+            if d > dist[v]:
+                continue
+            if v in left:
+                left.discard(v)
+                found[v] = (d, length[v])
+            for w, sec, metres, _ in self.adj[v]:
+                nd = d + sec
+                if nd < dist.get(w, math.inf):
+                    dist[w] = nd
+                    length[w] = length[v] + metres
+                    heapq.heappush(heap, (nd, w))
+        return found
+
+    def shortest(self, s, t):
+        """Edges ``[(u, v, seconds, metres, name), ...]`` of the fastest path, or None."""
+        if s == t:
+            return []
+        t_from = self._from[t].tolist()
+        t_to = self._to[t].tolist()
+        g = {s: 0.0}
+        prev = {}
+        closed = set()
+        heap = [(self._bound(s, t_from, t_to), 0.0, s)]
+        while heap:
+            _, gv, v = heapq.heappop(heap)
+            if v in closed:
+                continue
+            if v == t:
+                break
+            closed.add(v)
+            for w, sec, metres, name in self.adj[v]:
+                ng = gv + sec
+                if ng < g.get(w, math.inf):
+                    g[w] = ng
+                    prev[w] = (v, sec, metres, name)
+                    heapq.heappush(heap, (ng + self._bound(w, t_from, t_to), ng, w))
+        else:
+            return None
+
+        path = []
+        v = t
+        while v != s:
+            u, sec, metres, name = prev[v]
+            path.append((u, v, sec, metres, name))
+            v = u
+        path.reverse()
+        return path
+
+
+def _geometry(coords, geometries):
+    if geometries == "polyline":
+        return polyline.encode(coords)
+    return {"type": "LineString", "coordinates": coords}
+
+
+class LocalRouter:
+    """
+    Offline router over ``settings.SPATIAL_ROAD_GRAPH_PATH``. The first time
+    a profile is asked for (or on ``warm()``), a background thread reads the
+    file and builds that profile's graph and landmarks; requests never wait
+    for it and get no local answer until it is ready. A changed file is
+    picked up the same way.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._mtime = None
+        self._nodes = None  # (mtime, (lats, lons, names, [(u, v, metres, name, tags), ...]))
+        self._graphs = {}  # profile -> RoadGraph, or None when the build failed
+        self._builds = {}  # profile -> building thread
+
+    def _path(self):
+        path = getattr(settings, "SPATIAL_ROAD_GRAPH_PATH", None)
+        return Path(path) if path else None
+
+    def _read(self, path):
+        with open(path, encoding="utf-8-sig") as fh:
+            data = json.load(fh)
+        index, lats, lons = {}, [], []
+        names, name_ids = [], {}
+        segments = []
+
+        def _node(lon, lat):
+            key = (round(lat, COORD_PRECISION), round(lon, COORD_PRECISION))
+            if key not in index:
+                index[key] = len(lats)
+                lats.append(lat)
+                lons.append(lon)
+            return index[key]
+
+        for feature in data.get("features") or []:
+            geom = feature.get("geometry") or {}
+            tags = _tags(feature.get("properties") or {})
+            if not tags.get("highway"):
+                continue
+            if geom.get("type") == "LineString":
+                lines = [geom.get("coordinates") or []]
+            elif geom.get("type") == "MultiLineString":
+                lines = geom.get("coordinates") or []
+            else:
+                continue
+            name = str(tags.get("name") or tags.get("ref") or "")
+            if name not in name_ids:
+                name_ids[name] = len(names)
+                names.append(name)
+            for line in lines:
+                ids = [_node(float(c[0]), float(c[1])) for c in line if len(c) >= 2]
+                for u, v in zip(ids, ids[1:]):
+                    if u != v:
+                        segments.append((u, v, name_ids[name], tags))
+
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if segments:
+            us = np.fromiter((s[0] for s in segments), dtype=np.intp, count=len(segments))
+            vs = np.fromiter((s[1] for s in segments), dtype=np.intp, count=len(segments))
+            metres = self._segment_metres(lats, lons, us, vs)
+            segments = [(u, v, m, name, tags) for (u, v, name, tags), m in zip(segments, metres.tolist())]
+        return lats, lons, names, segments
+
+    @staticmethod
+    def _segment_metres(lats, lons, us, vs):
+        phi1, phi2 = np.radians(lats[us]), np.radians(lats[vs])
+        dlam = np.radians(lons[vs] - lons[us])
+        a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2) ** 2
+        return 2000.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    def _ensure(self):
+        """Whether the file exists; forgets the graphs when it has changed."""
+        path = self._path()
+        try:
+            mtime = path.stat().st_mtime if path else None
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._nodes, self._graphs, self._mtime = None, {}, mtime
+        return mtime is not None
+
+    def _load(self, mtime):
+        with self._read_lock:
+            with self._lock:
+                if self._nodes is not None and self._nodes[0] == mtime:
+                    return self._nodes[1]
+            path = self._path()
+            try:
+                nodes = self._read(path)
+            except (OSError, ValueError):
+                logger.exception("Could not read road graph %s", path)
+                return None
+            with self._lock:
+                if self._mtime == mtime:
+                    self._nodes = (mtime, nodes)
+            return nodes
+
+    @staticmethod
+    def _build_graph(nodes, profile):
+        lats, lons, names, segments = nodes
+        edges = []
+        for u, v, metres, name, tags in segments:
+            speed = _speed_kmh(tags, profile)
+            if not speed:
+                continue
+            sec = metres / (speed / 3.6)
+            direction = _direction(tags, profile)
+            if direction >= 0:
+                edges.append((u, v, sec, metres, name))
+            if direction <= 0:
+                edges.append((v, u, sec, metres, name))
+        return RoadGraph(lats, lons, names, edges)
+
+    def _build(self, mtime, profile):
+        try:
+            nodes = self._load(mtime)
+            graph = self._build_graph(nodes, profile) if nodes is not None else None
+        except Exception:
+            logger.exception("Could not build the %s road graph", profile)
+            graph = None
+        with self._lock:
+            if self._mtime == mtime:
+                self._graphs[profile] = graph
+            if self._builds.get(profile) is threading.current_thread():
+                del self._builds[profile]
+
+    def graph(self, profile, wait=False):
+        """
+        The profile's RoadGraph, or None when there is no road network file
+        or the graph is not built yet. Starts the build if needed; ``wait``
+        blocks until it is done.
+        """
+        with self._lock:
+            if not self._ensure():
+                return None
+            if profile in self._graphs:
+                return self._graphs[profile]
+            job = self._builds.get(profile)
+            if job is None:
+                job = threading.Thread(
+                    target=self._build, args=(self._mtime, profile), name=f"road-graph-{profile}", daemon=True,
+                )
+                self._builds[profile] = job
+                job.start()
+        if not wait:
+            return None
+        job.join()
+        with self._lock:
+            return self._graphs.get(profile)
+
+    def warm(self):
+        """Start building every profile's graph, e.g. when the server starts."""
+        for profile in SPEEDS_KMH:
+            self.graph(profile)
+
+    def available(self):
+        with self._lock:
+            return self._ensure()
+
+    def invalidate(self):
+        with self._lock:
+            self._mtime = None
+            self._nodes, self._graphs = None, {}
+
+    def route(self, profile, frm, to, overview=True, geometries="geojson", steps=False):
+        """
+        OSRM-style route response (``{"code": "Ok", "routes": [...], ...}``)
+        from ``frm`` to ``to`` (``(lat, lon)``), a ``NoSegment``/``NoRoute``
+        code when the points are off the network or unconnected, or None when
+        there is no road network file.
+        """
+        graph = self.graph(profile if profile in SPEEDS_KMH else "driving")
+        if graph is None:
+            return None
+        s, s_km = graph.snap(*frm)
+        t, t_km = graph.snap(*to)
+        if s is None or t is None:
+            return {"code": "NoSegment", "message": "Point is too far from the road network"}
+        path = graph.shortest(s, t)
+        if path is None:
+            return {"code": "NoRoute", "message": "No route found"}
+
+        coords = [[float(graph.lons[s]), float(graph.lats[s])]]
+        coords += [[float(graph.lons[v]), float(graph.lats[v])] for _, v, _, _, _ in path]
+        distance = round(sum(p[3] for p in path), 1)
+        duration = round(sum(p[2] for p in path), 1)
+        by_name = Counter()
+        for p in path:
+            if graph.names[p[4]]:
+                by_name[graph.names[p[4]]] += p[3]
+        leg = {
+            "distance": distance,
+            "duration": duration,
+            "weight": duration,
+            "summary": ", ".join(name for name, _ in by_name.most_common(2)),
+            "steps": self._steps(graph, path, coords, profile, geometries) if steps else [],
+        }
+        route = {"distance": distance, "duration": duration, "weight": duration, "weight_name": "duration", "legs": [leg]}
+        if overview:
+            route["geometry"] = _geometry(coords, geometries)
+        waypoints = [
+            {"location": coords[0], "name": graph.names[path[0][4]] if path else "", "distance": round(s_km * 1000, 1)},
+            {"location": coords[-1], "name": graph.names[path[-1][4]] if path else "", "distance": round(t_km * 1000, 1)},
+        ]
+        return {"code": "Ok", "routes": [route], "waypoints": waypoints}
+
+    def table(self, profile, points, sources=None, destinations=None):
+        """
+        OSRM-style table response (``durations``/``distances`` from the
+        ``sources`` to the ``destinations`` indices of ``points``, all of them
+        by default; None where unreachable), a ``NoSegment`` code when a point
+        is off the network, or None when there is no road network file.
+        """
+        graph = self.graph(profile if profile in SPEEDS_KMH else "driving")
+        if graph is None:
+            return None
+        nodes = [graph.snap(lat, lon)[0] for lat, lon in points]
+        if any(n is None for n in nodes):
+            return {"code": "NoSegment", "message": "Point is too far from the road network"}
+        rows = [nodes[i] for i in (range(len(nodes)) if sources is None else sources)]
+        cols = [nodes[i] for i in (range(len(nodes)) if destinations is None else destinations)]
+        durations, distances = [], []
+        for s in rows:
+            found = graph.tree(s, cols)
+            durations.append([round(found[t][0], 1) if t in found else None for t in cols])
+            distances.append([round(found[t][1], 1) if t in found else None for t in cols])
+        return {"code": "Ok", "durations": durations, "distances": distances}
+
+    @staticmethod
+    def _steps(graph, path, coords, profile, geometries):
+        """One step per run of edges on the same street, then an arrive step."""
+        steps = []
+        start = 0
+        for i in range(1, len(path) + 1):
+            if i < len(path) and path[i][4] == path[start][4]:
+                continue
+            run = path[start:i]
+            duration = round(sum(p[2] for p in run), 1)
+            steps.append({
+                "name": graph.names[run[0][4]],
+                "distance": round(sum(p[3] for p in run), 1),
+                "duration": duration,
+                "weight": duration,
+                "mode": profile,
+                "maneuver": {"type": "depart" if start == 0 else "turn", "location": coords[start]},
+                "geometry": _geometry(coords[start:i + 1], geometries),
+            })
+            start = i
+        steps.append({
+            "name": steps[-1]["name"] if steps else "",
+            "distance": 0.0,
+            "duration": 0.0,
+            "weight": 0.0,
+            "mode": profile,
+            "maneuver": {"type": "arrive", "location": coords[-1]},
+            "geometry": _geometry([coords[-1], coords[-1]], geometries),
+        })
+        return steps
+
+
+local_router = LocalRouter()
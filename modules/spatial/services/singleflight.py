@@ -0,0 +1,94 @@
+"""
+Coalesce concurrent identical upstream calls.
+
+``do(key, fn)`` runs ``fn`` once for every caller asking for the same key at
+the same time. Inside a process, followers block on the leader's result.
+Across processes the leader also holds a short lock in the Django cache
+(``cache.add`` is atomic in every backend), and followers elsewhere poll
+``lookup`` - normally a read of the cache entry the leader fills - until
+the result appears or the lock goes away, and only then call ``fn``
+themselves. With the default LocMemCache that second layer stays inside
+one process; a shared cache backend extends it to every worker.
+"""
+
+import threading
+import time
+
+from django.core.cache import cache
+
+WAIT_SEC = 15  # longest a follower waits before calling upstream itself
+POLL_SEC = 0.1
+LOCK_TTL_SEC = 20
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_lock = threading.Lock()
+_calls = {}
+
+
+def _wait_elsewhere(lock_key, lookup, wait):
+    """Poll ``lookup`` while another process holds ``lock_key``; None if it never answers."""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SEC)
+        found = lookup()
+        if found is not None:
+            return found
+        if cache.get(lock_key) is None:
+            return lookup()
+    return None
+
+
+def _lead(key, fn, lookup, wait):
+    if lookup is None:
+        return fn()
+    lock_key = f"singleflight:{key}"
+    if not cache.add(lock_key, 1, LOCK_TTL_SEC):
+        found = _wait_elsewhere(lock_key, lookup, wait)
+        if found is not None:
+            return found
+        cache.add(lock_key, 1, LOCK_TTL_SEC)
+    try:
+        return fn()
+    finally:
+        cache.delete(lock_key)
+
+
+def do(key, fn, lookup=None, wait=WAIT_SEC):
+    """
+    ``fn()``, shared with concurrent callers of the same ``key``.
+
+    ``lookup`` returns the result another process stored for ``key`` (or
+    None); without it only callers in this process are coalesced.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if not call.event.wait(wait):
+            return fn()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _lead(key, fn, lookup, wait)
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.event.set()
+    return call.result
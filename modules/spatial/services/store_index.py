@@ -0,0 +1,407 @@
+"""Process-local grid index over a compact snapshot of store coordinates.
+
+The snapshot keeps only what the spatial endpoints filter on (id, position,
+chain name, district) in parallel columns, bucketed into a uniform lat/lon
+grid. Radius and nearest queries touch the cells that overlap the search box
+instead of loading ``CuaHang`` rows, and the caller fetches full rows only for
+the ids it is going to return.
+
+Distances are computed for all candidates of a query in one NumPy call
+(``haversine_km_many``); the list columns are mirrored into arrays lazily, the
+first query after an edit pays for the copy.
+
+The snapshot is built lazily on first use, patched by the ``CuaHang``
+signal handlers in ``modules.spatial.signals`` and rebuilt after
+``SNAPSHOT_MAX_AGE_SEC`` so that edits made through another worker process
+are eventually picked up.
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+
+import numpy as np
+from django.core.cache import cache
+
+from modules.spatial.services.district_index import district_index
+from modules.spatial.utils.geo import EARTH_RADIUS_KM, bbox_deltas, haversine_km_many, mercator_xy, top_k
+
+CELL_DEG = 0.01  # ~1.1 km at HCM latitude
+SNAPSHOT_MAX_AGE_SEC = 300
+NEAREST_MAX_RINGS = 30  # beyond ~30 km of empty rings a full scan is cheaper
+BATCH_BLOCK_SIZE = 2_000_000  # origin x store distances per NumPy block in nearest_many
+CLUSTER_CELL_PX = 60  # screen-space cluster size, same order as Leaflet.markercluster
+
+_GENERATION_KEY = "spatial:store_generation"
+
+
+def _seconds(t):
+    return -1 if t is None else t.hour * 3600 + t.minute * 60 + t.second
+
+
+class StoreIndex:
+    def __init__(self, cell_deg=CELL_DEG, max_age=SNAPSHOT_MAX_AGE_SEC):
+        self.cell_deg = cell_deg
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._ready = False
+        self._built_at = 0.0
+        self._ids = []
+        self._lats = []
+        self._lons = []
+        self._brands = []
+        self._districts = []
+        self._opens = []
+        self._closes = []
+        self._all_day = []
+        self._pos = {}
+        self._cells = {}
+        self._arrays = None
+        self._clusters = {}
+
+    # ---- snapshot maintenance ----
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _load_rows(self):
+        from modules.store.models import CuaHang
+
+        return CuaHang.objects.values_list(
+            "id", "vi_do", "kinh_do", "chuoi__ten", "quan_huyen",
+            "mo_cua", "dong_cua", "hoat_dong_24h",
+        )
+
+    def _append(self, store_id, lat, lon, brand, district, mo_cua=None, dong_cua=None, all_day=False):
+        pos = len(self._ids)
+        self._ids.append(store_id)
+        self._lats.append(float(lat))
+        self._lons.append(float(lon))
+        self._brands.append((brand or "").upper())
+        self._districts.append((district or "").strip().lower())
+        self._opens.append(_seconds(mo_cua))
+        self._closes.append(_seconds(dong_cua))
+        self._all_day.append(bool(all_day))
+        self._pos[store_id] = pos
+        self._cells.setdefault(self._cell(float(lat), float(lon)), []).append(pos)
+        self._arrays = None
+
+    def _drop(self, store_id):
+        pos = self._pos.pop(store_id, None)
+        if pos is None:
+            return
+        self._arrays = None
+        bucket = self._cells.get(self._cell(self._lats[pos], self._lons[pos]))
+        if bucket is not None:
+            try:
+                bucket.remove(pos)
+            except ValueError:
+                pass
+
+    def rebuild(self):
+        with self._lock:
+            self._reset()
+            for row in self._load_rows():
+                if row[1] is None or row[2] is None:
+                    continue
+                self._append(*row)
+            self._built_at = time.monotonic()
+            self._ready = True
+
+    def _ensure(self):
+        if self._ready and (time.monotonic() - self._built_at) < self.max_age:
+            return
+        with self._lock:
+            if self._ready and (time.monotonic() - self._built_at) < self.max_age:
+                return
+            self.rebuild()
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+
+    def upsert(self, store):
+        """Patch one store into the snapshot after it was saved."""
+        with self._lock:
+            if not self._ready:
+                return
+            self._drop(store.id)
+            if store.vi_do is None or store.kinh_do is None:
+                return
+            brand = store.chuoi.ten if getattr(store, "chuoi", None) else ""
+            self._append(
+                store.id, store.vi_do, store.kinh_do, brand, store.quan_huyen,
+                store.mo_cua, store.dong_cua, store.hoat_dong_24h,
+            )
+
+    def remove(self, store_id):
+        with self._lock:
+            if self._ready:
+                self._drop(store_id)
+
+    def _columns(self):
+        if self._arrays is None:
+            self._arrays = {
+                "id": np.array(self._ids, dtype=np.int64),
+                "lat": np.array(self._lats, dtype=np.float64),
+                "lon": np.array(self._lons, dtype=np.float64),
+                "brand": np.array(self._brands, dtype=str),
+                "district": np.array(self._districts, dtype=str),
+                "open": np.array(self._opens, dtype=np.int32),
+                "close": np.array(self._closes, dtype=np.int32),
+                "all_day": np.array(self._all_day, dtype=bool),
+            }
+            self._clusters = {}
+        return self._arrays
+
+    def __len__(self):
+        self._ensure()
+        return len(self._pos)
+
+    # ---- queries ----
+    def _filter(self, pos, brands=None, district="", open_at=None):
+        cols = self._columns()
+        district = (district or "").strip().lower()
+        if brands and len(pos):
+            pos = pos[np.isin(cols["brand"][pos], list(brands))]
+        if district and len(pos):
+            inside = district_index.contains_mask(district, cols["lat"][pos], cols["lon"][pos])
+            pos = pos[inside if inside is not None else cols["district"][pos] == district]
+        if open_at is not None and len(pos):
+            # Same rule as _store_dict's is_open_now; unknown hours count as closed.
+            t = _seconds(open_at)
+            o, c = cols["open"][pos], cols["close"][pos]
+            known = (o >= 0) & (c >= 0)
+            same_day = (o <= c) & (o <= t) & (t <= c)
+            overnight = (o > c) & ((t >= o) | (t <= c))
+            pos = pos[cols["all_day"][pos] | (known & (same_day | overnight))]
+        return pos
+
+    def _candidates(self, lat, lon, radius_km, brands=None, district="", open_at=None):
+        dlat, dlon = bbox_deltas(lat, radius_km)
+        ci0, cj0 = self._cell(lat - dlat, lon - dlon)
+        ci1, cj1 = self._cell(lat + dlat, lon + dlon)
+        if (ci1 - ci0 + 1) * (cj1 - cj0 + 1) > len(self._cells):
+            # Very large radius: walking the occupied cells is cheaper.
+            buckets = [
+                bucket for (ci, cj), bucket in self._cells.items()
+                if ci0 <= ci <= ci1 and cj0 <= cj <= cj1
+            ]
+        else:
+            buckets = [
+                self._cells.get((ci, cj), ())
+                for ci in range(ci0, ci1 + 1)
+                for cj in range(cj0, cj1 + 1)
+            ]
+        pos = np.fromiter(itertools.chain.from_iterable(buckets), dtype=np.intp)
+        return self._filter(pos, brands, district, open_at)
+
+    def _ring(self, ci, cj, r):
+        """Positions in the cells at Chebyshev distance exactly ``r`` from (ci, cj)."""
+        if r == 0:
+            cells = [(ci, cj)]
+        else:
+            cells = [(ci + di, cj + dj) for di in (-r, r) for dj in range(-r, r + 1)]
+            cells += [(ci + di, cj + dj) for dj in (-r, r) for di in range(-r + 1, r)]
+        buckets = [self._cells.get(c, ()) for c in cells]
+        return np.fromiter(itertools.chain.from_iterable(buckets), dtype=np.intp)
+
+    def _clearance_km(self, lat, lon, ci, cj, r):
+        """Lower bound on the distance from the point to any store outside rings 0..r."""
+        cd = self.cell_deg
+        dlat = min(lat - (ci - r) * cd, (ci + r + 1) * cd - lat)
+        dlon = min(lon - (cj - r) * cd, (cj + r + 1) * cd - lon)
+        lat_km = math.radians(dlat) * EARTH_RADIUS_KM
+        # Distance from the point to the meridian dlon away.
+        lon_km = EARTH_RADIUS_KM * math.asin(
+            min(1.0, math.cos(math.radians(lat)) * math.sin(math.radians(min(dlon, 90.0))))
+        )
+        return min(lat_km, lon_km)
+
+    def radius(self, lat, lon, radius_km, brands=None, district="", limit=None, open_at=None, with_coords=False):
+        """
+        Return ``[(distance_km, store_id), ...]`` inside the circle, nearest first.
+        With ``with_coords`` each hit also carries the store's ``lat, lon``.
+        """
+        self._ensure()
+        with self._lock:
+            pos = self._candidates(lat, lon, radius_km, brands, district, open_at)
+            cols = self._columns()
+        dist = haversine_km_many(lat, lon, cols["lat"][pos], cols["lon"][pos])
+        keep = dist <= radius_km
+        pos, dist = pos[keep], dist[keep]
+        if limit is not None and len(pos) > limit:
+            order = top_k(dist, limit)
+        else:
+            order = np.argsort(dist, kind="stable")
+        pos = pos[order]
+        if with_coords:
+            return list(zip(
+                dist[order].tolist(), cols["id"][pos].tolist(),
+                cols["lat"][pos].tolist(), cols["lon"][pos].tolist(),
+            ))
+        return list(zip(dist[order].tolist(), cols["id"][pos].tolist()))
+
+    def nearest(self, lat, lon, k=1, brands=None, district="", open_at=None, max_km=None):
+        """
+        Return the ``k`` closest matching stores as ``[(distance_km, store_id), ...]``.
+
+        Grid rings are searched outwards from the query cell, keeping the best
+        ``k`` in a bounded heap, until the k-th distance is no farther than the
+        unsearched area (or ``max_km``). If that has not happened after
+        ``NEAREST_MAX_RINGS`` rings the whole snapshot is scanned in one
+        vectorized pass instead, so a query's cost is bounded whatever the
+        data density.
+        """
+        if k <= 0:
+            return []
+        self._ensure()
+        with self._lock:
+            cols = self._columns()
+            ci, cj = self._cell(lat, lon)
+            heap = []  # max-heap on distance: (-distance_km, store_id)
+
+            def _merge(pos):
+                pos = self._filter(pos, brands, district, open_at)
+                if not len(pos):
+                    return
+                dist = haversine_km_many(lat, lon, cols["lat"][pos], cols["lon"][pos])
+                for i in top_k(dist, k).tolist():
+                    item = (-float(dist[i]), int(cols["id"][pos[i]]))
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+
+            for r in range(NEAREST_MAX_RINGS + 1):
+                _merge(self._ring(ci, cj, r))
+                clearance = self._clearance_km(lat, lon, ci, cj, r)
+                if max_km is not None and clearance >= max_km:
+                    break
+                if len(heap) == k and -heap[0][0] <= clearance:
+                    break
+            else:
+                heap.clear()
+                _merge(np.fromiter(self._pos.values(), dtype=np.intp))
+
+        hits = sorted((-neg, sid) for neg, sid in heap)
+        if max_km is not None:
+            hits = [(d, sid) for d, sid in hits if d <= max_km]
+        return hits
+
+    def nearest_many(self, lats, lons, k=1, brands=None, district="", max_km=None):
+        """
+        k nearest matching stores for each origin, as one list of hits per origin.
+
+        A brute-force vectorized join: origins are processed in blocks so that
+        each block's origin x store distance matrix stays near
+        ``BATCH_BLOCK_SIZE`` entries, and ``top_k`` picks each row's k best.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        self._ensure()
+        with self._lock:
+            cols = self._columns()
+            pos = self._filter(np.fromiter(self._pos.values(), dtype=np.intp), brands, district)
+        if not len(pos) or k <= 0:
+            return [[] for _ in range(len(lats))]
+        s_lat, s_lon, s_id = cols["lat"][pos], cols["lon"][pos], cols["id"][pos]
+        step = max(1, BATCH_BLOCK_SIZE // len(pos))
+        out = []
+        for a in range(0, len(lats), step):
+            dist = haversine_km_many(lats[a:a + step], lons[a:a + step], s_lat, s_lon)
+            idx = top_k(dist, k)
+            best = np.take_along_axis(dist, idx, axis=-1).tolist()
+            for row_d, row_id in zip(best, s_id[idx].tolist()):
+                out.append([
+                    (d, sid) for d, sid in zip(row_d, row_id)
+                    if max_km is None or d <= max_km
+                ])
+        return out
+
+    # ---- clustering ----
+    def _build_clusters(self, zoom, brands, district):
+        cols = self._columns()
+        pos = self._filter(np.fromiter(self._pos.values(), dtype=np.intp), brands, district)
+        lat, lon, brand = cols["lat"][pos], cols["lon"][pos], cols["brand"][pos]
+        n = max(1, int(256 * (2 ** zoom) // CLUSTER_CELL_PX))
+        x, y = mercator_xy(lat, lon)
+        cx = np.clip((x * n).astype(np.int64), 0, n - 1)
+        cy = np.clip((y * n).astype(np.int64), 0, n - 1)
+        keys, inv = np.unique(cx * n + cy, return_inverse=True)
+        inv = inv.ravel()
+        count = np.bincount(inv, minlength=len(keys))
+        names, bcode = np.unique(brand, return_inverse=True)
+        by_brand = np.bincount(
+            inv * len(names) + bcode.ravel(), minlength=len(keys) * len(names)
+        ).reshape(len(keys), len(names))
+        single = np.full(len(keys), -1, dtype=np.int64)
+        single[inv] = cols["id"][pos]
+        return {
+            "key": keys,
+            "n": n,
+            "lat": np.bincount(inv, weights=lat, minlength=len(keys)) / np.maximum(count, 1),
+            "lon": np.bincount(inv, weights=lon, minlength=len(keys)) / np.maximum(count, 1),
+            "count": count,
+            "brand_names": names.tolist(),
+            "by_brand": by_brand,
+            "single": single,
+        }
+
+    def clusters(self, zoom, south, west, north, east, brands=None, district=""):
+        """
+        Grid clusters (count, centroid, per-brand counts) for one zoom level.
+
+        Clusters are computed once per (zoom, brand, district) over the whole
+        snapshot and memoized until the next edit; a request only filters the
+        precomputed centroids by its bounds.
+        """
+        self._ensure()
+        memo_key = (int(zoom), tuple(sorted(brands or ())), (district or "").strip().lower())
+        with self._lock:
+            self._columns()
+            table = self._clusters.get(memo_key)
+            if table is None:
+                table = self._clusters[memo_key] = self._build_clusters(*memo_key)
+
+        lat, lon = table["lat"], table["lon"]
+        mask = (
+            (lat >= min(south, north)) & (lat <= max(south, north))
+            & (lon >= min(west, east)) & (lon <= max(west, east))
+        )
+        out = []
+        for i in np.flatnonzero(mask).tolist():
+            key = int(table["key"][i])
+            count = int(table["count"][i])
+            out.append({
+                "id": f"{memo_key[0]}/{key // table['n']}/{key % table['n']}",
+                "lat": round(float(lat[i]), 6),
+                "lon": round(float(lon[i]), 6),
+                "count": count,
+                "brands": {
+                    name: int(c)
+                    for name, c in zip(table["brand_names"], table["by_brand"][i].tolist())
+                    if c
+                },
+                "store_id": int(table["single"][i]) if count == 1 else None,
+            })
+        return out
+
+
+def store_generation():
+    """Counter folded into spatial cache keys; bumped on every store edit."""
+    return cache.get_or_set(_GENERATION_KEY, 1, None)
+
+
+def bump_store_generation():
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        cache.set(_GENERATION_KEY, 2, None)
+
+
+store_index = StoreIndex()
@@ -0,0 +1,70 @@
+"""On-disk cache for store-layer vector tiles.
+
+Tiles live under ``settings.SPATIAL_TILE_CACHE_DIR`` as ``z/x/y.pbf`` so every
+worker on the host (and a fronting nginx, if pointed at the directory) shares
+them. Store edits delete the tiles around the old and new position at every
+zoom through ``modules.spatial.signals``; files older than
+``TILE_DISK_MAX_AGE_SEC`` are treated as missing in case an invalidation raced
+with a tile being written.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from modules.spatial.utils.geo import tile_of
+
+TILE_MIN_ZOOM = 0
+TILE_MAX_ZOOM = 18
+TILE_DISK_MAX_AGE_SEC = 60 * 60 * 24
+
+
+def cache_dir() -> Path:
+    return Path(getattr(settings, "SPATIAL_TILE_CACHE_DIR", settings.BASE_DIR / "cache" / "tiles"))
+
+
+def _path(z: int, x: int, y: int) -> Path:
+    return cache_dir() / str(z) / str(x) / f"{y}.pbf"
+
+
+def read(z: int, x: int, y: int):
+    path = _path(z, x, y)
+    try:
+        if time.time() - path.stat().st_mtime > TILE_DISK_MAX_AGE_SEC:
+            return None
+        return path.read_bytes()
+    except OSError:
+        return None
+
+
+def write(z: int, x: int, y: int, data: bytes):
+    path = _path(z, x, y)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def invalidate_point(lat: float, lon: float):
+    """Drop every cached tile whose buffered extent can contain the point."""
+    for z in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1):
+        n = 2 ** z
+        tx, ty = tile_of(lat, lon, z)
+        for x in {max(tx - 1, 0), tx, min(tx + 1, n - 1)}:
+            for y in {max(ty - 1, 0), ty, min(ty + 1, n - 1)}:
+                try:
+                    _path(z, x, y).unlink()
+                except OSError:
+                    pass
+
+
+def clear():
+    shutil.rmtree(cache_dir(), ignore_errors=True)
@@ -0,0 +1,111 @@
+"""
+Visiting order for a start point and a set of stops.
+
+``plan(cost, closed, budget_sec)`` takes a travel-time matrix whose row and
+column 0 is the start and returns the stop order. Nearest insertion builds
+a tour, then 2-opt (segment reversal) and Or-opt (moving runs of one to
+three stops) improve it until no move helps or the time budget runs out.
+Costs may be asymmetric (one-way streets): reversal deltas use prefix sums
+of the forward and backward leg costs, so every move is evaluated in O(1).
+With ``closed`` the tour returns to the start; otherwise it ends at the
+last stop.
+"""
+
+import time
+
+UNREACHABLE = 1e9  # cost used for pairs without a route
+OR_OPT_MAX_RUN = 3
+
+
+def _cost(cost, a, b):
+    c = cost[a][b]
+    return UNREACHABLE if c is None else c
+
+
+def tour_cost(cost, tour):
+    return sum(_cost(cost, a, b) for a, b in zip(tour, tour[1:]))
+
+
+def _nearest_insertion(cost, n, closed):
+    tour = [0, 0] if closed else [0]
+    left = set(range(1, n))
+    while left:
+        k = min(left, key=lambda x: min(min(_cost(cost, t, x), _cost(cost, x, t)) for t in tour))
+        best_pos, best_delta = len(tour), None
+        for i in range(1, len(tour) + (0 if closed else 1)):
+            a = tour[i - 1]
+            if i < len(tour):
+                b = tour[i]
+                delta = _cost(cost, a, k) + _cost(cost, k, b) - _cost(cost, a, b)
+            else:
+                delta = _cost(cost, a, k)
+            if best_delta is None or delta < best_delta:
+                best_pos, best_delta = i, delta
+        tour.insert(best_pos, k)
+        left.remove(k)
+    return tour
+
+
+def _two_opt(cost, tour, last, deadline):
+    """One improving reversal of ``tour[i..j]`` (``1 <= i < j <= last``); True if applied."""
+    fwd = [0.0]
+    bwd = [0.0]
+    for a, b in zip(tour, tour[1:]):
+        fwd.append(fwd[-1] + _cost(cost, a, b))
+        bwd.append(bwd[-1] + _cost(cost, b, a))
+    for i in range(1, last):
+        if time.monotonic() > deadline:
+            return False
+        before = tour[i - 1]
+        for j in range(i + 1, last + 1):
+            after = tour[j + 1] if j + 1 < len(tour) else None
+            old = _cost(cost, before, tour[i]) + (fwd[j] - fwd[i])
+            new = _cost(cost, before, tour[j]) + (bwd[j] - bwd[i])
+            if after is not None:
+                old += _cost(cost, tour[j], after)
+                new += _cost(cost, tour[i], after)
+            if new < old - 1e-9:
+                tour[i:j + 1] = tour[i:j + 1][::-1]
+                return True
+    return False
+
+
+def _or_opt(cost, tour, last, closed, deadline):
+    """One improving move of a run of up to OR_OPT_MAX_RUN stops; True if applied."""
+    for run in range(1, OR_OPT_MAX_RUN + 1):
+        for i in range(1, last - run + 2):
+            if time.monotonic() > deadline:
+                return False
+            j = i + run - 1  # run is tour[i..j]
+            before = tour[i - 1]
+            after = tour[j + 1] if j + 1 < len(tour) else None
+            removed = _cost(cost, before, tour[i])
+            if after is not None:
+                removed += _cost(cost, tour[j], after) - _cost(cost, before, after)
+            rest = tour[:i] + tour[j + 1:]
+            # Insert before rest[p]; an open path may also end with the run.
+            for p in range(1, len(rest) + (0 if closed else 1)):
+                if p == i:
+                    continue
+                a = rest[p - 1]
+                added = _cost(cost, a, tour[i])
+                if p < len(rest):
+                    added += _cost(cost, tour[j], rest[p]) - _cost(cost, a, rest[p])
+                if added < removed - 1e-9:
+                    tour[:] = rest[:p] + tour[i:j + 1] + rest[p:]
+                    return True
+    return False
+
+
+def plan(cost, closed=False, budget_sec=0.3):
+    """Stop indices (1..n-1 of ``cost``) in visiting order."""
+    n = len(cost)
+    if n <= 2:
+        return list(range(1, n))
+    deadline = time.monotonic() + budget_sec
+    tour = _nearest_insertion(cost, n, closed)
+    last = len(tour) - 2 if closed else len(tour) - 1  # last movable position
+    while time.monotonic() <= deadline:
+        if not (_two_opt(cost, tour, last, deadline) or _or_opt(cost, tour, last, closed, deadline)):
+            break
+    return tour[1:last + 1]
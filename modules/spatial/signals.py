@@ -0,0 +1,66 @@
+"""
+Keep process-local spatial structures in step with store edits. In-memory
+updates wait for the transaction to commit, so a rolled-back edit never
+reaches the store index or tile cache.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from modules.store.models import ChuoiCuaHang, CuaHang
+
+from .services import route_store, tile_cache
+from .services.store_index import bump_store_generation, store_index
+
+
+@receiver(pre_save, sender=CuaHang, dispatch_uid="spatial_store_saving")
+def store_saving(sender, instance, **kwargs):
+    # Remember where the store was so its old tiles can be dropped too.
+    instance._spatial_prev_latlon = None
+    if instance.pk:
+        instance._spatial_prev_latlon = (
+            CuaHang.objects.filter(pk=instance.pk).values_list("vi_do", "kinh_do").first()
+        )
+
+
+@receiver(post_save, sender=CuaHang, dispatch_uid="spatial_store_saved")
+def store_saved(sender, instance, **kwargs):
+    prev = getattr(instance, "_spatial_prev_latlon", None)
+    if prev and None not in prev and prev != (instance.vi_do, instance.kinh_do):
+        route_store.invalidate_store(instance.id)
+
+    def _committed():
+        store_index.upsert(instance)
+        bump_store_generation()
+        if prev and None not in prev:
+            tile_cache.invalidate_point(*prev)
+        if instance.vi_do is not None and instance.kinh_do is not None:
+            tile_cache.invalidate_point(instance.vi_do, instance.kinh_do)
+
+    transaction.on_commit(_committed)
+
+
+@receiver(post_delete, sender=CuaHang, dispatch_uid="spatial_store_deleted")
+def store_deleted(sender, instance, **kwargs):
+    store_id = instance.id  # Django clears the pk once the delete is done
+
+    def _committed():
+        store_index.remove(store_id)
+        bump_store_generation()
+        if instance.vi_do is not None and instance.kinh_do is not None:
+            tile_cache.invalidate_point(instance.vi_do, instance.kinh_do)
+
+    transaction.on_commit(_committed)
+
+
+@receiver(post_save, sender=ChuoiCuaHang, dispatch_uid="spatial_chain_saved")
+def chain_saved(sender, instance, created, **kwargs):
+    # Renaming a chain changes the brand of every store in it.
+    if not created:
+        def _committed():
+            store_index.invalidate()
+            bump_store_generation()
+            tile_cache.clear()
+
+        transaction.on_commit(_committed)
@@ -0,0 +1,51 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from modules.spatial.services import circuit
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        circuit.reset()
+        self.addCleanup(circuit.reset)
+
+    def test_opens_after_consecutive_failures(self):
+        cb = circuit.breaker("p")
+        for _ in range(circuit.CONSECUTIVE_FAILURES_OPEN):
+            self.assertTrue(cb.allow())
+            cb.record(False, 0.1)
+        self.assertEqual(cb.state, circuit.OPEN)
+        self.assertFalse(cb.allow())
+        self.assertEqual(circuit.ordered(["p", "q"]), ["q"])
+
+    def test_half_open_lets_one_probe_through(self):
+        cb = circuit.breaker("p")
+        for _ in range(circuit.CONSECUTIVE_FAILURES_OPEN):
+            cb.record(False, 0.1)
+
+        with patch("modules.spatial.services.circuit.time.monotonic", return_value=cb._opened_at + circuit.COOLDOWN_SEC + 0.001):
+            self.assertEqual(cb.state, circuit.HALF_OPEN)
+            self.assertTrue(cb.allow())
+            self.assertFalse(cb.allow())
+            cb.record(True, 0.05)
+        self.assertEqual(cb.state, circuit.CLOSED)
+
+    def test_failed_probe_doubles_the_cooldown(self):
+        cb = circuit.breaker("p")
+        for _ in range(circuit.CONSECUTIVE_FAILURES_OPEN):
+            cb.record(False, 0.1)
+        with patch("modules.spatial.services.circuit.time.monotonic", return_value=cb._opened_at + circuit.COOLDOWN_SEC + 0.001):
+            self.assertTrue(cb.allow())
+            cb.record(False, 0.1)
+        self.assertEqual(cb.state, circuit.OPEN)
+        self.assertEqual(cb._cooldown, circuit.COOLDOWN_SEC * 2)
+
+    def test_orders_by_error_rate_then_latency(self):
+        circuit.breaker("slow").record(True, 2.0)
+        circuit.breaker("fast").record(True, 0.1)
+        flaky = circuit.breaker("flaky")
+        flaky.record(False, 0.05)
+        flaky.record(True, 0.05)
+        self.assertEqual(circuit.ordered(["flaky", "slow", "fast"]), ["fast", "slow", "flaky"])
+        self.assertEqual(circuit.snapshot()["flaky"]["error_rate"], 0.5)
@@ -0,0 +1,915 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import time as time_module
+from datetime import time, timedelta
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from modules.spatial import controllers
+from modules.spatial.models import GeocodeCache, RouteCache
+from modules.spatial.services import circuit, geocode_store, postgis, route_store, tile_cache
+from modules.spatial.services.district_index import district_index
+from modules.spatial.services.geocoding_service import local_geocoder
+from modules.spatial.services.reverse_index import reverse_index
+from modules.spatial.services.routing_service import local_router
+from modules.spatial.services.store_index import store_generation, store_index
+from modules.spatial.tests.test_routing import grid_roads
+from modules.spatial.utils import geohash
+from modules.spatial.utils.geo import tile_of
+from modules.store.models import ChuoiCuaHang, CuaHang
+
+
+def _make_store(chain, ten, lat, lon, quan_huyen="Quan 1", **extra):
+    extra.setdefault("dia_chi", f"{ten}, TP.HCM")
+    return CuaHang.objects.create(
+        chuoi=chain,
+        ten=ten,
+        quan_huyen=quan_huyen,
+        vi_do=lat,
+        kinh_do=lon,
+        **extra,
+    )
+
+
+class SpatialTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        store_index.invalidate()
+        local_geocoder.invalidate()
+        reverse_index.invalidate()
+        self.circlek = ChuoiCuaHang.objects.create(ten="CIRCLEK")
+        self.gs25 = ChuoiCuaHang.objects.create(ten="GS25")
+
+
+class StoreIndexTests(SpatialTestCase):
+    def test_radius_filters_and_orders_by_distance(self):
+        near = _make_store(self.circlek, "CK Near", 10.7770, 106.7010)
+        far = _make_store(self.circlek, "CK Far", 10.7800, 106.7050)
+        _make_store(self.gs25, "GS Near", 10.7771, 106.7011)
+        _make_store(self.circlek, "CK Outside", 10.8500, 106.8000)
+
+        hits = store_index.radius(10.7769, 106.7009, 1.0, brands={"CIRCLEK"})
+        self.assertEqual([sid for _, sid in hits], [near.id, far.id])
+
+    def test_index_is_patched_on_save_and_delete(self):
+        store = _make_store(self.circlek, "CK Move", 10.7770, 106.7010)
+        self.assertEqual(len(store_index.radius(10.7769, 106.7009, 0.5)), 1)
+
+        store.vi_do = 10.9000
+        with self.captureOnCommitCallbacks(execute=True):
+            store.save()
+        self.assertEqual(store_index.radius(10.7769, 106.7009, 0.5), [])
+        self.assertEqual(len(store_index.radius(10.9000, 106.7010, 0.5)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.delete()
+        self.assertEqual(store_index.radius(10.9000, 106.7010, 0.5), [])
+
+    def test_rolled_back_edit_leaves_the_index_alone(self):
+        store = _make_store(self.circlek, "CK Stay", 10.7770, 106.7010)
+        self.assertEqual(len(store_index.radius(10.7769, 106.7009, 0.5)), 1)
+        generation = store_generation()
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            store.vi_do = 10.9000
+            store.save()
+            raise RuntimeError("rollback")
+        self.assertEqual(len(store_index.radius(10.7769, 106.7009, 0.5)), 1)
+        self.assertEqual(store_index.radius(10.9000, 106.7010, 0.5), [])
+        self.assertEqual(store_generation(), generation)
+
+    def test_stores_in_radius_endpoint(self):
+        _make_store(self.circlek, "CK A", 10.7770, 106.7010, quan_huyen="Quan 1")
+        _make_store(self.circlek, "CK B", 10.7775, 106.7015, quan_huyen="Quan 3")
+
+        response = self.client.get(
+            "/tools/stores-in-radius/",
+            {"lat": 10.7769, "lon": 106.7009, "radius_km": 1, "district": "quan 1"},
+        )
+        data = response.json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["stores"][0]["name"], "CK A")
+        self.assertIn("distance_km", data["stores"][0])
+
+
+class SpatialBackendTests(SpatialTestCase):
+    def test_float_fallback_without_postgis(self):
+        self.assertFalse(postgis.postgis_enabled())
+        _make_store(self.circlek, "CK In", 10.7770, 106.7010)
+        _make_store(self.circlek, "CK Out", 10.9000, 106.7010)
+
+        response = self.client.get(
+            "/tools/stores-in-bounds/",
+            {"south": 10.70, "west": 106.60, "north": 10.80, "east": 106.80},
+        )
+        data = response.json()
+        self.assertEqual([s["name"] for s in data["stores"]], ["CK In"])
+
+
+class NearestTests(SpatialTestCase):
+    def test_nearest_expands_until_k_found(self):
+        a = _make_store(self.circlek, "CK A", 10.7770, 106.7010)
+        b = _make_store(self.circlek, "CK B", 10.8500, 106.7500)
+        _make_store(self.gs25, "GS C", 10.7771, 106.7011)
+        # Far beyond the ring budget, only reachable through the full scan.
+        c = _make_store(self.circlek, "CK Ha Noi", 21.0285, 105.8542)
+
+        hits = store_index.nearest(10.7769, 106.7009, k=3, brands={"CIRCLEK"})
+        self.assertEqual([sid for _, sid in hits], [a.id, b.id, c.id])
+
+    def test_nearest_open_now_filter(self):
+        _make_store(self.circlek, "CK Day", 10.7770, 106.7010, mo_cua=time(7, 0), dong_cua=time(22, 0))
+        night = _make_store(self.circlek, "CK Night", 10.7800, 106.7050, mo_cua=time(22, 0), dong_cua=time(6, 0))
+        _make_store(self.circlek, "CK Unknown", 10.7769, 106.7009)
+
+        hits = store_index.nearest(10.7769, 106.7009, k=5, open_at=time(23, 30))
+        self.assertEqual([sid for _, sid in hits], [night.id])
+
+    def test_nearest_endpoint(self):
+        _make_store(self.circlek, "CK A", 10.7770, 106.7010)
+        _make_store(self.gs25, "GS B", 10.7800, 106.7050)
+
+        response = self.client.get("/tools/nearest/", {"lat": 10.7769, "lon": 106.7009, "k": 1, "brand": "gs25"})
+        data = response.json()
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(data["stores"][0]["name"], "GS B")
+
+
+class ClusterTests(SpatialTestCase):
+    def test_bounds_returns_clusters_when_zoomed_out(self):
+        for i in range(5):
+            _make_store(self.circlek, f"CK {i}", 10.7770 + i * 0.0005, 106.7010)
+        _make_store(self.gs25, "GS 1", 10.7772, 106.7012)
+        _make_store(self.gs25, "GS Far", 10.9500, 106.6000)
+        bounds = {"south": 10.70, "west": 106.50, "north": 11.00, "east": 106.80}
+
+        data = self.client.get("/tools/stores-in-bounds/", {**bounds, "zoom": 10}).json()
+        self.assertEqual(data["mode"], "clusters")
+        self.assertEqual(data["total"], 7)
+        big = max(data["clusters"], key=lambda c: c["count"])
+        self.assertEqual(big["count"], 6)
+        self.assertEqual(big["brands"], {"CIRCLEK": 5, "GS25": 1})
+
+        data = self.client.get("/tools/stores-in-bounds/", {**bounds, "zoom": 16}).json()
+        self.assertEqual(data["mode"], "stores")
+        self.assertEqual(data["count"], 7)
+
+
+class VectorTileTests(SpatialTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(SPATIAL_TILE_CACHE_DIR=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_tile_is_cached_and_invalidated_on_store_edit(self):
+        store = _make_store(self.circlek, "CK Tile", 10.7769, 106.7009, quan_huyen="Quan 1")
+        x, y = tile_of(10.7769, 106.7009, 14)
+        url = f"/tools/tiles/14/{x}/{y}.pbf"
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+        self.assertIn(b"CIRCLEK", response.content)
+        self.assertIn(b"Quan 1", response.content)
+        self.assertIsNotNone(tile_cache.read(14, x, y))
+
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        store.quan_huyen = "Quan 3"
+        with self.captureOnCommitCallbacks(execute=True):
+            store.save()
+        self.assertIsNone(tile_cache.read(14, x, y))
+        self.assertIn(b"Quan 3", self.client.get(url).content)
+
+    def test_tile_out_of_range(self):
+        self.assertEqual(self.client.get("/tools/tiles/2/4/0.pbf").status_code, 404)
+
+
+class RadiusCellCacheTests(SpatialTestCase):
+    def test_nearby_centers_share_cell_but_stay_exact(self):
+        _make_store(self.circlek, "CK Edge", 10.7769, 106.7100)
+        params = {"lon": 106.7009, "radius_km": 1}
+
+        first = self.client.get("/tools/stores-in-radius/", {**params, "lat": 10.7769}).json()
+        self.assertEqual(first["message"], "OK")
+        self.assertEqual(first["total"], 1)
+
+        # A few meters away: same geohash cell, exact distance recomputed.
+        second = self.client.get("/tools/stores-in-radius/", {**params, "lat": 10.77695, "radius_km": 0.98}).json()
+        self.assertEqual(second["message"], "OK (cache)")
+        self.assertEqual(second["total"], 0)
+
+    def test_store_edit_invalidates_cell_entries(self):
+        params = {"lat": 10.7769, "lon": 106.7009, "radius_km": 1}
+        self.assertEqual(self.client.get("/tools/stores-in-radius/", params).json()["total"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            _make_store(self.circlek, "CK New", 10.7770, 106.7010)
+        self.assertEqual(self.client.get("/tools/stores-in-radius/", params).json()["total"], 1)
+
+
+class KeysetPaginationTests(SpatialTestCase):
+    def _walk(self, url, params):
+        seen, cursor = [], None
+        while True:
+            page = self.client.get(url, {**params, **({"cursor": cursor} if cursor else {})}).json()
+            seen += [s["id"] for s in page["stores"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                return seen
+
+    def test_radius_pages_follow_distance_then_id(self):
+        # Two stores share coordinates to exercise the id tie-break.
+        stores = [_make_store(self.circlek, f"CK {i}", 10.7770 + i * 0.001, 106.7010) for i in range(4)]
+        twin = _make_store(self.circlek, "CK Twin", 10.7790, 106.7010)
+        params = {"lat": 10.7769, "lon": 106.7009, "radius_km": 2, "limit": 2}
+
+        first = self.client.get("/tools/stores-in-radius/", params).json()
+        self.assertEqual(first["total"], 5)
+        self.assertEqual(first["count"], 2)
+        expected = [stores[0].id, stores[1].id, stores[2].id, twin.id, stores[3].id]
+        self.assertEqual(self._walk("/tools/stores-in-radius/", params), expected)
+
+    def test_search_pages_by_id(self):
+        ids = [_make_store(self.gs25, f"GS {i}", 10.77, 106.70).id for i in range(5)]
+        self.assertEqual(self._walk("/tools/search-stores/", {"q": "GS", "limit": 2}), ids)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/tools/search-stores/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class NearestBatchTests(SpatialTestCase):
+    URL = "/tools/nearest-batch/"
+
+    def _post(self, body):
+        return self.client.post(self.URL, data=json.dumps(body), content_type="application/json")
+
+    @patch("modules.spatial.controllers._resolve_geocode_payload", return_value={"location": None, "provider": None, "score": 0})
+    def test_batch_keeps_input_order(self, _geocode):
+        a = _make_store(self.circlek, "CK A", 10.7770, 106.7010)
+        b = _make_store(self.circlek, "CK B", 10.8500, 106.7500)
+        _make_store(self.gs25, "GS A", 10.7771, 106.7011)
+
+        data = self._post({
+            "brand": "circlek",
+            "k": 1,
+            "points": [
+                {"lat": 10.8499, "lon": 106.7499},
+                {"address": "nowhere"},
+                {"address": "10.7769, 106.7009"},
+            ],
+        }).json()
+        self.assertEqual([r["index"] for r in data["results"]], [0, 1, 2])
+        self.assertEqual(data["results"][0]["stores"][0]["id"], b.id)
+        self.assertIsNone(data["results"][1]["location"])
+        self.assertEqual(data["results"][2]["stores"][0]["id"], a.id)
+
+    def test_large_batches_stream_ndjson(self):
+        store = _make_store(self.circlek, "CK A", 10.7770, 106.7010)
+        points = [{"lat": 10.77, "lon": 106.70}] * 3
+
+        response = self._post({"points": points, "k": 2, "stream": True})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(x) for x in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]["count"], 3)
+        self.assertEqual([x["index"] for x in lines[1:]], [0, 1, 2])
+        self.assertEqual(lines[1]["stores"][0]["id"], store.id)
+
+    def test_requires_points(self):
+        self.assertEqual(self._post({"points": []}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL).status_code, 405)
+        self.assertEqual(self._post({"points": [{"lat": 10.77, "lon": 106.70}], "max_km": 0}).status_code, 400)
+
+    def test_non_string_address_is_an_invalid_point(self):
+        points = [{"address": 123}, {"address": ["Le Loi"]}, {"address": {"q": "Le Loi"}}, {"lat": 10.77, "lon": 106.70}]
+        data = self._post({"points": points}).json()
+        self.assertEqual([r["geocode"] for r in data["results"][:3]], [{"error": "INVALID_POINT"}] * 3)
+        self.assertIsNone(data["results"][3]["geocode"])
+
+
+def _square(name, south, west, north, east):
+    ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+    return {"type": "Feature", "properties": {"name": name}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+class DistrictPolygonTests(SpatialTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "districts.geojson")
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({"type": "FeatureCollection", "features": [
+                _square("Quận 1", 10.76, 106.69, 10.79, 106.71),
+                _square("Quận 3", 10.76, 106.67, 10.79, 106.69),
+            ]}, fh)
+        override = override_settings(SPATIAL_DISTRICTS_GEOJSON=path)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_point_lookup(self):
+        self.assertEqual(district_index.locate(10.7769, 106.7009), "Quận 1")
+        self.assertEqual(district_index.locate(10.7769, 106.6800), "Quận 3")
+        self.assertIsNone(district_index.locate(10.9000, 106.7000))
+        data = self.client.get("/tools/district-at/", {"lat": 10.7769, "lon": 106.6800}).json()
+        self.assertEqual(data["district"], "Quận 3")
+
+    def test_district_filter_uses_geometry(self):
+        # Mislabelled in text, but the coordinates are inside Quan 1.
+        _make_store(self.circlek, "CK In", 10.7770, 106.7010, quan_huyen="Quan 3")
+        _make_store(self.circlek, "CK Out", 10.7771, 106.6800, quan_huyen="Quan 1")
+
+        for url, params in [
+            ("/tools/stores-in-radius/", {"lat": 10.7769, "lon": 106.7009, "radius_km": 5}),
+            ("/tools/search-stores/", {}),
+        ]:
+            data = self.client.get(url, {**params, "district": "quan 1"}).json()
+            self.assertEqual([s["name"] for s in data["stores"]], ["CK In"])
+
+    def test_assign_districts_command(self):
+        wrong = _make_store(self.circlek, "CK Wrong", 10.7770, 106.7010, quan_huyen="Quan 3")
+        blank = _make_store(self.circlek, "CK Blank", 10.7771, 106.6800, quan_huyen="")
+        ok_store = _make_store(self.circlek, "CK Ok", 10.7772, 106.6801, quan_huyen="Q.3")
+
+        call_command("assign_districts", stdout=io.StringIO())
+        wrong.refresh_from_db()
+        self.assertEqual(wrong.quan_huyen, "Quan 3")
+
+        call_command("assign_districts", "--fix", stdout=io.StringIO())
+        for store, expected in [(wrong, "Quận 1"), (blank, "Quận 3"), (ok_store, "Q.3")]:
+            store.refresh_from_db()
+            self.assertEqual(store.quan_huyen, expected)
+
+
+class GeocodeFanOutTests(SpatialTestCase):
+    QUERY = "236 Le Van Sy, Tan Binh, TP.HCM"
+    HIT = {"display_name": "236 Le Van Sy, Tan Binh, Thanh pho Ho Chi Minh, Viet Nam", "lat": "10.7934", "lon": "106.6789"}
+
+    @patch("modules.spatial.controllers._call_photon_search_safe", return_value=(None, {"status": 503}))
+    @patch("modules.spatial.controllers._call_nominatim_search_safe")
+    def test_stops_once_a_candidate_clears_the_threshold(self, mock_nominatim, mock_photon):
+        mock_nominatim.return_value = ([self.HIT], None)
+
+        payload = controllers._resolve_geocode_payload(self.QUERY)
+        self.assertEqual(payload["provider"], "nominatim")
+        self.assertGreaterEqual(payload["score"], controllers.GEOCODE_MIN_SCORE)
+        # The remaining variants were still waiting on their rate-limit slots.
+        self.assertEqual(mock_nominatim.call_count, 1)
+        self.assertLessEqual(mock_photon.call_count, 1)
+
+    @patch("modules.spatial.controllers._call_photon_search_safe")
+    @patch("modules.spatial.controllers._call_nominatim_search_safe", return_value=(None, {"status": 429}))
+    def test_other_provider_answers_when_one_fails(self, mock_nominatim, mock_photon):
+        mock_photon.return_value = ([self.HIT], None)
+
+        payload = controllers._resolve_geocode_payload(self.QUERY)
+        self.assertEqual(payload["provider"], "photon")
+
+
+class GeocodeStoreTests(SpatialTestCase):
+    HIT = GeocodeFanOutTests.HIT
+
+    @patch("modules.spatial.controllers._call_photon_search_safe", return_value=([], None))
+    @patch("modules.spatial.controllers._call_nominatim_search_safe")
+    def test_results_survive_a_cache_flush(self, mock_nominatim, mock_photon):
+        mock_nominatim.return_value = ([self.HIT], None)
+        first = controllers._resolve_geocode_payload("236 Le Van Sy, Tan Binh, TP.HCM")
+        self.assertIsNotNone(first["location"])
+
+        cache.clear()
+        mock_nominatim.reset_mock()
+        # Different spelling, same normalized key.
+        again = controllers._resolve_geocode_payload("236  LE VAN SY,  Tan Binh, TP.HCM")
+        self.assertEqual(again["location"], first["location"])
+        mock_nominatim.assert_not_called()
+
+        row = GeocodeCache.objects.get(kind="geocode")
+        self.assertEqual(row.provider, "nominatim")
+        self.assertEqual(row.hits, 1)
+
+    @patch("modules.spatial.controllers._call_nominatim_reverse_safe")
+    def test_reverse_reads_through_the_store(self, mock_reverse):
+        mock_reverse.return_value = ({"display_name": "Ben Thanh"}, None)
+        self.client.get("/tools/reverse-geo/", {"lat": 10.7725, "lon": 106.6980})
+        cache.clear()
+        data = self.client.get("/tools/reverse-geo/", {"lat": 10.7725, "lon": 106.6980}).json()
+        self.assertEqual(data["display"], "Ben Thanh")
+        self.assertEqual(mock_reverse.call_count, 1)
+
+    def test_prefetch_and_expiry(self):
+        geocode_store.put("geocode", "a", {"location": None})
+        geocode_store.put("geocode", "b", {"location": None}, ttl=-1)
+        self.assertEqual(geocode_store.prefetch("geocode", ["a", "b", "c"]), {"a": {"location": None}})
+        self.assertEqual(geocode_store.purge_expired(), 1)
+
+
+class LocalGeocoderTests(SpatialTestCase):
+    def setUp(self):
+        super().setUp()
+        _make_store(self.circlek, "CK Le Van Sy", 10.7934, 106.6789, quan_huyen="Tân Bình", dia_chi="236 Lê Văn Sỹ, Phường 1")
+
+    @patch("modules.spatial.controllers._call_photon_search_safe")
+    @patch("modules.spatial.controllers._call_nominatim_search_safe")
+    def test_store_address_is_answered_locally(self, mock_nominatim, mock_photon):
+        payload = controllers._resolve_geocode_payload("236 Le Van Sy, Tan Binh, TP.HCM")
+        self.assertEqual(payload["provider"], "local")
+        self.assertEqual(payload["precision"], "address")
+        self.assertEqual(payload["location"]["lat"], 10.7934)
+        mock_nominatim.assert_not_called()
+        mock_photon.assert_not_called()
+
+    def test_other_house_number_is_not_confident(self):
+        self.assertIsNone(local_geocoder.geocode("100 Le Van Sy, Tan Binh"))
+        # The number of an alley, not at the start of the query.
+        self.assertIsNone(local_geocoder.geocode("Hem 100 Le Van Sy, Tan Binh"))
+        self.assertIsNone(local_geocoder.geocode("Le Van Sy, Tan Binh"))
+        self.assertEqual(local_geocoder.geocode("Số 236 Lê Văn Sỹ, Tân Bình")["lat"], 10.7934)
+
+    def test_other_district_or_ward_is_rejected(self):
+        self.assertIsNone(local_geocoder.geocode("236 Le Van Sy, Quan 3"))
+        self.assertIsNone(local_geocoder.geocode("236 Le Van Sy, Q.3, TP.HCM"))
+        self.assertIsNone(local_geocoder.geocode("236 Le Van Sy, Phuong 13, Tan Binh"))
+        self.assertIsNotNone(local_geocoder.geocode("236 Le Van Sy, P.1, Quan Tan Binh"))
+
+    def test_zero_padded_district_matches(self):
+        _make_store(self.gs25, "GS Q3", 10.7820, 106.6870, quan_huyen="Quận 03", dia_chi="12 Tran Quoc Thao")
+        self.assertIsNotNone(local_geocoder.geocode("12 Tran Quoc Thao, Quan 3"))
+        self.assertIsNone(local_geocoder.geocode("12 Tran Quoc Thao, Quan 1"))
+
+    def test_gazetteer_streets(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8") as fh:
+            fh.write("name,ward,district,lat,lon\nĐường Nguyễn Huệ,Bến Nghé,Quận 1,10.7740,106.7038\n")
+        self.addCleanup(os.remove, fh.name)
+        with override_settings(SPATIAL_GAZETTEER_PATH=fh.name):
+            hit = local_geocoder.geocode("nguyen hue, ben nghe")
+        self.assertEqual(hit["source"], "gazetteer")
+        self.assertEqual((hit["lat"], hit["lon"]), (10.7740, 106.7038))
+
+
+class ProviderCircuitTests(SpatialTestCase):
+    def setUp(self):
+        super().setUp()
+        circuit.reset()
+        self.addCleanup(circuit.reset)
+
+    @patch("modules.spatial.services.http_pool.get", side_effect=ConnectionError("timeout"))
+    def test_open_circuit_skips_the_provider(self, mock_get):
+        for _ in range(circuit.CONSECUTIVE_FAILURES_OPEN):
+            controllers._call_photon_search_safe("x", throttle=False)
+        self.assertEqual(circuit.breaker("photon").state, circuit.OPEN)
+
+        mock_get.reset_mock()
+        arr, err = controllers._call_photon_search_safe("x")
+        self.assertEqual(err["error"], "CIRCUIT_OPEN")
+        mock_get.assert_not_called()
+        data = self.client.get("/tools/providers/").json()
+        self.assertEqual(data["providers"]["photon"]["state"], "open")
+
+    @patch("modules.spatial.controllers._call_photon_search_safe")
+    def test_suggest_from_photon_is_stored_as_photon(self, mock_photon):
+        mock_photon.return_value = ([{"display_name": "12 Nguyen Hue", "lat": "10.77", "lon": "106.70"}], None)
+        for _ in range(circuit.CONSECUTIVE_FAILURES_OPEN):
+            circuit.breaker("nominatim").record(False, 1.0)
+
+        self.client.get("/tools/suggest/", {"q": "12 Nguyen Hue"})
+        row = GeocodeCache.objects.get(kind="suggest")
+        self.assertEqual(row.provider, "photon")
+
+    @patch("modules.spatial.controllers._call_photon_search_safe")
+    @patch("modules.spatial.controllers._call_nominatim_search_safe")
+    def test_suggest_stays_on_nominatim_while_its_circuit_is_closed(self, mock_nominatim, mock_photon):
+        mock_nominatim.return_value = ([{"display_name": "12 Nguyen Hue", "lat": "10.77", "lon": "106.70"}], None)
+        # Nominatim is slower and has failed once; Photon has no calls at all.
+        circuit.breaker("nominatim").record(False, 2.0)
+        circuit.breaker("nominatim").record(True, 1.5)
+        self.assertEqual(circuit.ordered(("nominatim", "photon"))[0], "photon")
+
+        data = self.client.get("/tools/suggest/", {"q": "12 Nguyen Hue"}).json()
+        self.assertEqual(data["items"][0]["display"], "12 Nguyen Hue")
+        mock_nominatim.assert_called()
+        mock_photon.assert_not_called()
+
+
+class GeocodeBulkCommandTests(SpatialTestCase):
+    def _fake_geocode(self, q):
+        if "nowhere" in q:
+            return {"q": q, "location": None, "provider": None, "score": 0.0, "error": {"status": 404}}
+        return {"q": q, "provider": "nominatim", "score": 0.9, "location": {"lat": 10.77, "lon": 106.70, "display": q}}
+
+    def test_resume_from_checkpoint(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        src = os.path.join(tmp.name, "stores.json")
+        out = os.path.join(tmp.name, "stores.csv")
+        with open(src, "w", encoding="utf-8") as fh:
+            json.dump(["1 Le Loi, Quan 1", {"address": "nowhere at all", "ten": "X"}, "3 Le Loi", "4 Le Loi"], fh)
+
+        with patch("modules.spatial.controllers._resolve_geocode_payload", side_effect=self._fake_geocode) as mock:
+            call_command("geocode_bulk", src, "--output", out, "--batch-size", "2", "--limit", "2", stdout=io.StringIO())
+            self.assertTrue(os.path.exists(out + ".checkpoint"))
+            call_command("geocode_bulk", src, "--output", out, "--batch-size", "2", stdout=io.StringIO())
+        self.assertEqual(mock.call_count, 4)
+        self.assertFalse(os.path.exists(out + ".checkpoint"))
+
+        with open(out, encoding="utf-8") as fh:
+            rows = list(csv.DictReader(fh))
+        self.assertEqual([r["index"] for r in rows], ["0", "1", "2", "3"])
+        self.assertEqual(rows[0]["confidence"], "high")
+        self.assertEqual(rows[1]["confidence"], "none")
+        self.assertEqual(rows[1]["ten"], "X")
+        self.assertEqual(rows[3]["lat"], "10.77")
+
+
+class ProximityReverseTests(SpatialTestCase):
+    URL = "/tools/reverse-geo/"
+
+    @patch("modules.spatial.controllers._call_nominatim_reverse_safe")
+    def test_nearby_click_reuses_the_resolved_point(self, mock_reverse):
+        mock_reverse.return_value = ({"display_name": "Cho Ben Thanh"}, None)
+        self.client.get(self.URL, {"lat": 10.77250, "lon": 106.69800})
+        # ~30 m away, in another geohash cell.
+        data = self.client.get(self.URL, {"lat": 10.77277, "lon": 106.69800}).json()
+        self.assertEqual(data["display"], "Cho Ben Thanh")
+        self.assertEqual(mock_reverse.call_count, 1)
+
+        self.client.get(self.URL, {"lat": 10.78000, "lon": 106.69800})
+        self.assertEqual(mock_reverse.call_count, 2)
+
+    @patch("modules.spatial.controllers._call_nominatim_reverse_safe", return_value=(None, {"error": "CIRCUIT_OPEN"}))
+    def test_falls_back_to_the_nearest_store(self, _reverse):
+        store = _make_store(self.circlek, "CK Ben Thanh", 10.7726, 106.6982, quan_huyen="Quan 1")
+        data = self.client.get(self.URL, {"lat": 10.7725, "lon": 106.6980}).json()
+        self.assertTrue(data["approximate"])
+        self.assertEqual(data["raw"]["store_id"], store.id)
+        self.assertIn("CK Ben Thanh", data["display"])
+
+        data = self.client.get(self.URL, {"lat": 10.9500, "lon": 106.9000}).json()
+        self.assertEqual(data["message"], "NO_RESULT")
+
+
+class ReverseIndexTests(SpatialTestCase):
+    A = (10.77250, 106.69800)
+    B = (10.78000, 106.69800)
+
+    def _put(self, point, display):
+        cell = geohash.encode(*point, controllers.REVERSE_GEOHASH_PRECISION)
+        geocode_store.put("reverse", cell, {"display_name": display})
+        return cell
+
+    def test_refresh_reads_only_new_rows(self):
+        self._put(self.A, "A")
+        self.assertEqual(reverse_index.nearest(*self.A, 0.05)[0]["display_name"], "A")
+
+        # Rows written before the overlap window are not read again.
+        GeocodeCache.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        self._put(self.B, "B")
+        loaded = []
+        entries = geocode_store.entries
+
+        def spy(kind, since=None):
+            rows = entries(kind, since=since)
+            loaded.extend(payload["display_name"] for _, payload, _ in rows)
+            return rows
+
+        with patch("modules.spatial.services.reverse_index.SNAPSHOT_MAX_AGE_SEC", -1), \
+                patch("modules.spatial.services.geocode_store.entries", side_effect=spy):
+            self.assertEqual(reverse_index.nearest(*self.B, 0.05)[0]["display_name"], "B")
+        self.assertEqual(loaded, ["B"])
+        self.assertEqual(reverse_index.nearest(*self.A, 0.05)[0]["display_name"], "A")
+
+    @patch("modules.spatial.services.reverse_index.MAX_POINTS", 2)
+    def test_full_index_evicts_the_oldest_point(self):
+        reverse_index.nearest(*self.A, 0.05)
+        for point, display in [(self.A, "A"), ((10.7760, 106.6980), "M"), (self.B, "B")]:
+            reverse_index.add(geohash.encode(*point, controllers.REVERSE_GEOHASH_PRECISION), {"display_name": display})
+        self.assertIsNone(reverse_index.nearest(*self.A, 0.05))
+        self.assertEqual(reverse_index.nearest(*self.B, 0.05)[0]["display_name"], "B")
+
+
+class RoadMatrixTests(SpatialTestCase):
+    URL = "/tools/road-matrix/"
+
+    def setUp(self):
+        super().setUp()
+        self.a = _make_store(self.circlek, "CK A", 10.7730, 106.7000)
+        self.b = _make_store(self.gs25, "GS A", 10.7800, 106.7050)
+
+    @patch("modules.spatial.controllers._one_to_many_table")
+    def test_one_table_call_then_cached_pairs(self, mock_table):
+        mock_table.return_value = ([(850.0, 120.0), (2100.0, 300.0)], None)
+        ids = f"{self.a.id},{self.b.id},999999"
+        data = self.client.get(self.URL, {"from": "10.7769,106.7009", "ids": ids}).json()
+        self.assertEqual(
+            data["items"],
+            [
+                {"id": self.a.id, "distance_m": 850.0, "duration_s": 120.0},
+                {"id": self.b.id, "distance_m": 2100.0, "duration_s": 300.0},
+            ],
+        )
+        self.assertEqual(data["missing"], [999999])
+        # Measured from the origin cell's centre, which every origin in the cell shares.
+        profile, origin, dests = mock_table.call_args.args
+        cell, centre = controllers._snap_origin(10.7769, 106.7009, controllers.ROAD_MATRIX_GEOHASH_PRECISION)
+        self.assertEqual((profile, origin), ("driving", centre))
+        self.assertEqual(geohash.encode(*origin, controllers.ROAD_MATRIX_GEOHASH_PRECISION), cell)
+        self.assertEqual(dests, [(10.7730, 106.7000), (10.7800, 106.7050)])
+
+        # A few metres away, same origin cell: answered from the pair cache.
+        mock_table.reset_mock()
+        data = self.client.get(self.URL, {"from": "10.77685,106.70085", "ids": f"{self.b.id},{self.a.id}"}).json()
+        self.assertEqual([x["id"] for x in data["items"]], [self.b.id, self.a.id])
+        mock_table.assert_not_called()
+
+    @patch("modules.spatial.controllers._one_to_many_table", return_value=(None, {"message": "OSRM error", "status": 503}))
+    def test_upstream_failure_without_cached_pairs(self, _table):
+        response = self.client.get(self.URL, {"from": "10.7769,106.7009", "ids": str(self.a.id)})
+        self.assertEqual(response.status_code, 503)
+
+    def test_requires_origin_and_ids(self):
+        self.assertEqual(self.client.get(self.URL, {"from": "10.7769,106.7009"}).status_code, 400)
+        ids = ",".join(str(i) for i in range(controllers.ROAD_MATRIX_MAX_STORES + 1))
+        self.assertEqual(self.client.get(self.URL, {"from": "10.7769,106.7009", "ids": ids}).status_code, 400)
+
+
+class _OsrmResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class RouteModeTests(SpatialTestCase):
+    URL = "/tools/route-osrm/"
+    LINE = [[106.7009 + i * 1e-4, 10.7769 + (i % 2) * 1e-6] for i in range(40)]
+
+    def setUp(self):
+        super().setUp()
+        circuit.reset()
+        self.addCleanup(circuit.reset)
+
+    def _osrm(self, geometry):
+        step = {"name": "Le Loi", "distance": 400.0, "duration": 60.0, "maneuver": {"type": "turn"}, "intersections": [{}]}
+        route = {
+            "distance": 420.0, "duration": 63.0, "weight": 63.0, "geometry": geometry,
+            "legs": [{"distance": 420.0, "duration": 63.0, "summary": "Le Loi", "steps": [step]}],
+        }
+        return _OsrmResponse({"code": "Ok", "routes": [route]})
+
+    def _get(self, **params):
+        return self.client.get(self.URL, {"from": "10.7769,106.7009", "to": "10.7800,106.7050", **params}).json()
+
+    @patch("modules.spatial.services.http_pool.get")
+    def test_summary_mode(self, mock_get):
+        mock_get.return_value = self._osrm(None)
+        data = self._get(mode="summary")
+        self.assertEqual(data["routes"], [{"distance": 420.0, "duration": 63.0}])
+        self.assertEqual(mock_get.call_args.kwargs["params"]["overview"], "false")
+        self.assertEqual(mock_get.call_args.kwargs["params"]["steps"], "false")
+
+    @patch("modules.spatial.services.http_pool.get")
+    def test_simplified_mode_with_step_fields(self, mock_get):
+        mock_get.return_value = self._osrm({"type": "LineString", "coordinates": self.LINE})
+        data = self._get(mode="simplified", zoom=14, fields="name,maneuver")
+        route = data["routes"][0]
+        self.assertEqual(route["geometry"]["coordinates"], [self.LINE[0], self.LINE[-1]])
+        self.assertEqual(route["legs"][0]["steps"], [{"name": "Le Loi", "maneuver": {"type": "turn"}}])
+        self.assertEqual(mock_get.call_args.kwargs["params"]["steps"], "true")
+
+        # Each mode/zoom/fields combination has its own cache entry.
+        self.assertEqual(self._get(mode="simplified", zoom=14, fields="maneuver,name")["message"], "OK (cache)")
+        self.assertEqual(self._get(mode="simplified", zoom=18, fields="name,maneuver")["message"], "OK")
+
+    @patch("modules.spatial.services.http_pool.get")
+    def test_polyline_and_full_modes(self, mock_get):
+        mock_get.return_value = self._osrm("_p~iF~ps|U")
+        route = self._get(mode="polyline")["routes"][0]
+        self.assertEqual(route, {"distance": 420.0, "duration": 63.0, "geometry": "_p~iF~ps|U"})
+        self.assertEqual(mock_get.call_args.kwargs["params"]["geometries"], "polyline")
+
+        mock_get.return_value = self._osrm({"type": "LineString", "coordinates": self.LINE})
+        route = self._get()["routes"][0]
+        self.assertEqual(len(route["geometry"]["coordinates"]), len(self.LINE))
+        self.assertIn("intersections", route["legs"][0]["steps"][0])
+
+
+class StoreRouteCacheTests(SpatialTestCase):
+    URL = "/tools/route-osrm/"
+
+    def setUp(self):
+        super().setUp()
+        circuit.reset()
+        self.addCleanup(circuit.reset)
+        self.store = _make_store(self.circlek, "CK A", 10.7800, 106.7050)
+        patcher = patch("modules.spatial.services.http_pool.get")
+        self.mock_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_get.return_value = _OsrmResponse({"code": "Ok", "routes": [{"distance": 900.0, "duration": 120.0}]})
+
+    def _get(self, origin, **params):
+        return self.client.get(self.URL, {"from": origin, "store": self.store.id, "mode": "summary", **params})
+
+    def test_nearby_origins_share_the_persisted_route(self):
+        data = self._get("10.77690,106.70090").json()
+        self.assertEqual(data["routes"], [{"distance": 900.0, "duration": 120.0}])
+        row = RouteCache.objects.get()
+        self.assertEqual((row.cua_hang_id, row.distance_m, row.duration_s), (self.store.id, 900.0, 120.0))
+        # Routed from the centre of the origin cell, not the raw point.
+        cell, (lat, lon) = controllers._snap_origin(10.7769, 106.7009)
+        self.assertEqual(row.origin_cell, cell)
+        self.assertIn(f"{lon},{lat};", self.mock_get.call_args.args[0])
+
+        cache.clear()  # as seen from another worker
+        data = self._get("10.77700,106.70100").json()
+        self.assertEqual(data["routes"][0]["distance"], 900.0)
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.assertEqual(RouteCache.objects.get().hits, 1)
+
+    def test_unknown_store(self):
+        self.assertEqual(self.client.get(self.URL, {"from": "10.7769,106.7009", "store": 999999}).status_code, 404)
+
+    def test_moving_a_store_drops_its_routes(self):
+        self._get("10.7769,106.7009")
+        self.store.vi_do = 10.7900
+        self.store.save()
+        self.assertFalse(RouteCache.objects.exists())
+
+    def test_evicts_least_recently_used(self):
+        self._get("10.7769,106.7009")
+        self._get("10.8000,106.6500")
+        RouteCache.objects.filter(origin_cell=controllers._snap_origin(10.7769, 106.7009)[0]).update(
+            last_hit_at=timezone.now() - timedelta(days=1),
+        )
+        self.assertEqual(route_store.evict(limit=1), 1)
+        self.assertEqual(RouteCache.objects.get().origin_cell, controllers._snap_origin(10.8, 106.65)[0])
+
+    def test_precompute_popular_cells(self):
+        self._get("10.7769,106.7009")
+        other = _make_store(self.gs25, "GS A", 10.7770, 106.7010)
+        call_command("precompute_routes", "--mode", "summary", "--alternatives", "1", "--stores", "2", stdout=io.StringIO())
+        cell = controllers._snap_origin(10.7769, 106.7009)[0]
+        self.assertEqual(
+            set(RouteCache.objects.filter(origin_cell=cell).values_list("cua_hang_id", flat=True)),
+            {self.store.id, other.id},
+        )
+        self.assertEqual(self.mock_get.call_count, 2)
+
+
+class LocalRoutingTests(SpatialTestCase):
+    URL = "/tools/route-osrm/"
+    PARAMS = {"from": "10.7700,106.6900", "to": "10.7780,106.6980", "mode": "summary"}
+
+    def setUp(self):
+        super().setUp()
+        circuit.reset()
+        self.addCleanup(circuit.reset)
+        fd, path = tempfile.mkstemp(suffix=".geojson")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(grid_roads(), fh)
+        self.addCleanup(os.remove, path)
+        settings = override_settings(SPATIAL_ROAD_GRAPH_PATH=path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        local_router.invalidate()
+        local_router.graph("driving", wait=True)
+
+    @patch("modules.spatial.services.http_pool.get", side_effect=ConnectionError("timeout"))
+    def test_falls_back_to_the_local_router(self, mock_get):
+        data = self.client.get(self.URL, self.PARAMS).json()
+        self.assertEqual(data["engine"], "local")
+        self.assertGreater(data["routes"][0]["distance"], 0)
+        mock_get.assert_called_once()
+
+    @override_settings(SPATIAL_ROUTING_ENGINE="local")
+    @patch("modules.spatial.services.http_pool.get")
+    def test_local_engine_skips_osrm(self, mock_get):
+        data = self.client.get(self.URL, self.PARAMS).json()
+        self.assertEqual(data["engine"], "local")
+        mock_get.assert_not_called()
+
+    @patch("modules.spatial.services.http_pool.get", side_effect=ConnectionError("timeout"))
+    def test_road_matrix_falls_back_to_the_local_router(self, mock_get):
+        store = _make_store(self.circlek, "CK Grid", 10.7760, 106.6960)
+        data = self.client.get("/tools/road-matrix/", {"from": "10.7700,106.6900", "ids": str(store.id)}).json()
+        self.assertGreater(data["items"][0]["distance_m"], 0)
+        mock_get.assert_called_once()
+
+    @override_settings(SPATIAL_ROUTING_ENGINE="osrm")
+    @patch("modules.spatial.services.http_pool.get", side_effect=ConnectionError("timeout"))
+    def test_osrm_engine_has_no_fallback(self, _get):
+        self.assertEqual(self.client.get(self.URL, self.PARAMS).status_code, 502)
+
+
+class OptimizeVisitsTests(SpatialTestCase):
+    URL = "/tools/optimize-visits/"
+
+    def setUp(self):
+        super().setUp()
+        # Stores east of the start along one street, created out of order.
+        self.far = _make_store(self.circlek, "CK far", 10.7769, 106.7300)
+        self.near = _make_store(self.gs25, "GS near", 10.7769, 106.7100)
+        self.mid = _make_store(self.circlek, "CK mid", 10.7769, 106.7200)
+
+    @staticmethod
+    def _table(profile, points):
+        lons = [lon for _, lon in points]
+        durations = [[abs(a - b) * 10000 for b in lons] for a in lons]
+        distances = [[abs(a - b) * 100000 for b in lons] for a in lons]
+        return {"code": "Ok", "durations": durations, "distances": distances}, None
+
+    def test_orders_stops_and_caches_the_matrix(self):
+        ids = f"{self.far.id},{self.near.id},{self.mid.id},999999"
+        with patch("modules.spatial.controllers._table_data", side_effect=self._table) as mock_table:
+            data = self.client.get(self.URL, {"start": "10.7769,106.7009", "ids": ids}).json()
+            self.assertEqual([s["id"] for s in data["stops"]], [self.near.id, self.mid.id, self.far.id])
+            self.assertEqual([s["order"] for s in data["stops"]], [1, 2, 3])
+            self.assertEqual(data["legs"][0]["from_id"], None)
+            self.assertEqual(data["legs"][-1]["to_id"], self.far.id)
+            self.assertAlmostEqual(data["total_duration_s"], 291.0, places=1)
+            self.assertEqual(data["missing"], [999999])
+
+            data = self.client.get(self.URL, {"start": "10.7769,106.7009", "ids": ids, "return": "1"}).json()
+            self.assertEqual(data["legs"][-1]["to_id"], None)
+            self.assertAlmostEqual(data["total_duration_s"], 582.0, places=1)
+
+            # Same stops in another order: one matrix entry, remapped.
+            ids = f"{self.mid.id},{self.far.id},{self.near.id}"
+            data = self.client.get(self.URL, {"start": "10.7769,106.7009", "ids": ids}).json()
+            self.assertEqual([s["id"] for s in data["stops"]], [self.near.id, self.mid.id, self.far.id])
+            for leg, metres in zip(data["legs"], [910.0, 1000.0, 1000.0]):
+                self.assertAlmostEqual(leg["distance_m"], metres, places=3)
+        mock_table.assert_called_once()
+
+    @patch("modules.spatial.controllers._table_data", return_value=(None, {"message": "OSRM error", "status": 503}))
+    def test_errors(self, _table):
+        self.assertEqual(self.client.get(self.URL, {"start": "10.7769,106.7009"}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {"start": "10.7769,106.7009", "ids": "999999"}).status_code, 404)
+        response = self.client.get(self.URL, {"start": "10.7769,106.7009", "ids": str(self.near.id)})
+        self.assertEqual(response.status_code, 503)
+
+
+class StaleWhileRevalidateTests(SpatialTestCase):
+    def _wait_for(self, predicate, timeout=2.0):
+        deadline = time_module.monotonic() + timeout
+        while not predicate() and time_module.monotonic() < deadline:
+            time_module.sleep(0.01)
+        return predicate()
+
+    def test_expired_entry_is_served_and_refreshed(self):
+        q = "12 Nguyen Hue"
+        key = controllers._cache_key("geocode", {"q": q.lower()})
+        old = {"q": q, "provider": "nominatim", "location": {"lat": 1.0, "lon": 2.0, "display": "old"}}
+        new = {"q": q, "provider": "photon", "location": {"lat": 10.77, "lon": 106.70, "display": "new"}}
+        controllers._cache_set(key, old, seconds=-1, stale_ok=True)
+
+        with patch("modules.spatial.controllers._resolve_geocode_payload", return_value=new) as mock:
+            data = self.client.get("/tools/geocode/", {"q": q}).json()
+            self.assertEqual(data["message"], "OK (cache)")
+            self.assertEqual(data["location"]["display"], "old")
+            self.assertTrue(self._wait_for(lambda: controllers._cache_get(key) == new))
+        mock.assert_called_once_with(q)
+
+    def test_failed_refresh_keeps_the_stale_entry(self):
+        q = "12 Nguyen Hue"
+        key = controllers._cache_key("geocode", {"q": q.lower()})
+        old = {"q": q, "provider": "nominatim", "location": {"lat": 1.0, "lon": 2.0, "display": "old"}}
+        controllers._cache_set(key, old, seconds=-1, stale_ok=True)
+
+        with patch("modules.spatial.controllers._resolve_geocode_payload", return_value={"q": q, "location": None}) as mock:
+            self.client.get("/tools/geocode/", {"q": q})
+            self.assertTrue(self._wait_for(lambda: mock.called and not controllers._refreshing))
+            data = self.client.get("/tools/geocode/", {"q": q}).json()
+            # The second hit schedules another refresh; let it finish under the patch.
+            self.assertTrue(self._wait_for(lambda: mock.call_count == 2 and not controllers._refreshing))
+        self.assertEqual(data["location"]["display"], "old")
+
+    def test_entries_are_dropped_past_the_staleness_bound(self):
+        controllers._cache_set("k", {"v": 1}, seconds=-controllers.CACHE_STALE_MAX_SEC - 1, stale_ok=True)
+        self.assertIsNone(controllers._cache_get("k", refresh=lambda: None))
+
+    def test_plain_entries_are_not_kept_stale(self):
+        controllers._cache_set("k", {"v": 1}, seconds=-1)
+        self.assertIsNone(cache.get("k"))
+        self.assertIsNone(controllers._cache_get("k", refresh=lambda: None))
+
+    def test_failed_refresh_is_logged(self):
+        controllers._cache_set("k", {"v": 1}, seconds=-1, stale_ok=True)
+        with self.assertLogs("modules.spatial.controllers", level="ERROR") as logs:
+            controllers._cache_get("k", refresh=lambda: 1 / 0)
+            self.assertTrue(self._wait_for(lambda: not controllers._refreshing))
+        self.assertIn("Background refresh of k failed", logs.output[0])
@@ -0,0 +1,18 @@
+from django.test import SimpleTestCase
+
+from modules.spatial.utils.geo import haversine_km, haversine_km_many, top_k
+
+
+class DistanceKernelTests(SimpleTestCase):
+    lats = [10.7770, 10.8000, 10.7769, 10.9000]
+    lons = [106.7010, 106.7050, 106.7009, 106.6000]
+
+    def test_batched_matches_scalar(self):
+        dist = haversine_km_many(10.7769, 106.7009, self.lats, self.lons)
+        for d, lat, lon in zip(dist, self.lats, self.lons):
+            self.assertAlmostEqual(d, haversine_km(10.7769, 106.7009, lat, lon), places=9)
+
+    def test_many_origins_shape_and_top_k(self):
+        dist = haversine_km_many([10.7769, 10.9000], [106.7009, 106.6000], self.lats, self.lons)
+        self.assertEqual(dist.shape, (2, 4))
+        self.assertEqual(top_k(dist, 2).tolist(), [[2, 0], [3, 1]])
@@ -0,0 +1,68 @@
+from unittest.mock import Mock, patch
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from modules.spatial.services import http_pool
+
+
+class HttpPoolTests(SimpleTestCase):
+    def setUp(self):
+        http_pool.close_all()
+        self.addCleanup(http_pool.close_all)
+
+    def test_one_session_per_host(self):
+        a = http_pool.session_for("https://nominatim.openstreetmap.org/search")
+        b = http_pool.session_for("https://nominatim.openstreetmap.org/reverse")
+        c = http_pool.session_for("https://photon.komoot.io/api/")
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+
+    @override_settings(SPATIAL_HTTP_POOL_SIZE=4)
+    def test_adapter_uses_configured_pool_without_its_own_retries(self):
+        adapter = http_pool.session_for("https://router.project-osrm.org/route").get_adapter("https://router.project-osrm.org/")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 0)
+
+
+@override_settings(SPATIAL_HTTP_RETRIES=2, SPATIAL_HTTP_BACKOFF=0.0)
+class HttpRetryTests(SimpleTestCase):
+    URL = "https://router.project-osrm.org/route"
+
+    def _get(self, answers, acquire=None):
+        session = Mock()
+        session.get.side_effect = answers
+        with patch.object(http_pool, "session_for", return_value=session):
+            return http_pool.get(self.URL, timeout=12, acquire=acquire), session.get
+
+    def test_retries_take_a_token_each(self):
+        acquire = Mock(return_value=True)
+        r, get = self._get([requests.ConnectionError(), _Response(502), _Response(200)], acquire)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(acquire.call_count, 2)
+
+    def test_no_token_means_no_retry(self):
+        r, get = self._get([_Response(504), _Response(200)], Mock(return_value=False))
+        self.assertEqual(r.status_code, 504)
+        self.assertEqual(get.call_count, 1)
+        with self.assertRaises(requests.ConnectionError):
+            self._get([requests.ConnectionError()], Mock(return_value=False))
+
+    def test_throttling_answers_are_not_retried(self):
+        for status in (429, 503):
+            r, get = self._get([_Response(status), _Response(200)])
+            self.assertEqual(r.status_code, status)
+            self.assertEqual(get.call_count, 1)
+
+    @override_settings(SPATIAL_HTTP_DEADLINE=5.0, SPATIAL_HTTP_BACKOFF=6.0)
+    def test_no_retry_past_the_deadline(self):
+        r, get = self._get([_Response(502), _Response(200)])
+        self.assertEqual(r.status_code, 502)
+        self.assertEqual(get.call_count, 1)
+        self.assertLessEqual(get.call_args.kwargs["timeout"], 5.0)
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
@@ -0,0 +1,22 @@
+from django.test import SimpleTestCase
+
+from modules.spatial.utils.polyline import decode, encode, simplify, tolerance_for_zoom
+
+
+class PolylineTests(SimpleTestCase):
+    def test_encode_matches_reference(self):
+        # Example from the Google polyline algorithm documentation.
+        coords = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        self.assertEqual(encode(coords), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decode(encode(coords)), coords)
+
+    def test_simplify_drops_collinear_points_and_keeps_corners(self):
+        line = [[106.70, 10.77], [106.701, 10.77], [106.702, 10.77], [106.702, 10.771], [106.702, 10.772]]
+        self.assertEqual(simplify(line, 1e-6), [[106.70, 10.77], [106.702, 10.77], [106.702, 10.772]])
+
+    def test_coarser_zoom_keeps_fewer_points(self):
+        line = [[106.70 + i * 1e-4, 10.77 + (i % 2) * 2e-5] for i in range(50)]
+        fine = simplify(line, tolerance_for_zoom(20))
+        coarse = simplify(line, tolerance_for_zoom(12))
+        self.assertLess(len(coarse), len(fine))
+        self.assertEqual(coarse, [line[0], line[-1]])
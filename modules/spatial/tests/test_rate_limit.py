@@ -0,0 +1,45 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from modules.spatial.services import rate_limit
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "ratelimit.sqlite3")
+        override = override_settings(
+            SPATIAL_RATE_LIMIT_DB=self.path,
+            SPATIAL_RATE_LIMIT_REDIS_URL="",
+            SPATIAL_RATE_LIMITS={"test": (2.0, 2)},
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        rate_limit.reset_backend()
+        self.addCleanup(rate_limit.reset_backend)
+
+    def test_bucket_is_shared_through_the_file(self):
+        # Two handles on one file stand in for two worker processes.
+        a, b = rate_limit.SQLiteBuckets(self.path), rate_limit.SQLiteBuckets(self.path)
+        self.assertEqual(a.take("p", 2.0, 2, 100.0), 0.0)
+        self.assertEqual(b.take("p", 2.0, 2, 100.0), 0.0)
+        self.assertAlmostEqual(a.take("p", 2.0, 2, 100.0), 0.5)
+        self.assertEqual(b.take("p", 2.0, 2, 100.6), 0.0)
+
+    def test_acquire_gives_up_before_the_deadline(self):
+        self.assertTrue(rate_limit.acquire("test"))
+        self.assertTrue(rate_limit.acquire("test"))
+        self.assertFalse(rate_limit.acquire("test", timeout=0.1))
+        self.assertTrue(rate_limit.acquire("test", timeout=1.0))
+
+    def test_unknown_provider_is_not_limited(self):
+        self.assertEqual(rate_limit.try_acquire("nobody"), 0.0)
+
+    def test_falls_back_to_process_bucket(self):
+        with patch.object(rate_limit.SQLiteBuckets, "take", side_effect=OSError("locked")):
+            with self.assertLogs(rate_limit.logger, "WARNING"):
+                self.assertEqual(rate_limit.try_acquire("test"), 0.0)
@@ -0,0 +1,117 @@
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from modules.spatial.services.routing_service import LocalRouter, _dijkstra
+
+STEP = 0.002  # ~220 m between grid streets
+ORIGIN = (10.770, 106.690)
+
+
+def grid_roads(n=6, oneway_row=None):
+    """GeoJSON of an n x n street grid; row ``oneway_row`` is one-way eastbound."""
+    lat0, lon0 = ORIGIN
+    features = []
+    for i in range(n):
+        row = [[lon0 + j * STEP, lat0 + i * STEP] for j in range(n)]
+        props = {"highway": "primary" if i == 2 else "residential", "name": f"Hang {i}"}
+        if i == oneway_row:
+            props["oneway"] = "yes"
+        features.append({"type": "Feature", "geometry": {"type": "LineString", "coordinates": row}, "properties": props})
+        col = [[lon0 + i * STEP, lat0 + j * STEP] for j in range(n)]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": col},
+            "properties": {"tags": {"highway": "residential", "name": f"Cot {i}"}},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class LocalRouterTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".geojson")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self._write(grid_roads(oneway_row=0))
+        self.router = LocalRouter()
+        settings = override_settings(SPATIAL_ROAD_GRAPH_PATH=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for profile in ("driving", "walking"):
+            self.router.graph(profile, wait=True)
+
+    def _write(self, data):
+        with open(self.path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+
+    def _point(self, i, j):
+        return ORIGIN[0] + i * STEP, ORIGIN[1] + j * STEP
+
+    def test_alt_search_matches_dijkstra(self):
+        graph = self.router.graph("driving")
+        self.assertEqual(len(graph.landmarks), 8)
+        self.assertEqual(graph._from.dtype, np.float32)
+        nodes = list(graph.usable)
+        for s in nodes[::5]:
+            exact = _dijkstra(graph.adj, s)
+            for t in nodes[::3]:
+                path = graph.shortest(s, t)
+                self.assertAlmostEqual(sum(p[2] for p in path), exact[t], places=6)
+
+    def test_route_response_has_osrm_shape(self):
+        data = self.router.route("driving", self._point(1, 0), self._point(3, 5), steps=True)
+        self.assertEqual(data["code"], "Ok")
+        route = data["routes"][0]
+        leg = route["legs"][0]
+        self.assertGreater(route["distance"], 0)
+        self.assertEqual(route["duration"], leg["duration"])
+        self.assertEqual(route["geometry"]["coordinates"][0], [ORIGIN[1], ORIGIN[0] + STEP])
+        self.assertEqual(leg["steps"][0]["maneuver"]["type"], "depart")
+        self.assertEqual(leg["steps"][-1]["maneuver"]["type"], "arrive")
+        self.assertAlmostEqual(sum(st["distance"] for st in leg["steps"]), route["distance"], delta=1)
+        # The faster primary street (row 2) carries most of the trip.
+        self.assertIn("Hang 2", leg["summary"])
+
+    def test_one_way_street_applies_to_driving_only(self):
+        west_bound = (self._point(0, 5), self._point(0, 0))
+        driving = self.router.route("driving", *west_bound)["routes"][0]
+        walking = self.router.route("walking", *west_bound)["routes"][0]
+        straight = 5 * STEP * 111.32 * 1000 * math.cos(math.radians(ORIGIN[0]))
+        self.assertAlmostEqual(walking["distance"], straight, delta=5)
+        self.assertGreater(driving["distance"], straight + 400)
+
+    def test_polyline_geometry_and_far_points(self):
+        data = self.router.route("driving", self._point(0, 0), self._point(1, 1), geometries="polyline")
+        self.assertIsInstance(data["routes"][0]["geometry"], str)
+        self.assertEqual(self.router.route("driving", (10.9, 106.9), self._point(0, 0))["code"], "NoSegment")
+
+    def test_table_matches_single_routes(self):
+        points = [self._point(0, 0), self._point(3, 4), self._point(5, 1)]
+        table = self.router.table("driving", points)
+        self.assertEqual(table["code"], "Ok")
+        self.assertEqual(table["durations"][1][1], 0.0)
+        for i, j in [(0, 1), (1, 2), (2, 0)]:
+            route = self.router.route("driving", points[i], points[j])["routes"][0]
+            self.assertAlmostEqual(table["durations"][i][j], route["duration"], delta=0.1)
+            self.assertAlmostEqual(table["distances"][i][j], route["distance"], delta=0.1)
+
+    def test_graph_is_built_in_the_background(self):
+        router = LocalRouter()
+        self.assertIsNone(router.route("cycling", self._point(0, 0), self._point(1, 1)))
+        self.assertIsNotNone(router.graph("cycling", wait=True))
+        self.assertEqual(router.route("cycling", self._point(0, 0), self._point(1, 1))["code"], "Ok")
+
+        # A rewritten file is rebuilt the same way.
+        self._write(grid_roads(n=3))
+        os.utime(self.path, (1, 1))
+        self.assertIsNone(router.graph("cycling"))
+        self.assertEqual(len(router.graph("cycling", wait=True).lats), 9)
+
+    def test_no_file_means_no_answer(self):
+        with override_settings(SPATIAL_ROAD_GRAPH_PATH=self.path + ".missing"):
+            self.assertIsNone(self.router.route("driving", self._point(0, 0), self._point(1, 1)))
+            self.assertFalse(self.router.available())
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from modules.spatial.services import singleflight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _run_concurrently(self, n, target):
+        results, threads = [], []
+        for _ in range(n):
+            t = threading.Thread(target=lambda: results.append(target()))
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_concurrent_callers_share_one_call(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"value": 42}
+
+        results = self._run_concurrently(5, lambda: singleflight.do("k", fetch))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"value": 42}] * 5)
+
+    def test_errors_reach_every_waiter(self):
+        def fail():
+            time.sleep(0.1)
+            raise ValueError("upstream down")
+
+        def call():
+            try:
+                return singleflight.do("err", fail)
+            except ValueError as e:
+                return str(e)
+
+        self.assertEqual(self._run_concurrently(3, call), ["upstream down"] * 3)
+
+    def test_waits_for_a_call_in_another_process(self):
+        # Another worker holds the lock and publishes its result into the cache.
+        cache.add("singleflight:remote", 1, 5)
+        timer = threading.Timer(0.2, lambda: cache.set("remote", {"from": "other worker"}))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        result = singleflight.do("remote", lambda: {"from": "here"}, lookup=lambda: cache.get("remote"))
+        self.assertEqual(result, {"from": "other worker"})
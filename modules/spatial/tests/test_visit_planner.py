@@ -0,0 +1,55 @@
+import itertools
+import random
+import time
+
+from django.test import SimpleTestCase
+
+from modules.spatial.services.visit_planner import plan, tour_cost
+
+
+def _matrix(points, one_way_penalty=1.0):
+    n = len(points)
+    return [
+        [
+            0.0 if i == j else ((points[i][0] - points[j][0]) ** 2 + (points[i][1] - points[j][1]) ** 2) ** 0.5
+            * (one_way_penalty if i < j else 1.0)
+            for j in range(n)
+        ]
+        for i in range(n)
+    ]
+
+
+class VisitPlannerTests(SimpleTestCase):
+    def test_stops_on_a_line_are_visited_in_order(self):
+        points = [(0, 0), (3, 0), (1, 0), (4, 0), (2, 0)]
+        self.assertEqual(plan(_matrix(points)), [2, 4, 1, 3])
+
+    def test_closed_tour_returns_to_start(self):
+        points = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        order = plan(_matrix(points), closed=True)
+        self.assertEqual(tour_cost(_matrix(points), [0, *order, 0]), 4.0)
+
+    def test_close_to_optimal_on_small_asymmetric_instances(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            n = rng.randint(3, 8)
+            closed = rng.random() < 0.5
+            cost = _matrix([(rng.random(), rng.random()) for _ in range(n)], one_way_penalty=1.3)
+            tail = [0] if closed else []
+            order = plan(cost, closed=closed)
+            self.assertEqual(sorted(order), list(range(1, n)))
+            best = min(tour_cost(cost, [0, *p, *tail]) for p in itertools.permutations(range(1, n)))
+            self.assertLessEqual(tour_cost(cost, [0, *order, *tail]), best * 1.15)
+
+    def test_thirty_stops_within_budget(self):
+        rng = random.Random(3)
+        cost = _matrix([(rng.random(), rng.random()) for _ in range(31)])
+        started = time.monotonic()
+        order = plan(cost, budget_sec=0.2)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(sorted(order), list(range(1, 31)))
+
+    def test_unreachable_pairs_are_avoided(self):
+        cost = _matrix([(0, 0), (1, 0), (2, 0)])
+        cost[0][1] = None
+        self.assertEqual(plan(cost), [2, 1])
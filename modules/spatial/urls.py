@@ -4,12 +4,19 @@ from . import controllers
 urlpatterns = [
     path('geocode/', controllers.geocode),
     path('stores-in-bounds/', controllers.stores_in_bounds),
+    path('tiles/<int:z>/<int:x>/<int:y>.pbf', controllers.store_tile),
     path('stores-in-radius/', controllers.stores_in_radius),
+    path('nearest/', controllers.nearest),
+    path('nearest-batch/', controllers.nearest_batch),
     path('smart-search/', controllers.smart_search),
     path('reverse-geo/', controllers.reverse),
     path('suggest/', controllers.suggest),
     path('districts/', controllers.districts),
+    path('district-at/', controllers.district_at),
     path('search-stores/', controllers.search_stores),
     path('route-osrm/', controllers.route_osrm),
+    path('road-matrix/', controllers.road_matrix),
+    path('optimize-visits/', controllers.optimize_visits),
     path('ping/', controllers.ping),
+    path('providers/', controllers.providers),
 ]
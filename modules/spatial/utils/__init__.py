@@ -1,4 +1,4 @@
-﻿from .geo import parse_latlon
+﻿from .geo import haversine_km, haversine_km_many, parse_latlon, top_k
 from .text import strip_accents
 
-__all__ = ['parse_latlon', 'strip_accents']
+__all__ = ['haversine_km', 'haversine_km_many', 'parse_latlon', 'strip_accents', 'top_k']
@@ -1,4 +1,9 @@
-﻿import re
+﻿import math
+import re
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
 
 
 def parse_latlon(text: str):
@@ -12,3 +17,88 @@ def parse_latlon(text: str):
     if -90 <= lat <= 90 and -180 <= lon <= 180:
         return lat, lon
     return None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = (math.sin(dphi / 2) ** 2) + math.cos(phi1) * math.cos(phi2) * (math.sin(dlambda / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bbox_deltas(lat: float, radius_km: float):
+    """Half-width of the lat/lon box that encloses a circle of ``radius_km``."""
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 1e-6))
+    return dlat, dlon
+
+
+MERCATOR_MAX_LAT = 85.05112878
+
+
+def mercator_xy(lat, lon):
+    """Web Mercator position normalized to ``[0, 1)`` (x east, y south), as in XYZ tiles."""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT)
+    lon = np.asarray(lon, dtype=np.float64)
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(np.radians(lat)) + 1.0 / np.cos(np.radians(lat))) / math.pi) / 2.0
+    return x, y
+
+
+def tile_of(lat: float, lon: float, z: int):
+    """XYZ tile (x, y) containing the point at zoom ``z``."""
+    n = 2 ** z
+    x, y = mercator_xy(lat, lon)
+    return min(n - 1, max(0, int(float(x) * n))), min(n - 1, max(0, int(float(y) * n)))
+
+
+def tile_bounds(z: int, x: int, y: int, buffer: float = 0.0):
+    """(south, west, north, east) of an XYZ tile, grown by ``buffer`` tile widths."""
+    n = 2 ** z
+
+    def _lat(ty):
+        ty = min(max(ty, 0.0), float(n))
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    west = (x - buffer) / n * 360.0 - 180.0
+    east = (x + 1 + buffer) / n * 360.0 - 180.0
+    return _lat(y + 1 + buffer), west, _lat(y - buffer), east
+
+
+# ---- batched kernels ----
+def haversine_km_many(lat, lon, lats, lons):
+    """
+    Great-circle distances from one or many origins to arrays of points.
+
+    ``lat``/``lon`` may be scalars (result shape ``(n_points,)``) or 1-D arrays
+    of origins (result shape ``(n_origins, n_points)``).
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lam2 = np.radians(np.asarray(lons, dtype=np.float64))
+    if lat.ndim:
+        lat = lat[:, None]
+        lon = lon[:, None]
+    phi1 = np.radians(lat)
+    lam1 = np.radians(lon)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def top_k(dist, k):
+    """
+    Indices of the ``k`` smallest distances along the last axis, nearest first.
+    Uses ``argpartition`` so only the selected ``k`` are fully sorted.
+    """
+    dist = np.asarray(dist)
+    n = dist.shape[-1]
+    if k <= 0 or n == 0:
+        return np.empty(dist.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        part = np.argpartition(dist, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), dist.shape).copy()
+    order = np.argsort(np.take_along_axis(dist, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
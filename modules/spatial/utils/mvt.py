@@ -0,0 +1,101 @@
+"""Minimal Mapbox Vector Tile (v2) encoder for point layers.
+
+Only what the store layer needs: one or more layers of POINT features with
+string/bool/number attributes, written straight to protobuf wire format so
+no protobuf runtime is required.
+"""
+
+import struct
+
+import numpy as np
+
+from .geo import mercator_xy
+
+EXTENT = 4096
+
+_VARINT = 0
+_LEN = 2
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _key(field: int, wire: int) -> bytes:
+    return _varint((field << 3) | wire)
+
+
+def _len_field(field: int, payload: bytes) -> bytes:
+    return _key(field, _LEN) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values) -> bytes:
+    return _len_field(field, b"".join(_varint(v) for v in values))
+
+
+def _value(v) -> bytes:
+    if isinstance(v, bool):
+        return _key(7, _VARINT) + _varint(int(v))
+    if isinstance(v, int):
+        return _key(6, _VARINT) + _varint(_zigzag(v))
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    return _len_field(1, str(v).encode("utf-8"))
+
+
+def encode_point_layer(name, features, z, x, y, extent=EXTENT, buffer=64):
+    """
+    Encode one layer.
+
+    ``features`` is an iterable of ``(feature_id, lat, lon, properties)``.
+    Points outside the tile plus ``buffer`` pixels are dropped.
+    """
+    features = list(features)
+    keys, key_idx = [], {}
+    values, value_idx = [], {}
+    body = []
+    n = 2 ** z
+    mx, my = mercator_xy([f[1] for f in features], [f[2] for f in features])
+    pxs = np.floor((mx * n - x) * extent + 0.5).astype(np.int64).tolist()
+    pys = np.floor((my * n - y) * extent + 0.5).astype(np.int64).tolist()
+    for (fid, _lat, _lon, props), px, py in zip(features, pxs, pys):
+        if not (-buffer <= px < extent + buffer and -buffer <= py < extent + buffer):
+            continue
+        tags = []
+        for k, v in props.items():
+            if v is None or v == "":
+                continue
+            if k not in key_idx:
+                key_idx[k] = len(keys)
+                keys.append(k)
+            vk = (type(v).__name__, v)
+            if vk not in value_idx:
+                value_idx[vk] = len(values)
+                values.append(v)
+            tags += [key_idx[k], value_idx[vk]]
+        feat = _key(1, _VARINT) + _varint(int(fid))
+        if tags:
+            feat += _packed(2, tags)
+        feat += _key(3, _VARINT) + _varint(1)  # POINT
+        feat += _packed(4, [(1 & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)])  # MoveTo(1)
+        body.append(_len_field(2, feat))
+
+    layer = _key(15, _VARINT) + _varint(2)
+    layer += _len_field(1, name.encode("utf-8"))
+    layer += b"".join(body)
+    layer += b"".join(_len_field(3, k.encode("utf-8")) for k in keys)
+    layer += b"".join(_len_field(4, _value(v)) for v in values)
+    layer += _key(5, _VARINT) + _varint(extent)
+    return _len_field(3, layer)
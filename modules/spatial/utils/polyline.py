@@ -0,0 +1,94 @@
+"""Route geometry helpers: Douglas-Peucker simplification and encoded polylines.
+
+Coordinates are GeoJSON ``[lon, lat]`` pairs, as OSRM returns them with
+``geometries=geojson``. Encoded polylines use the Google/OSRM format
+(``lat,lon`` order, precision 5 by default).
+"""
+
+import math
+
+import numpy as np
+
+
+def tolerance_for_zoom(zoom: int, pixels: float = 1.0) -> float:
+    """Degrees covered by ``pixels`` screen pixels of a 256 px web-mercator tile at ``zoom``."""
+    return pixels * 360.0 / (256 * 2 ** zoom)
+
+
+def simplify(coords, tolerance: float):
+    """
+    Douglas-Peucker simplification of ``[[lon, lat], ...]`` to ``tolerance``
+    degrees. Longitudes are scaled by cos(latitude) so the tolerance is the
+    same in both directions; the endpoints are always kept.
+    """
+    if len(coords) < 3 or tolerance <= 0:
+        return [list(c) for c in coords]
+    pts = np.asarray(coords, dtype=np.float64)
+    xy = pts.copy()
+    xy[:, 0] *= math.cos(math.radians(float(pts[:, 1].mean())))
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = xy[b] - xy[a]
+        rel = xy[a + 1:b] - xy[a]
+        seg_len = math.hypot(seg[0], seg[1])
+        if seg_len == 0.0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / seg_len
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            mid = a + 1 + i
+            keep[mid] = True
+            stack.append((a, mid))
+            stack.append((mid, b))
+    return pts[keep].tolist()
+
+
+def _encode_value(v: int, out: list):
+    v = ~(v << 1) if v < 0 else v << 1
+    while v >= 0x20:
+        out.append(chr((0x20 | (v & 0x1F)) + 63))
+        v >>= 5
+    out.append(chr(v + 63))
+
+
+def encode(coords, precision: int = 5) -> str:
+    """Encoded polyline of ``[[lon, lat], ...]``."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lon, lat in coords:
+        lat_i, lon_i = round(lat * factor), round(lon * factor)
+        _encode_value(lat_i - prev_lat, out)
+        _encode_value(lon_i - prev_lon, out)
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(out)
+
+
+def decode(text: str, precision: int = 5):
+    """``[[lon, lat], ...]`` from an encoded polyline."""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lon = 0
+    while index < len(text):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append([lon / factor, lat / factor])
+    return coords
@@ -1,4 +1,11 @@
-﻿import unicodedata
+﻿import re
+import unicodedata
+
+ADDRESS_STOPWORDS = {
+    'viet', 'nam', 'vietnam', 'thanh', 'pho', 'tp', 'ho', 'chi', 'minh',
+    'duong', 'street', 'road', 'hem', 'ngo', 'so', 'ap', 'xa', 'phuong',
+    'quan', 'huyen', 'city', 'ward', 'district',
+}
 
 
 def strip_accents(text: str) -> str:
@@ -7,3 +14,31 @@ def strip_accents(text: str) -> str:
     norm = unicodedata.normalize('NFD', text)
     norm = ''.join(ch for ch in norm if unicodedata.category(ch) != 'Mn')
     return unicodedata.normalize('NFC', norm)
+
+
+def norm_text(s: str) -> str:
+    s = strip_accents((s or '').lower())
+    s = re.sub(r'[^a-z0-9\s]', ' ', s)
+    s = re.sub(r'\s+', ' ', s).strip()
+    return s
+
+
+def address_tokens(s: str):
+    """Accent-folded address words, minus one-letter words and ADDRESS_STOPWORDS."""
+    return [w for w in norm_text(s).split() if len(w) > 1 and w not in ADDRESS_STOPWORDS]
+
+
+def score_geocode_candidate(query: str, display: str):
+    """Share of the query's address tokens found in ``display``, plus a bonus for matching numbers."""
+    q_tokens = set(address_tokens(query))
+    d_tokens = set(address_tokens(display))
+    if not q_tokens or not d_tokens:
+        return 0.0
+    inter = len(q_tokens & d_tokens)
+    score = inter / max(len(q_tokens), 1)
+
+    q_nums = set(re.findall(r'\d+', query or ''))
+    d_nums = set(re.findall(r'\d+', display or ''))
+    if q_nums and d_nums:
+        score += 0.15 * (len(q_nums & d_nums) / len(q_nums))
+    return score
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+TABLE = "gis_store_cuahang"
+INDEX = "gis_store_cuahang_geog_gist"
+
+
+def _has_postgis(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")
+        return cur.fetchone() is not None
+
+
+def add_geog(apps, schema_editor):
+    # The column is generated from vi_do/kinh_do, so every insert and update
+    # keeps it in sync without touching the model or the admin.
+    if not _has_postgis(schema_editor):
+        return
+    schema_editor.execute(
+        f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS geog geography(Point, 4326) "
+        f"GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(kinh_do, vi_do), 4326)::geography) STORED"
+    )
+    schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX} ON {TABLE} USING GIST (geog)")
+
+
+def drop_geog(apps, schema_editor):
+    if not _has_postgis(schema_editor):
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX}")
+    schema_editor.execute(f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS geog")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gis_store", "0012_alter_nhanvien_avatar_default_jpg"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_geog, drop_geog),
+    ]